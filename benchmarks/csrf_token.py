@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: csrf_token.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Benchmark of the CSRF token extraction done twice per login.
+
+Compares the full BeautifulSoup parse with the incremental scan on a page
+shaped like Strava's login page, reporting CPU time and bytes read.
+
+Run it with ``python benchmarks/csrf_token.py``.
+
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pystrava.csrf import CsrfTokenScanner, _parse_csrf_token  # noqa: E402
+
+CHUNK_SIZE = 8192
+
+HEAD = '''<!DOCTYPE html>
+<html class="logged-out" lang="en-US">
+<head>
+<meta charset="utf-8">
+<title>Log In | Strava</title>
+<meta content="width = device-width, initial-scale = 1" name="viewport">
+<meta name="csrf-param" content="authenticity_token" />
+<meta name="csrf-token" content="Zm9vYmFyYmF6cXV4Zm9vYmFyYmF6cXV4Zm9vYmFyYmF6cXV4Cg==" />
+''' + ''.join(f'<link href="https://assets.example.com/{index}.css" rel="stylesheet">\n'
+              for index in range(40)) + '</head>\n'
+
+BODY = '<body>' + ''.join(
+    f'<div class="row"><span id="item-{index}">Lorem ipsum dolor sit amet</span>'
+    f'<a href="/path/{index}">link</a></div>\n' for index in range(1500)) + '</body></html>'
+
+PAGE = (HEAD + BODY).encode('utf-8')
+
+
+def chunks(page):
+    return (page[start:start + CHUNK_SIZE] for start in range(0, len(page), CHUNK_SIZE))
+
+
+def scan(page):
+    scanner = CsrfTokenScanner()
+    bytes_read = 0
+    for chunk in chunks(page):
+        bytes_read += len(chunk)
+        if scanner.feed(chunk):
+            break
+    return scanner.token, bytes_read
+
+
+def main():
+    token, bytes_read = scan(PAGE)
+    assert token == _parse_csrf_token(PAGE.decode('utf-8'))
+    runs = 20
+    parse_time = timeit.timeit(lambda: _parse_csrf_token(PAGE.decode('utf-8')),
+                               number=runs) / runs
+    scan_time = timeit.timeit(lambda: scan(PAGE), number=runs * 100) / (runs * 100)
+    # a login extracts the token from two pages
+    print(f'page size:              {len(PAGE):>10} bytes')
+    print(f'full parse per login:   {2 * parse_time * 1000:>10.3f} ms CPU, '
+          f'{2 * len(PAGE):>8} bytes read')
+    print(f'scan per login:         {2 * scan_time * 1000:>10.3f} ms CPU, '
+          f'{2 * bytes_read:>8} bytes read')
+    print(f'speedup:                {parse_time / scan_time:>10.0f}x')
+
+
+if __name__ == '__main__':
+    main()
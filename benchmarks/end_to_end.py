@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: end_to_end.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+End to end benchmark of pystrava against a local stand-in for Strava.
+
+Starts the fake Strava server of the test suite, optionally with latency and
+errors injected, and reports the latency of the login flow, the requests per
+second going through the patched session, sequentially and from concurrent
+threads, and their p50 and p99 latencies. The server runs in the same
+process, so its CPU time is part of the numbers; compare runs on the same
+machine rather than reading them as absolute figures.
+
+Run it with ``python benchmarks/end_to_end.py``, ``--help`` lists the options.
+
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pystrava import StravaAuthenticator  # noqa: E402
+from tests.fakestrava import FakeStrava  # noqa: E402
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def timed(function):
+    started = time.perf_counter()
+    result = function()
+    return time.perf_counter() - started, result
+
+
+def login(**kwargs):
+    return StravaAuthenticator('1', 'secret', 'http://localhost.local/callback', 'read',
+                               'athlete@example.com', 'password', **kwargs)
+
+
+def report(name, latencies, elapsed, errors=0):
+    print(f'{name:<24} {len(latencies) / elapsed:>9.1f} /s   '
+          f'p50 {percentile(latencies, 0.5) * 1000:>8.2f} ms   '
+          f'p99 {percentile(latencies, 0.99) * 1000:>8.2f} ms   '
+          f'mean {statistics.mean(latencies) * 1000:>8.2f} ms   '
+          f'errors {errors}')
+
+
+def run_requests(authenticator, url, count, concurrency):
+    def fetch(_):
+        return timed(lambda: authenticator._session.get(url).status_code)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fetch, range(count)))
+    elapsed = time.perf_counter() - started
+    return ([latency for latency, _ in results], elapsed,
+            sum(1 for _, status in results if status >= 400))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--logins', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--page-latency', type=float, default=0,
+                        help='milliseconds added to the login pages')
+    parser.add_argument('--token-latency', type=float, default=0,
+                        help='milliseconds added to /oauth/token')
+    parser.add_argument('--api-latency', type=float, default=0,
+                        help='milliseconds added to the API endpoints')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of API requests answered with a 503')
+    args = parser.parse_args()
+
+    with FakeStrava(page_delay=args.page_latency / 1000,
+                    token_delay=args.token_latency / 1000,
+                    api_delay=args.api_latency / 1000,
+                    error_rate=args.error_rate, seed=0) as fake, \
+            mock.patch('pystrava.pystrava.SITE', fake.url):
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(args.logins):
+            latency, authenticator = timed(login)
+            latencies.append(latency)
+            authenticator.close()
+        report('auth flow', latencies, time.perf_counter() - started)
+
+        authenticator = login(pool_maxsize=args.concurrency)
+        url = f'{fake.url}/api/v3/athlete'
+        run_requests(authenticator, url, args.concurrency, args.concurrency)
+        report('requests, sequential',
+               *run_requests(authenticator, url, args.requests, 1))
+        report(f'requests, {args.concurrency} threads',
+               *run_requests(authenticator, url, args.requests, args.concurrency))
+        authenticator.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: import_time.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Benchmark of the time ``import pystrava`` takes.
+
+Runs ``python -X importtime`` in fresh interpreters for plain ``import
+pystrava`` and for the first use of its main classes, and reports the
+cumulative import time of pystrava and of its heavy dependencies.
+
+Run it with ``python benchmarks/import_time.py``.
+
+"""
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+SCENARIOS = [('import pystrava', 'import pystrava'),
+             ('token store only', 'from pystrava import FileTokenStore, Token'),
+             ('StravaAuthenticator', 'from pystrava import StravaAuthenticator'),
+             ('Strava client', 'import pystrava.client')]
+
+TRACKED = ('pystrava', 'requests', 'stravalib', 'bs4', 'aiohttp')
+
+RUNS = 5
+
+
+def import_times(statement):
+    """
+    Cumulative import time in microseconds of the top level modules
+
+    Args:
+        statement: python code to run
+
+    Returns: dictionary
+
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            cwd=ROOT, stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() in TRACKED:
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    print(f'{"scenario":<22}' + ''.join(f'{name:>12}' for name in TRACKED))
+    for label, statement in SCENARIOS:
+        runs = [import_times(statement) for _ in range(RUNS)]
+        best = {name: min(run.get(name, 0) for run in runs) for name in TRACKED}
+        print(f'{label:<22}' + ''.join(f'{best[name] / 1000:>10.1f}ms' if best[name]
+                                       else f'{"-":>12}' for name in TRACKED))
+
+
+if __name__ == '__main__':
+    main()
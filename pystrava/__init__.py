@@ -31,9 +31,47 @@ Import all parts from pystrava here
 .. _Google Python Style Guide:
    http://google.github.io/styleguide/pyguide.html
 """
+import importlib
 from ._version import __version__
+from . import constants
 from .constants import *
-from .pystrava import StravaAuthenticator, Strava
+from .tokenstore import TokenStore, MemoryTokenStore, FileTokenStore
+
+# Names imported on first use, since requests, stravalib and aiohttp are slow
+# to import and many users only need the constants or a token store.
+LAZY_IMPORTS = {'StravaAuthenticator': '.pystrava',
+                'Strava': '.pystrava',
+                'StravaClient': '.client',
+                'StravaAdapter': '.adapters',
+                'ResponseCache': '.cache',
+                'RetryPolicy': '.retry',
+                'RetryBudget': '.retry',
+                'CircuitBreaker': '.circuitbreaker',
+                'RequestCoalescer': '.coalescing',
+                'MetricsHook': '.metrics',
+                'CallbackMetrics': '.metrics',
+                'PrometheusMetrics': '.metrics',
+                'AuthProfiler': '.profiling',
+                'CircuitOpenError': '.pystravaexceptions',
+                'LockTimeoutError': '.pystravaexceptions',
+                'RateLimiter': '.ratelimit',
+                'SqliteStateStore': '.sharedstate',
+                'SharedRateLimiter': '.sharedstate',
+                'StravaPool': '.pool',
+                'FileCookieStore': '.cookiestore',
+                'ActivityStore': '.activitystore',
+                'WebhookReceiver': '.webhooks',
+                'WebhookSubscriptions': '.webhooks',
+                'EventDispatcher': '.webhooks',
+                'AsyncStravaAuthenticator': '.aio',
+                'AsyncStrava': '.aio'}
+
+# A star import looks the lazy names up through __getattr__, loading them
+__all__ = sorted([name for name, value in vars(constants).items()
+                  if not name.startswith('_') and
+                  getattr(value, '__module__', constants.__name__) == constants.__name__] +
+                 ['TokenStore', 'MemoryTokenStore', 'FileTokenStore'] +
+                 list(LAZY_IMPORTS))
 
 __author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
 __docformat__ = '''google'''
@@ -46,6 +84,20 @@ __status__ = '''Development'''  # "Prototype", "Development", "Production".
 
 # This is to 'use' the module(s), so lint doesn't complain
 assert __version__
-assert StravaAuthenticator
-assert Strava
+assert TokenStore
+assert MemoryTokenStore
+assert FileTokenStore
 assert constants
+
+
+def __getattr__(name):
+    module = LAZY_IMPORTS.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(LAZY_IMPORTS))
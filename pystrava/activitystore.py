@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: activitystore.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Local copy of athletes' activities for pystrava
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import calendar
+import json
+import logging
+import time
+from datetime import datetime
+from .sqlitedb import SqliteDatabase
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+# This is the main prefix used for logging
+LOGGER_BASENAME = '''pystrava'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS activities (
+    athlete_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    start_date INTEGER NOT NULL,
+    type TEXT,
+    name TEXT,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (athlete_id, id)
+);
+CREATE INDEX IF NOT EXISTS activities_by_start_date
+    ON activities (athlete_id, start_date);
+CREATE TABLE IF NOT EXISTS watermarks (
+    athlete_id INTEGER PRIMARY KEY,
+    start_date INTEGER NOT NULL,
+    synced_at REAL NOT NULL
+);
+'''
+
+
+def to_epoch(value):
+    """
+    Converts a datetime, a Strava date string or an epoch to an epoch
+
+    Args:
+        value: datetime, string like '2018-08-22T10:00:00Z' or integer
+
+    Returns: integer
+
+    """
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    if isinstance(value, str):
+        return calendar.timegm(time.strptime(value, '%Y-%m-%dT%H:%M:%SZ'))
+    return int(value)
+
+
+class ActivityStore(SqliteDatabase):
+    """
+    Activity summaries of several athletes kept in a SQLite file.
+
+    sync only asks Strava for the activities started after the newest one
+    already stored, the watermark, and reads are answered from the local
+    tables.
+
+    """
+
+    schema = SCHEMA
+
+    def watermark(self, athlete_id):
+        """
+        Start date of the newest activity synced for an athlete
+
+        Args:
+            athlete_id: integer
+
+        Returns: integer epoch or None if the athlete was never synced
+
+        """
+        row = self._connection().execute(
+            'SELECT start_date FROM watermarks WHERE athlete_id = ?',
+            (athlete_id,)).fetchone()
+        return row[0] if row else None
+
+    def upsert(self, athlete_id, activities):
+        """
+        Inserts activities or replaces the stored copies of them
+
+        Args:
+            athlete_id: integer
+            activities: iterable of activity dictionaries as returned by Strava
+
+        Returns: integer, number of activities written
+
+        """
+        rows = [(athlete_id, activity['id'], to_epoch(activity['start_date']),
+                 activity.get('type'), activity.get('name'), json.dumps(activity))
+                for activity in activities]
+        with self.transaction() as connection:
+            connection.executemany('INSERT OR REPLACE INTO activities '
+                                   'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def sync(self, client, athlete_id=None, lookback=0, chunk_size=200):
+        """
+        Fetches the activities started after the watermark and stores them.
+
+        Strava can only be asked for activities by start date, so edits to
+        older activities are only picked up within lookback seconds of the
+        watermark. The watermark is advanced once every activity is stored,
+        an interrupted sync starts over from the previous one.
+
+        Args:
+            client: StravaClient object of the athlete
+            athlete_id: integer, fetched from Strava when not given
+            lookback: integer, seconds before the watermark fetched again
+            chunk_size: integer, activities written per transaction
+
+        Returns: integer, number of activities written
+
+        """
+        if athlete_id is None:
+            athlete_id = client.get_athlete().id
+        watermark = self.watermark(athlete_id)
+        after = int(watermark - lookback) if watermark is not None else None
+        newest, written, chunk = watermark, 0, []
+        for activity in client.iter_activities(after=after, raw=True):
+            chunk.append(activity)
+            start_date = to_epoch(activity['start_date'])
+            newest = start_date if newest is None else max(newest, start_date)
+            if len(chunk) >= chunk_size:
+                written += self.upsert(athlete_id, chunk)
+                chunk = []
+        written += self.upsert(athlete_id, chunk)
+        if newest is not None:
+            with self.transaction() as connection:
+                connection.execute('INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)',
+                                   (athlete_id, newest, time.time()))
+        self._logger.info('Synced %s activities of athlete %s', written, athlete_id)
+        return written
+
+    def activities(self, athlete_id, before=None, after=None, activity_type=None,
+                   limit=None):
+        """
+        Reads stored activities, newest first
+
+        Args:
+            athlete_id: integer
+            before: datetime or epoch, only activities started before it
+            after: datetime or epoch, only activities started after it
+            activity_type: string like 'Run', only activities of that type
+            limit: integer, maximum number of activities
+
+        Returns: list of activity dictionaries
+
+        """
+        query = 'SELECT payload FROM activities WHERE athlete_id = ?'
+        arguments = [athlete_id]
+        if before is not None:
+            query += ' AND start_date < ?'
+            arguments.append(to_epoch(before))
+        if after is not None:
+            query += ' AND start_date > ?'
+            arguments.append(to_epoch(after))
+        if activity_type is not None:
+            query += ' AND type = ?'
+            arguments.append(activity_type)
+        query += ' ORDER BY start_date DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            arguments.append(limit)
+        return [json.loads(payload) for payload, in
+                self._connection().execute(query, arguments)]
+
+    def count(self, athlete_id):
+        """
+        Number of activities stored for an athlete
+
+        Args:
+            athlete_id: integer
+
+        Returns: integer
+
+        """
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM activities WHERE athlete_id = ?',
+            (athlete_id,)).fetchone()[0]
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: adapters.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Connection pooling for pystrava sessions
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import socket
+from requests.adapters import HTTPAdapter, DEFAULT_POOLBLOCK, DEFAULT_POOLSIZE
+from urllib3.connection import HTTPConnection
+from .constants import ConnectionPoolStats
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+class StravaAdapter(HTTPAdapter):
+    """
+    HTTPAdapter with tunable keep alive that reports the use of its pools.
+
+    """
+
+    __attrs__ = HTTPAdapter.__attrs__ + ['keep_alive', 'tcp_keepalive']
+
+    def __init__(self, pool_connections=DEFAULT_POOLSIZE, pool_maxsize=DEFAULT_POOLSIZE,
+                 pool_block=DEFAULT_POOLBLOCK, keep_alive=True, tcp_keepalive=False,
+                 **kwargs):
+        """
+        Initialises object.
+
+        Args:
+            pool_connections: integer, number of hosts to keep a pool for
+            pool_maxsize: integer, connections kept per host, it should be at
+                least the number of threads sharing the session
+            pool_block: boolean, wait for a free connection instead of opening
+                one that is discarded afterwards when the pool is full
+            keep_alive: boolean, reuse connections between requests
+            tcp_keepalive: boolean, send TCP keep alive probes so idle pooled
+                connections are not dropped by NATs and load balancers
+            **kwargs: extra options passed to HTTPAdapter
+        """
+        self.keep_alive = keep_alive
+        self.tcp_keepalive = tcp_keepalive
+        super().__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                         pool_block=pool_block, **kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=DEFAULT_POOLBLOCK,
+                         **pool_kwargs):
+        if self.tcp_keepalive:
+            pool_kwargs.setdefault('socket_options', self._keepalive_socket_options())
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+
+    @staticmethod
+    def _keepalive_socket_options():
+        options = list(HTTPConnection.default_socket_options)
+        options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        for name, value in (('TCP_KEEPIDLE', 60), ('TCP_KEEPINTVL', 20), ('TCP_KEEPCNT', 3)):
+            if hasattr(socket, name):
+                options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+        return options
+
+    def add_headers(self, request, **kwargs):
+        if not self.keep_alive:
+            request.headers['Connection'] = 'close'
+
+    def stats(self):
+        """
+        Use of the connection pool of every host
+
+        Returns: list of ConnectionPoolStats namedtuples
+
+        """
+        pools = self.poolmanager.pools
+        stats = []
+        for key in pools.keys():
+            try:
+                pool = pools[key]
+            except KeyError:
+                continue
+            idle = sum(1 for connection in list(pool.pool.queue) if connection is not None)
+            stats.append(ConnectionPoolStats(f'{pool.scheme}://{pool.host}:{pool.port}',
+                                             pool.num_connections,
+                                             pool.num_requests,
+                                             idle,
+                                             pool.pool.maxsize - pool.pool.qsize(),
+                                             pool.pool.maxsize))
+        return stats
@@ -0,0 +1,612 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: aio.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+asyncio flavour of pystrava, built on top of aiohttp
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qsl, urlparse
+from .constants import (User, BatchResult, HEADERS, SITE, INVALID_TOKEN_MSG,
+                        TOKEN_REFRESH_MARGIN)
+from .csrf import CsrfTokenScanner, find_csrf_token
+from .pystrava import StravaAuthenticator
+from .ratelimit import RateLimiter
+from .tokenstore import token_key
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+# This is the main prefix used for logging
+LOGGER_BASENAME = '''pystrava'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+
+class AsyncStravaAuthenticator:
+    """
+    Non blocking counterpart of StravaAuthenticator.
+
+    It runs the same login, accept application and token exchange steps and
+    refreshes the token before it expires or once Strava rejects it.
+
+    """
+
+    def __init__(self, client_id, client_secret, callback, scope, email, password,
+                 token_store=None, refresh_margin=TOKEN_REFRESH_MARGIN,
+                 connector=None, rate_limiter=None):
+        """
+        Initialises object.
+
+        Args:
+            client_id: string
+            client_secret: string
+            callback: string
+            scope: comma separated string
+            email: string
+            password: string
+            token_store: TokenStore object to persist tokens across restarts
+            refresh_margin: seconds before expiry in which the token is
+                refreshed ahead of the next request
+            connector: aiohttp connector to share one connection pool between
+                several authenticators
+            rate_limiter: RateLimiter object pacing the API requests, by
+                default the budget is only tracked
+        """
+        if aiohttp is None:
+            raise ImportError('aiohttp is required for asyncio support, '
+                              'install it with "pip install pystrava[async]"')
+        self._logger = logging.getLogger('{base}.{suffix}'
+                                         .format(base=LOGGER_BASENAME,
+                                                 suffix=self.__class__.__name__)
+                                         )
+        self.user = User(client_id, client_secret, email, password)
+        self._token = None
+        self._scope = scope
+        self._callback = callback
+        self._token_store = token_store
+        self._refresh_margin = refresh_margin
+        self._connector = connector
+        self.rate_limiter = rate_limiter or RateLimiter(pace=False)
+        self._session = None
+        self._refresh_lock = None
+        self._store_executor = None
+
+    @property
+    def session(self):
+        """
+        aiohttp session, with its own cookie jar for the login flow
+
+        Returns: ClientSession object
+
+        """
+        if self._session is None:
+            self._session = aiohttp.ClientSession(headers=HEADERS,
+                                                  connector=self._connector,
+                                                  connector_owner=self._connector is None)
+        return self._session
+
+    @property
+    def token(self):
+        """
+        Token namedtuple
+
+        Returns: namedtuple
+
+        """
+        return self._token
+
+    async def authenticate(self):
+        """
+        Initiate authentication flow to get token credentials
+
+        A token kept in the token store is used when it is still valid or can
+        be refreshed, otherwise the whole login flow is performed.
+
+        Returns: Token namedtuple
+
+        """
+        self._token = await self._load_stored_token()
+        if not self._token:
+            csrf_token = await self._login_session()
+            location = await self._accept_application(csrf_token)
+            self._token = await self._exchange_token(location)
+            await self._store_token()
+        return self._token
+
+    async def _load_stored_token(self):
+        if not self._token_store:
+            return None
+        async with self._token_store_lock():
+            token = await self._run_in_store(self._token_store.load, token_key(self.user))
+            if not token:
+                return None
+            if not self._is_expiring(token):
+                self._logger.info('Using stored token')
+                return token
+            self._logger.info('Stored token is expired, trying to refresh it')
+            try:
+                token = await self._renew_token(token)
+            except (ValueError, aiohttp.ClientError):
+                self._logger.warning('Unable to refresh stored token, logging in')
+                return None
+            self._token = token
+            await self._store_token()
+            return token
+
+    async def _run_in_store(self, function, *args):
+        """
+        Runs a blocking token store call without blocking the event loop
+
+        Calls run one at a time on a thread of their own, so a store lock is
+        released by the thread that acquired it.
+
+        Args:
+            function: callable
+            *args: arguments for function
+
+        Returns: the result of function
+
+        """
+        if self._store_executor is None:
+            self._store_executor = ThreadPoolExecutor(max_workers=1,
+                                                      thread_name_prefix='pystrava-store')
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._store_executor, function, *args)
+
+    @asynccontextmanager
+    async def _token_store_lock(self):
+        """
+        Holds the token store lock, if there is a store, while refreshing
+
+        Returns: async context manager
+
+        """
+        if not self._token_store:
+            yield
+            return
+        lock = self._token_store.lock(token_key(self.user))
+        await self._run_in_store(lock.__enter__)
+        try:
+            yield
+        finally:
+            await self._run_in_store(lock.__exit__, None, None, None)
+
+    async def _store_token(self):
+        if self._token_store:
+            await self._run_in_store(self._token_store.save, token_key(self.user),
+                                     self._token)
+
+    def _is_expiring(self, token):
+        return token.expires_at - self._refresh_margin <= time.time()
+
+    def _url_params(self):
+        return {'client_id': self.user.client_id,
+                'redirect_uri': self._callback,
+                'approval_prompt': 'auto',
+                'response_type': 'code',
+                'scope': self._scope}
+
+    async def _login_session(self):
+        """
+        Login to Strava with the CSRF token of the login page
+
+        Returns: string, CSRF token of the page Strava redirects to
+
+        """
+        login_url = f'{SITE}/login'
+        async with self.session.get(login_url) as response:
+            csrf_token = await self._read_csrf_token(response)
+        login_form = {
+            'authenticity_token': csrf_token,
+            'email': self.user.email,
+            'password': self.user.password,
+            'utf8': '✓'}
+        self._logger.info("Logging in")
+        async with self.session.post(f'{SITE}/session',
+                                     data=login_form,
+                                     headers={'Referer': login_url}) as response:
+            return await self._read_csrf_token(response)
+
+    @staticmethod
+    async def _read_csrf_token(response):
+        """
+        Gets the CSRF value reading the page only until it shows up
+
+        Args:
+            response: ClientResponse object
+
+        Returns: string
+
+        """
+        scanner = CsrfTokenScanner()
+        async for chunk in response.content.iter_chunked(8192):
+            if scanner.feed(chunk):
+                break
+        if scanner.token:
+            return scanner.token
+        return find_csrf_token(scanner.buffer + await response.content.read())
+
+    async def _accept_application(self, csrf_token):
+        """
+        Accepts application to use Strava's API.
+
+        Args:
+            csrf_token: string, CSRF token of the logged in page
+
+        Returns: string, location Strava redirects to with the code
+
+        """
+        auth_form = {'authenticity_token': csrf_token}
+        auth_form.update(StravaAuthenticator._generate_auth_scope(self._scope))
+        self._logger.info("Accepting application")
+        async with self.session.post(f'{SITE}/oauth/accept_application',
+                                     params=self._url_params(),
+                                     data=auth_form,
+                                     allow_redirects=False) as response:
+            location = response.headers.get('location')
+        if not location:
+            raise ValueError('Application was not accepted, got status '
+                             f'{response.status}')
+        return location
+
+    async def _exchange_token(self, location_url):
+        code = dict(parse_qsl(urlparse(location_url).query)).get('code')
+        payload = {'code': code,
+                   'grant_type': 'authorization_code',
+                   'client_id': self.user.client_id,
+                   'client_secret': self.user.client_secret}
+        self._logger.info("Getting access token from code")
+        return await self._retrieve_token(payload)
+
+    async def _retrieve_token(self, payload):
+        async with self.session.post(f'{SITE}/oauth/token', data=payload) as response:
+            tokens = await response.json(content_type=None)
+        return StravaAuthenticator._parse_token(tokens, payload)
+
+    async def _renew_token(self, token):
+        payload = StravaAuthenticator._renew_payload(self.user, token)
+        return await self._retrieve_token(payload)
+
+    async def _refresh_token(self, stale_token):
+        """
+        Renews the token once for all the coroutines that found it stale
+
+        The token another process stored meanwhile is used instead of
+        renewing, as the blocking authenticator does.
+
+        Args:
+            stale_token: Token namedtuple the caller found to be expired
+
+        Returns: Token namedtuple
+
+        """
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock, self._token_store_lock():
+            if self._token.access_token != stale_token.access_token:
+                return self._token
+            stored = await self._run_in_store(self._token_store.load, token_key(self.user)) \
+                if self._token_store else None
+            if stored and stored.access_token != self._token.access_token \
+                    and not self._is_expiring(stored):
+                self._logger.info('Using token refreshed by another process')
+                self._token = stored
+                return self._token
+            self._logger.info('Refreshing token')
+            self._token = await self._renew_token(self._token)
+            await self._store_token()
+            return self._token
+
+    async def request(self, method, url, **kwargs):
+        """
+        Performs a request with the current token, refreshing it if needed.
+
+        The body is read before returning, so the response can be decoded
+        after the connection went back to the pool.
+
+        Args:
+            method: HTTP verb
+            url: URL to request
+            **kwargs: extra kwargs passed to aiohttp
+
+        Returns: ClientResponse object
+
+        """
+        token = self._token
+        if self._is_expiring(token):
+            token = await self._refresh_token(token)
+        response = await self._send(method, url, token, **kwargs)
+        if response.status == 401 and \
+                await response.json(content_type=None) == INVALID_TOKEN_MSG:
+            self._logger.warning('Expired token detected, trying to refresh!')
+            token = await self._refresh_token(token)
+            response = await self._send(method, url, token, **kwargs)
+        return response
+
+    async def _send(self, method, url, token, **kwargs):
+        headers = dict(kwargs.pop('headers', None) or {})
+        headers.update({'Authorization': f'Bearer {token.access_token}'})
+        await self._acquire()
+        async with self.session.request(method, url, headers=headers,
+                                        **kwargs) as response:
+            await response.read()
+        await self._run_blocking(self.rate_limiter.update, response.headers)
+        if response.status == 429:
+            self._logger.warning('Rate limit exceeded')
+            await self._run_blocking(self.rate_limiter.exhaust)
+        return response
+
+    @staticmethod
+    async def _run_blocking(function, *args):
+        """
+        Runs a call that may block, like a rate limiter shared through SQLite,
+        on the default executor instead of the event loop
+
+        Args:
+            function: callable
+            *args: arguments for function
+
+        Returns: the result of function
+
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, function, *args)
+
+    async def _acquire(self):
+        """
+        Takes one request from the rate limit budget without blocking the loop
+
+        Returns: float, seconds waited
+
+        """
+        waited = 0
+        while True:
+            delay = await self._run_blocking(self.rate_limiter.reserve)
+            if not delay:
+                return waited
+            self._logger.debug('Pacing request for %.2f seconds', delay)
+            await asyncio.sleep(delay)
+            waited += delay
+
+    async def wait_for_budget(self):
+        """
+        Waits until neither rate limit window is used up, even when not pacing
+
+        Returns: float, seconds waited
+
+        """
+        waited = 0
+        while True:
+            exhausted_for = await self._run_blocking(self.rate_limiter.exhausted_for)
+            if not exhausted_for:
+                return waited
+            self._logger.info('Rate limit budget used up, waiting %.0f seconds',
+                              exhausted_for)
+            await asyncio.sleep(exhausted_for)
+            waited += exhausted_for
+
+    async def close(self):
+        """
+        Closes the aiohttp session. A shared connector is left open.
+
+        Returns: None
+
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._store_executor is not None:
+            self._store_executor.shutdown(wait=False)
+            self._store_executor = None
+
+
+class AsyncStrava:
+    """
+    Minimal asyncio Strava API client.
+
+    stravalib is blocking, so this client returns the decoded JSON of the
+    endpoints instead of stravalib models.
+
+    """
+
+    def __init__(self, authenticator):
+        """
+        Initialises object.
+
+        Args:
+            authenticator: authenticated AsyncStravaAuthenticator object
+        """
+        self.authenticator = authenticator
+
+    @classmethod
+    async def login(cls, client_id, client_secret, callback, scope, email, password,
+                    **kwargs):
+        """
+        Authenticates and returns a ready client.
+
+        Args:
+            client_id: string
+            client_secret: string
+            callback: string
+            scope: comma separated string
+            email: string
+            password: string
+            **kwargs: extra options passed to AsyncStravaAuthenticator
+
+        Returns: AsyncStrava object
+
+        """
+        authenticator = AsyncStravaAuthenticator(client_id,
+                                                 client_secret,
+                                                 callback,
+                                                 scope,
+                                                 email,
+                                                 password,
+                                                 **kwargs)
+        try:
+            await authenticator.authenticate()
+        except Exception:
+            await authenticator.close()
+            raise
+        return cls(authenticator)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+    async def close(self):
+        await self.authenticator.close()
+
+    @property
+    def rate_limit(self):
+        """
+        Current Strava API budget
+
+        Returns: RateLimitState namedtuple
+
+        """
+        return self.authenticator.rate_limiter.state
+
+    async def _get(self, path, **params):
+        params = {key: value for key, value in params.items() if value is not None}
+        response = await self.authenticator.request('GET', f'{SITE}/api/v3{path}',
+                                                    params=params)
+        response.raise_for_status()
+        return await response.json()
+
+    async def batch(self, function, items, concurrency=32):
+        """
+        Awaits a client method for many items concurrently
+
+        Calls wait while the rate limit budget is used up, like the blocking
+        batch does.
+
+        Args:
+            function: coroutine function taking one item, or the name of a
+                method of the client like 'get_activity'
+            items: iterable of arguments for function
+            concurrency: integer, calls running at the same time
+
+        Returns: list of BatchResult namedtuples in the order of items
+
+        """
+        if isinstance(function, str):
+            function = getattr(self, function)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call(item):
+            async with semaphore:
+                await self.authenticator.wait_for_budget()
+                try:
+                    return BatchResult(item, await function(item), None)
+                except Exception as error:  # pylint: disable=broad-except
+                    return BatchResult(item, None, error)
+
+        return await asyncio.gather(*[call(item) for item in items])
+
+    async def get_athlete(self):
+        """
+        Currently authenticated athlete
+
+        Returns: dictionary
+
+        """
+        return await self._get('/athlete')
+
+    async def get_activities(self, before=None, after=None, page=None, per_page=None):
+        """
+        Page of activities of the authenticated athlete
+
+        Args:
+            before: epoch timestamp
+            after: epoch timestamp
+            page: integer
+            per_page: integer
+
+        Returns: list of dictionaries
+
+        """
+        return await self._get('/athlete/activities', before=before, after=after,
+                               page=page, per_page=per_page)
+
+    async def get_activity(self, activity_id):
+        """
+        Detailed activity
+
+        Args:
+            activity_id: integer
+
+        Returns: dictionary
+
+        """
+        return await self._get(f'/activities/{activity_id}')
+
+    async def get_gear(self, gear_id):
+        """
+        Gear of the authenticated athlete
+
+        Args:
+            gear_id: string
+
+        Returns: dictionary
+
+        """
+        return await self._get(f'/gear/{gear_id}')
+
+    async def get_club(self, club_id):
+        """
+        Club details
+
+        Args:
+            club_id: integer
+
+        Returns: dictionary
+
+        """
+        return await self._get(f'/clubs/{club_id}')
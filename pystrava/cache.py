@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: cache.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+HTTP response cache for pystrava sessions
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import copy
+import logging
+import re
+import time
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from urllib.parse import urlparse
+from .constants import CacheStats, CACHE_TTLS
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+# This is the main prefix used for logging
+LOGGER_BASENAME = '''pystrava'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+API_PREFIX = '/api/v3'
+
+# Rough size of a cached response besides its body
+ENTRY_OVERHEAD = 512
+
+CacheEntry = namedtuple('CacheEntry', ['response', 'stored_at', 'ttl', 'size'])
+
+
+def compile_templates(templates):
+    """
+    Compiles endpoint templates such as '/activities/{id}' into regexes
+
+    Args:
+        templates: iterable of strings
+
+    Returns: list of (template, regex) tuples
+
+    """
+    compiled = []
+    for template in templates:
+        pattern = re.sub(r'\\{[^/]+\\}', '[^/]+', re.escape(template))
+        compiled.append((template, re.compile(f'{pattern}/?$')))
+    return compiled
+
+
+def endpoint_path(url):
+    """
+    Path of an API URL relative to the API root
+
+    Args:
+        url: string
+
+    Returns: string
+
+    """
+    path = urlparse(url).path
+    return path[len(API_PREFIX):] if path.startswith(API_PREFIX) else path
+
+
+def match_template(url, templates):
+    """
+    Finds the endpoint template an URL belongs to
+
+    Args:
+        url: string
+        templates: list of (template, regex) tuples from compile_templates
+
+    Returns: string or None
+
+    """
+    path = endpoint_path(url)
+    for template, regex in templates:
+        if regex.match(path):
+            return template
+    return None
+
+
+class ResponseCache:
+    """
+    LRU cache of GET responses bounded in bytes.
+
+    Responses are served from memory for the time to live of their endpoint.
+    Past it, or for endpoints without one, responses carrying an ETag or a
+    Last-Modified header are revalidated with a conditional request, a 304
+    answer reusing the cached body.
+
+    """
+
+    def __init__(self, ttls=None, max_bytes=16 * 1024 * 1024):
+        """
+        Initialises object.
+
+        Args:
+            ttls: dictionary of endpoint templates to seconds, like
+                {'/activities/{id}': 300}, defaults to CACHE_TTLS
+            max_bytes: integer, memory the cached responses may use
+        """
+        self._logger = logging.getLogger('{base}.{suffix}'
+                                         .format(base=LOGGER_BASENAME,
+                                                 suffix=self.__class__.__name__)
+                                         )
+        self.ttls = dict(CACHE_TTLS if ttls is None else ttls)
+        self._templates = compile_templates(self.ttls)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._size = 0
+        self._hits = 0
+        self._revalidations = 0
+        self._misses = 0
+        self._bytes_saved = 0
+
+    @staticmethod
+    def key(namespace, url, params):
+        """
+        Key of a request in the cache
+
+        Args:
+            namespace: string isolating the responses of an athlete
+            url: string
+            params: dictionary or None
+
+        Returns: tuple
+
+        """
+        params = tuple(sorted((str(name), str(value))
+                              for name, value in (params or {}).items()
+                              if name != 'access_token'))
+        return namespace, url, params
+
+    def ttl(self, url):
+        """
+        Time to live of the responses of an URL
+
+        Args:
+            url: string
+
+        Returns: seconds
+
+        """
+        template = match_template(url, self._templates)
+        return self.ttls[template] if template else 0
+
+    def lookup(self, key):
+        """
+        Looks up a request
+
+        Args:
+            key: tuple from key
+
+        Returns: tuple of a fresh cached response, or None, and the headers
+            to revalidate a stale one
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, {}
+            self._entries.move_to_end(key)
+            if time.time() - entry.stored_at < entry.ttl:
+                self._hits += 1
+                self._bytes_saved += len(entry.response.content)
+                return copy.copy(entry.response), {}
+        headers = {}
+        if entry.response.headers.get('ETag'):
+            headers['If-None-Match'] = entry.response.headers['ETag']
+        if entry.response.headers.get('Last-Modified'):
+            headers['If-Modified-Since'] = entry.response.headers['Last-Modified']
+        return None, headers
+
+    def store(self, key, response):
+        """
+        Caches a response, or answers a 304 with the cached one
+
+        Args:
+            key: tuple from key
+            response: Response object
+
+        Returns: Response object to hand to the caller, or None for a 304
+            whose entry was evicted meanwhile, the request has to be sent
+            again without the conditional headers
+
+        """
+        url = key[1]
+        if response.status_code == 304:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._revalidations += 1
+                    self._bytes_saved += len(entry.response.content)
+                    self._entries[key] = entry._replace(stored_at=time.time())
+                    return copy.copy(entry.response)
+            response.close()
+            return None
+        with self._lock:
+            self._misses += 1
+        if response.status_code != 200 or \
+                'no-store' in response.headers.get('Cache-Control', ''):
+            return response
+        ttl = self.ttl(url)
+        if not ttl and not (response.headers.get('ETag') or
+                            response.headers.get('Last-Modified')):
+            return response
+        size = len(response.content) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return response
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = CacheEntry(copy.copy(response), time.time(), ttl, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return response
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._size -= entry.size
+
+    def invalidate(self, namespace=None, url=None):
+        """
+        Drops the cached responses, of a namespace or all of them
+
+        Args:
+            namespace: string
+            url: string, only the responses of this URL, whatever their params
+
+        Returns: None
+
+        """
+        with self._lock:
+            for key in [key for key in self._entries
+                        if (namespace is None or key[0] == namespace) and
+                        (url is None or key[1] == url)]:
+                self._remove(key)
+
+    @property
+    def stats(self):
+        """
+        Hits, revalidations, misses and bytes saved by the cache
+
+        Returns: CacheStats namedtuple
+
+        """
+        with self._lock:
+            lookups = self._hits + self._revalidations + self._misses
+            hit_ratio = (self._hits + self._revalidations) / lookups if lookups else 0.0
+            return CacheStats(self._hits, self._revalidations, self._misses, hit_ratio,
+                              self._bytes_saved, self._size, len(self._entries))
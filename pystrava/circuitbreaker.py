@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: circuitbreaker.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Circuit breaker for pystrava sessions
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import logging
+import time
+from collections import deque
+from threading import Lock
+from .constants import CircuitBreakerStats
+from .pystravaexceptions import CircuitOpenError
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+# This is the main prefix used for logging
+LOGGER_BASENAME = '''pystrava'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to Strava while it is failing or too slow.
+
+    The outcome of the last window calls is kept. Once at least min_calls
+    were made and the rate of failures or of slow calls reaches its threshold,
+    the circuit opens and requests fail fast with CircuitOpenError. After
+    open_timeout seconds it goes half open and lets half_open_calls trial
+    requests through: it closes again if they all succeed and reopens on the
+    first failure.
+
+    """
+
+    def __init__(self, failure_rate=0.5, slow_call_duration=None, slow_call_rate=0.5,
+                 window=20, min_calls=10, open_timeout=30, half_open_calls=1):
+        """
+        Initialises object.
+
+        Args:
+            failure_rate: float, rate of failed calls opening the circuit
+            slow_call_duration: seconds after which a call counts as slow,
+                None to ignore latency
+            slow_call_rate: float, rate of slow calls opening the circuit
+            window: integer, number of recent calls considered
+            min_calls: integer, calls needed before the rates are considered
+            open_timeout: seconds the circuit stays open
+            half_open_calls: integer, trial requests while half open
+        """
+        self._logger = logging.getLogger('{base}.{suffix}'
+                                         .format(base=LOGGER_BASENAME,
+                                                 suffix=self.__class__.__name__)
+                                         )
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.min_calls = min_calls
+        self.open_timeout = open_timeout
+        self.half_open_calls = half_open_calls
+        self._calls = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = None
+        self._trials = 0
+        self._rejected = 0
+        self._transitions = 0
+        self._listeners = []
+        self._lock = Lock()
+
+    def add_listener(self, listener):
+        """
+        Registers a callable notified of every state transition
+
+        Args:
+            listener: callable receiving the old and the new state
+
+        Returns: None
+
+        """
+        self._listeners.append(listener)
+
+    def _transition(self, state):
+        """
+        Changes the state. Must hold the lock.
+
+        Returns: tuple of old and new state
+
+        """
+        old_state, self._state = self._state, state
+        self._transitions += 1
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state in (CLOSED, HALF_OPEN):
+            self._calls.clear()
+            self._trials = 0
+        self._logger.warning('Circuit breaker went from %s to %s', old_state, state)
+        return old_state, state
+
+    def _notify(self, transition):
+        if transition:
+            for listener in self._listeners:
+                listener(*transition)
+
+    def before_call(self):
+        """
+        Lets a call through or rejects it
+
+        Raises: CircuitOpenError if the call is not allowed
+
+        Returns: None
+
+        """
+        transition = None
+        with self._lock:
+            if self._state == OPEN and \
+                    time.monotonic() - self._opened_at >= self.open_timeout:
+                transition = self._transition(HALF_OPEN)
+            allowed = self._state == CLOSED or \
+                (self._state == HALF_OPEN and self._trials < self.half_open_calls)
+            if allowed and self._state == HALF_OPEN:
+                self._trials += 1
+            if not allowed:
+                self._rejected += 1
+        self._notify(transition)
+        if not allowed:
+            raise CircuitOpenError(f'Circuit breaker is {self._state}, '
+                                   'not sending request to Strava')
+
+    def record(self, success, duration):
+        """
+        Records the outcome of a call let through
+
+        Args:
+            success: boolean
+            duration: seconds the call took
+
+        Returns: None
+
+        """
+        slow = self.slow_call_duration is not None and duration >= self.slow_call_duration
+        transition = None
+        with self._lock:
+            if self._state == HALF_OPEN:
+                if not success or slow:
+                    transition = self._transition(OPEN)
+                else:
+                    self._calls.append((success, slow))
+                    if len(self._calls) >= self.half_open_calls:
+                        transition = self._transition(CLOSED)
+            elif self._state == CLOSED:
+                self._calls.append((success, slow))
+                if self._should_open():
+                    transition = self._transition(OPEN)
+        self._notify(transition)
+
+    def _should_open(self):
+        calls = len(self._calls)
+        if calls < self.min_calls:
+            return False
+        failures = sum(1 for success, _ in self._calls if not success)
+        slow_calls = sum(1 for _, slow in self._calls if slow)
+        return failures / calls >= self.failure_rate or \
+            (self.slow_call_duration is not None and
+             slow_calls / calls >= self.slow_call_rate)
+
+    @property
+    def state(self):
+        """
+        Current state, one of closed, open or half_open
+
+        Returns: string
+
+        """
+        with self._lock:
+            if self._state == OPEN and \
+                    time.monotonic() - self._opened_at >= self.open_timeout:
+                return HALF_OPEN
+            return self._state
+
+    @property
+    def stats(self):
+        """
+        State and recent outcomes of the circuit breaker
+
+        Returns: CircuitBreakerStats namedtuple
+
+        """
+        state = self.state
+        with self._lock:
+            calls = len(self._calls)
+            failures = sum(1 for success, _ in self._calls if not success)
+            slow_calls = sum(1 for _, slow in self._calls if slow)
+            return CircuitBreakerStats(state, calls,
+                                       failures / calls if calls else 0.0,
+                                       slow_calls / calls if calls else 0.0,
+                                       self._rejected, self._transitions)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: client.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+stravalib client bound to pystrava's authenticated session
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from stravalib import Client as OriginalStrava
+from stravalib import model
+from .constants import BatchResult
+from .pagination import prefetch_pages, fetch_all_pages, split_window, fetch_slices
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+class StravaClient(OriginalStrava):
+    """
+    stravalib client using the session of a StravaAuthenticator.
+
+    """
+
+    def __init__(self, authenticator, **kwargs):
+        """
+        Initialises object.
+
+        Args:
+            authenticator: StravaAuthenticator object
+            **kwargs: extra options passed to stravalib's client
+        """
+        # a lazy authenticator may not have a token yet, requests get the
+        # token of the session anyway
+        token = authenticator.token
+        super().__init__(access_token=token.access_token if token else None,
+                         requests_session=authenticator._session,
+                         **kwargs)
+        self.authenticator = authenticator
+
+    @property
+    def rate_limit(self):
+        """
+        Current API budget of the session
+
+        Returns: RateLimitState namedtuple
+
+        """
+        return self.authenticator.rate_limiter.state
+
+    def batch(self, function, items, max_workers=8):
+        """
+        Calls a client method for many items in parallel.
+
+        Calls wait while the rate limit budget is used up, so a large batch
+        does not run into 429 responses. A failing item does not affect the
+        others, its exception is returned in its result.
+
+        Args:
+            function: callable taking one item, or the name of a method of
+                the client like 'get_activity'
+            items: iterable of arguments for function
+            max_workers: integer, calls running at the same time
+
+        Returns: list of BatchResult namedtuples in the order of items
+
+        """
+        if isinstance(function, str):
+            function = getattr(self, function)
+        limiter = self.authenticator.rate_limiter
+
+        def call(item):
+            limiter.wait_for_budget()
+            try:
+                return BatchResult(item, function(item), None)
+            except Exception as error:  # pylint: disable=broad-except
+                return BatchResult(item, None, error)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(call, items))
+
+    def iter_activities(self, before=None, after=None, limit=None, prefetch=2,
+                        slices=1, per_page=200, raw=False):
+        """
+        Lists the activities of the athlete fetching pages concurrently.
+
+        Unlike get_activities, the next prefetch pages are requested while
+        the current one is consumed. With slices and both before and after,
+        the window is split in that many slices fetched in parallel instead,
+        each of them sorted newest first.
+
+        Args:
+            before: datetime, string or epoch, only activities started before it
+            after: datetime, string or epoch, only activities started after it
+            limit: integer, maximum number of activities
+            prefetch: integer, pages fetched ahead of the one being consumed
+            slices: integer, parallel slices of a bounded window
+            per_page: integer, activities per page, at most 200
+            raw: boolean, yields the JSON dictionaries instead of models
+
+        Returns: generator of stravalib SummaryActivity objects or dictionaries
+
+        """
+        before, after = (bound if bound is None
+                         else int(bound) if isinstance(bound, (int, float))
+                         else self._utc_datetime_to_epoch(bound)
+                         for bound in (before, after))
+
+        def fetch(page, **window):
+            return self.protocol.get('/athlete/activities', check_for_errors=True,
+                                     page=page, per_page=per_page, **window)
+
+        if slices > 1:
+            if before is None or after is None:
+                raise ValueError('Slicing needs both a before and an after bound')
+
+            def fetch_slice(window):
+                results = fetch_all_pages(functools.partial(fetch, after=window[0],
+                                                            before=window[1]),
+                                          per_page)
+                return sorted(results, key=lambda item: item.get('start_date') or '',
+                              reverse=True)
+
+            pages = fetch_slices(fetch_slice, split_window(after, before, slices), slices)
+        else:
+            pages = prefetch_pages(functools.partial(fetch, after=after, before=before),
+                                   per_page, prefetch)
+        activities = (item for page in pages for item in page)
+        if not raw:
+            activities = (self._activity_model(item) for item in activities)
+        return islice(activities, limit)
+
+    def _activity_model(self, item):
+        """
+        Builds the stravalib model of an activity listed by Strava
+
+        Args:
+            item: dictionary, JSON of the activity
+
+        Returns: stravalib Activity object
+
+        """
+        if hasattr(model, 'Activity'):
+            return model.Activity.deserialize(item, bind_client=self)
+        # stravalib 1.0 and later replaced the models with pydantic ones
+        return model.SummaryActivity.model_validate({**item, 'bound_client': self})
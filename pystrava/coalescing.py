@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: coalescing.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Coalescing of identical in flight requests for pystrava sessions
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import copy
+from threading import Event, Lock
+from .constants import CoalescingStats
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+class _InFlight:
+    """A request being sent, waited on by the identical ones."""
+
+    def __init__(self):
+        self.done = Event()
+        self.response = None
+        self.error = None
+
+
+class RequestCoalescer:
+    """
+    Shares one round trip between identical concurrent GET requests.
+
+    The first request for a key is sent, the ones arriving while it is in
+    flight wait for it and get a copy of its response, or its exception.
+
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self._lock = Lock()
+        self._requests = 0
+        self._coalesced = 0
+
+    @staticmethod
+    def key(namespace, url, params):
+        """
+        Key of a request, requests with the same key are coalesced
+
+        Args:
+            namespace: string, usually the athlete and access token
+            url: string
+            params: dictionary or None
+
+        Returns: tuple
+
+        """
+        return namespace, url, tuple(sorted((str(name), str(value))
+                                            for name, value in (params or {}).items()))
+
+    def request(self, key, send):
+        """
+        Sends a request or waits for the identical one in flight
+
+        Args:
+            key: tuple from key
+            send: callable sending the request and returning its response
+
+        Returns: Response object
+
+        """
+        with self._lock:
+            self._requests += 1
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = self._in_flight[key] = _InFlight()
+            else:
+                self._coalesced += 1
+        if not leader:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return copy.copy(in_flight.response)
+        try:
+            in_flight.response = send()
+            return in_flight.response
+        except BaseException as error:
+            in_flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+
+    @property
+    def stats(self):
+        """
+        Requests seen and how many of them shared another one's round trip
+
+        Returns: CoalescingStats namedtuple
+
+        """
+        with self._lock:
+            return CoalescingStats(self._requests, self._coalesced, len(self._in_flight))
@@ -45,7 +45,133 @@ Token = namedtuple('Token', ['access_token',
                              'expires_in',
                              'refresh_token'])
 
+PoolStats = namedtuple('PoolStats', ['hits',
+                                     'misses',
+                                     'evictions',
+                                     'size'])
+
+RateLimitState = namedtuple('RateLimitState', ['short_limit',
+                                               'short_usage',
+                                               'long_limit',
+                                               'long_usage',
+                                               'short_reset',
+                                               'long_reset'])
+
+ConnectionPoolStats = namedtuple('ConnectionPoolStats', ['host',
+                                                         'connections',
+                                                         'requests',
+                                                         'idle',
+                                                         'in_use',
+                                                         'maxsize'])
+
+CacheStats = namedtuple('CacheStats', ['hits',
+                                       'revalidations',
+                                       'misses',
+                                       'hit_ratio',
+                                       'bytes_saved',
+                                       'size',
+                                       'entries'])
+
+CircuitBreakerStats = namedtuple('CircuitBreakerStats', ['state',
+                                                         'calls',
+                                                         'failure_rate',
+                                                         'slow_call_rate',
+                                                         'rejected',
+                                                         'transitions'])
+
+CoalescingStats = namedtuple('CoalescingStats', ['requests',
+                                                 'coalesced',
+                                                 'in_flight'])
+
+BatchResult = namedtuple('BatchResult', ['item',
+                                         'result',
+                                         'error'])
+
+RequestSample = namedtuple('RequestSample', ['method',
+                                             'endpoint',
+                                             'status',
+                                             'duration',
+                                             'bytes_out',
+                                             'bytes_in'])
+
+RefreshSample = namedtuple('RefreshSample', ['duration',
+                                             'success'])
+
+PhaseTiming = namedtuple('PhaseTiming', ['phase',
+                                         'wall',
+                                         'network',
+                                         'parse',
+                                         'bytes_in',
+                                         'bytes_out',
+                                         'requests'])
+
+BootstrapResult = namedtuple('BootstrapResult', ['clients',
+                                                 'failures'])
+
+WebSession = namedtuple('WebSession', ['cookies',
+                                       'authenticity_token'])
+
+WebhookEvent = namedtuple('WebhookEvent', ['object_type',
+                                           'object_id',
+                                           'aspect_type',
+                                           'owner_id',
+                                           'subscription_id',
+                                           'event_time',
+                                           'updates'])
+
 SITE = 'https://www.strava.com'
+
+# Strava's default application quotas, per 15 minutes and per day
+RATE_LIMIT_SHORT = 100
+RATE_LIMIT_LONG = 1000
+RATE_LIMIT_SHORT_WINDOW = 15 * 60
+RATE_LIMIT_LONG_WINDOW = 24 * 60 * 60
+
+# Seconds responses of the API endpoints are served from the response cache
+CACHE_TTLS = {'/athlete': 60,
+              '/athletes/{id}/stats': 300,
+              '/activities/{id}': 300,
+              '/gear/{id}': 3600,
+              '/clubs/{id}': 3600}
+
+# Endpoints requests are grouped by in metrics, literal paths go first
+ENDPOINT_TEMPLATES = ('/athlete',
+                      '/athlete/activities',
+                      '/athlete/clubs',
+                      '/athlete/zones',
+                      '/athletes/{id}/stats',
+                      '/activities',
+                      '/activities/{id}',
+                      '/activities/{id}/streams',
+                      '/activities/{id}/laps',
+                      '/activities/{id}/zones',
+                      '/activities/{id}/comments',
+                      '/activities/{id}/kudos',
+                      '/gear/{id}',
+                      '/clubs/{id}',
+                      '/clubs/{id}/members',
+                      '/clubs/{id}/activities',
+                      '/segments/starred',
+                      '/segments/explore',
+                      '/segments/{id}',
+                      '/segments/{id}/streams',
+                      '/segment_efforts',
+                      '/segment_efforts/{id}',
+                      '/routes/{id}',
+                      '/routes/{id}/export_gpx',
+                      '/routes/{id}/export_tcx',
+                      '/uploads',
+                      '/uploads/{id}',
+                      '/push_subscriptions',
+                      '/push_subscriptions/{id}')
+
+# Seconds before a token expires in which it is considered due for refresh
+TOKEN_REFRESH_MARGIN = 60
+# Seconds to wait for the token endpoint to connect and to answer
+TOKEN_REQUEST_TIMEOUT = (10, 30)
+# Cookie of the Strava web session created by logging in
+SESSION_COOKIE = '_strava4_session'
+
 HEADERS = {'DNT': '1', 'Host': urlparse(SITE).netloc}
 
 INVALID_TOKEN_MSG = {"message": "Authorization Error",
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: cookiestore.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Web session persistence for pystrava
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import json
+import logging
+import os
+import time
+from threading import Lock
+from requests.cookies import RequestsCookieJar, create_cookie
+from .constants import WebSession, SESSION_COOKIE
+from .tokenstore import write_json
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+# This is the main prefix used for logging
+LOGGER_BASENAME = '''pystrava'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+COOKIE_FIELDS = ('name', 'value', 'domain', 'path', 'expires', 'secure')
+
+
+class FileCookieStore:
+    """
+    Keeps the Strava web sessions of the users in a JSON file.
+
+    A web session is the cookie jar left by logging in together with the
+    authenticity token of the page that followed, which is all accepting the
+    application again needs. Strava's session cookie has no expiry date, so
+    sessions older than max_age are considered expired as well.
+
+    """
+
+    def __init__(self, path, max_age=7 * 24 * 3600):
+        """
+        Initialises object.
+
+        Args:
+            path: string, path of the JSON file
+            max_age: seconds a web session is reused for
+        """
+        self._logger = logging.getLogger('{base}.{suffix}'
+                                         .format(base=LOGGER_BASENAME,
+                                                 suffix=self.__class__.__name__)
+                                         )
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_age = max_age
+        self._lock = Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as cookie_file:
+                return json.load(cookie_file)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            self._logger.warning('Ignoring corrupted cookie file %s', self.path)
+            return {}
+
+    def load(self, key):
+        """
+        Retrieves a web session that has not expired
+
+        Args:
+            key: string
+
+        Returns: WebSession namedtuple or None
+
+        """
+        with self._lock:
+            values = self._read().get(key)
+        if not values:
+            return None
+        now = time.time()
+        if values.get('saved_at', 0) + self.max_age <= now:
+            self._logger.info('Stored web session of %s is too old', key)
+            return None
+        cookies = RequestsCookieJar()
+        for cookie in values.get('cookies', []):
+            if cookie.get('expires') is not None and cookie['expires'] <= now:
+                continue
+            cookies.set_cookie(create_cookie(**{field: cookie.get(field)
+                                                for field in COOKIE_FIELDS}))
+        if SESSION_COOKIE not in cookies.keys() or not values.get('authenticity_token'):
+            return None
+        return WebSession(cookies, values['authenticity_token'])
+
+    def save(self, key, cookies, authenticity_token):
+        """
+        Stores a web session, replacing any previous one
+
+        Args:
+            key: string
+            cookies: cookie jar of the logged in session
+            authenticity_token: string
+
+        Returns: None
+
+        """
+        values = {'saved_at': time.time(),
+                  'authenticity_token': authenticity_token,
+                  'cookies': [{field: getattr(cookie, field) for field in COOKIE_FIELDS}
+                              for cookie in cookies]}
+        with self._lock:
+            sessions = self._read()
+            sessions[key] = values
+            write_json(self.path, sessions)
+
+    def delete(self, key):
+        """
+        Removes a stored web session if there is any
+
+        Args:
+            key: string
+
+        Returns: None
+
+        """
+        with self._lock:
+            sessions = self._read()
+            if sessions.pop(key, None) is not None:
+                write_json(self.path, sessions)
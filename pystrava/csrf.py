@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: csrf.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+CSRF token extraction for pystrava
+
+Strava's pages carry the CSRF token in a meta tag at the top of their head, so
+it is found by scanning the page as it arrives instead of parsing it whole.
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import html
+import logging
+import re
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+# This is the main prefix used for logging
+LOGGER_BASENAME = '''pystrava'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+META_TAG = re.compile(rb'<meta\b[^>]*>', re.IGNORECASE)
+CSRF_NAME = re.compile(rb'\bname\s*=\s*["\']?csrf-token["\'\s/>]', re.IGNORECASE)
+CONTENT = re.compile(rb'\bcontent\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', re.IGNORECASE)
+HEAD_END = re.compile(rb'</head\s*>|<body\b', re.IGNORECASE)
+
+# A tag straddling two chunks is found again by rescanning this many bytes
+OVERLAP = 1024
+
+# Bytes left in a streamed page that are still read to reuse its connection
+DRAIN_LIMIT = 64 * 1024
+
+
+class CsrfTokenScanner:
+    """
+    Incremental search of the CSRF meta tag over the chunks of a page.
+
+    Scanning stops at the tag or at the end of the head, where Strava's pages
+    would have it.
+
+    """
+
+    def __init__(self):
+        self.buffer = b''
+        self.token = None
+        self.finished = False
+        self._position = 0
+
+    def feed(self, chunk):
+        """
+        Scans one more chunk of the page
+
+        Args:
+            chunk: bytes
+
+        Returns: boolean, whether scanning is finished
+
+        """
+        if self.finished:
+            return True
+        self.buffer += chunk
+        for tag in META_TAG.finditer(self.buffer, self._position):
+            if CSRF_NAME.search(tag.group(0)):
+                content = CONTENT.search(tag.group(0))
+                if content:
+                    value = content.group(1) if content.group(1) is not None \
+                        else content.group(2)
+                    self.token = html.unescape(value.decode('utf-8', 'replace'))
+                self.finished = True
+                return True
+        if HEAD_END.search(self.buffer, self._position):
+            self.finished = True
+        self._position = max(len(self.buffer) - OVERLAP, 0)
+        return self.finished
+
+
+def _parse_csrf_token(html_page):
+    """
+    Gets the CSRF token parsing the whole page, for pages the scanner
+    could not handle
+
+    Args:
+        html_page: HTML page
+
+    Returns: string
+
+    """
+    # bs4 is only needed, and imported, for the pages the scanner can't handle
+    from bs4 import BeautifulSoup as Bfs
+    LOGGER.debug('Falling back to a full parse to find the CSRF token')
+    soup = Bfs(html_page, 'html.parser')
+    meta = soup.find('meta', {'name': 'csrf-token'})
+    if not meta or not meta.attrs.get('content'):
+        raise ValueError('No CSRF token found in page')
+    return meta.attrs.get('content')
+
+
+def find_csrf_token(html_page):
+    """
+    Gets the CSRF value from an HTML page
+
+    Args:
+        html_page: HTML page, string or bytes
+
+    Returns: string
+
+    """
+    page = html_page.encode('utf-8') if isinstance(html_page, str) else html_page
+    scanner = CsrfTokenScanner()
+    scanner.feed(page)
+    return scanner.token or _parse_csrf_token(html_page)
+
+
+def read_csrf_token(response, chunk_size=8192):
+    """
+    Gets the CSRF value from a response requested with stream=True.
+
+    The body is only read until the token shows up. What is left of it is
+    read without parsing when it is small enough to keep the connection
+    alive, otherwise the connection is dropped.
+
+    Args:
+        response: Response object
+        chunk_size: integer, bytes read at a time
+
+    Returns: string
+
+    """
+    scanner = CsrfTokenScanner()
+    chunks = response.iter_content(chunk_size=chunk_size)
+    for chunk in chunks:
+        if scanner.feed(chunk):
+            break
+    if scanner.token:
+        _release(response, chunks, len(scanner.buffer))
+        return scanner.token
+    page = scanner.buffer + b''.join(chunks)
+    return _parse_csrf_token(page.decode(response.encoding or 'utf-8', 'replace'))
+
+
+def _release(response, chunks, read):
+    """
+    Drains or closes a partially read streamed response
+
+    Args:
+        response: Response object
+        chunks: iterator over the rest of the body
+        read: integer, bytes already read
+
+    Returns: None
+
+    """
+    length = response.headers.get('Content-Length')
+    if length and length.isdigit() and int(length) - read <= DRAIN_LIMIT:
+        for _ in chunks:
+            pass
+    response.close()
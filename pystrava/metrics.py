@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: metrics.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Request metrics of pystrava sessions
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+from .cache import compile_templates, match_template
+from .constants import ENDPOINT_TEMPLATES
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Endpoint of the requests matching none of the templates
+OTHER_ENDPOINT = 'other'
+
+
+class MetricsHook:
+    """
+    Receives the measurements of an authenticated session.
+
+    Requests are grouped by endpoint template, such as '/activities/{id}',
+    so the number of series doesn't grow with the number of activities.
+    Subclasses override the methods they are interested in.
+
+    """
+
+    def __init__(self, templates=ENDPOINT_TEMPLATES):
+        """
+        Initialises object.
+
+        Args:
+            templates: iterable of endpoint templates requests are grouped by
+        """
+        self._templates = compile_templates(templates)
+
+    def endpoint(self, url):
+        """
+        Endpoint template of an URL
+
+        Args:
+            url: string
+
+        Returns: string, OTHER_ENDPOINT if no template matches
+
+        """
+        return match_template(url, self._templates) or OTHER_ENDPOINT
+
+    def request(self, sample):
+        """
+        Called after every request sent to Strava, retries included
+
+        Args:
+            sample: RequestSample namedtuple, its status is None when no
+                response was received
+
+        Returns: None
+
+        """
+
+    def refresh(self, sample):
+        """
+        Called after every token refresh
+
+        Args:
+            sample: RefreshSample namedtuple
+
+        Returns: None
+
+        """
+
+    def rate_limit(self, limits, usages):
+        """
+        Called with the budget reported by every response having one
+
+        Args:
+            limits: tuple of the 15 minutes and daily limits
+            usages: tuple of the 15 minutes and daily usages
+
+        Returns: None
+
+        """
+
+
+class CallbackMetrics(MetricsHook):
+    """
+    Passes the measurements on to callables, e.g. to feed a statsd client.
+
+    """
+
+    def __init__(self, on_request=None, on_refresh=None, on_rate_limit=None,
+                 templates=ENDPOINT_TEMPLATES):
+        """
+        Initialises object.
+
+        Args:
+            on_request: callable taking a RequestSample namedtuple
+            on_refresh: callable taking a RefreshSample namedtuple
+            on_rate_limit: callable taking the limits and usages tuples
+            templates: iterable of endpoint templates requests are grouped by
+        """
+        super().__init__(templates)
+        self.on_request = on_request
+        self.on_refresh = on_refresh
+        self.on_rate_limit = on_rate_limit
+
+    def request(self, sample):
+        if self.on_request:
+            self.on_request(sample)
+
+    def refresh(self, sample):
+        if self.on_refresh:
+            self.on_refresh(sample)
+
+    def rate_limit(self, limits, usages):
+        if self.on_rate_limit:
+            self.on_rate_limit(limits, usages)
+
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped))
+
+
+class PrometheusMetrics(MetricsHook):
+    """
+    Aggregates the measurements and renders them in the Prometheus text format.
+
+    Serve the output of render on the metrics endpoint of the application.
+
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, templates=ENDPOINT_TEMPLATES,
+                 prefix='pystrava'):
+        """
+        Initialises object.
+
+        Args:
+            buckets: increasing upper bounds in seconds of the latency histogram
+            templates: iterable of endpoint templates requests are grouped by
+            prefix: string prepended to the metric names
+        """
+        super().__init__(templates)
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self._lock = Lock()
+        self._histograms = defaultdict(lambda: [[0] * (len(self.buckets) + 1), 0.0])
+        self._statuses = defaultdict(int)
+        self._bytes_out = defaultdict(int)
+        self._bytes_in = defaultdict(int)
+        self._refreshes = defaultdict(int)
+        self._refresh_seconds = 0.0
+        self._remaining = {}
+
+    def request(self, sample):
+        series = (sample.method, sample.endpoint)
+        status = 'error' if sample.status is None else str(sample.status)
+        with self._lock:
+            histogram = self._histograms[series]
+            histogram[0][bisect_left(self.buckets, sample.duration)] += 1
+            histogram[1] += sample.duration
+            self._statuses[series + (status,)] += 1
+            self._bytes_out[series] += sample.bytes_out
+            self._bytes_in[series] += sample.bytes_in
+
+    def refresh(self, sample):
+        with self._lock:
+            self._refreshes[sample.success] += 1
+            self._refresh_seconds += sample.duration
+
+    def rate_limit(self, limits, usages):
+        with self._lock:
+            self._remaining = {window: limit - usage for window, limit, usage
+                               in zip(('short', 'long'), limits, usages)}
+
+    def render(self):
+        """
+        Current values in the Prometheus text exposition format
+
+        Returns: string
+
+        """
+        name = self.prefix
+        lines = []
+        with self._lock:
+            lines.extend((f'# HELP {name}_request_duration_seconds Latency of the requests '
+                          'sent to Strava.',
+                          f'# TYPE {name}_request_duration_seconds histogram'))
+            for (method, endpoint), (counts, total) in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    labels = _labels(method=method, endpoint=endpoint, le=bound)
+                    lines.append(f'{name}_request_duration_seconds_bucket{{{labels}}} '
+                                 f'{cumulative}')
+                labels = _labels(method=method, endpoint=endpoint)
+                lines.append(f'{name}_request_duration_seconds_sum{{{labels}}} {total}')
+                lines.append(f'{name}_request_duration_seconds_count{{{labels}}} '
+                             f'{cumulative}')
+            lines.extend((f'# HELP {name}_requests_total Requests sent to Strava by '
+                          'status, error when no response was received.',
+                          f'# TYPE {name}_requests_total counter'))
+            for (method, endpoint, status), count in sorted(self._statuses.items()):
+                labels = _labels(method=method, endpoint=endpoint, status=status)
+                lines.append(f'{name}_requests_total{{{labels}}} {count}')
+            for metric, values, help_text in (
+                    ('request_bytes_total', self._bytes_out, 'Bytes of request bodies.'),
+                    ('response_bytes_total', self._bytes_in, 'Bytes of response bodies.')):
+                lines.extend((f'# HELP {name}_{metric} {help_text}',
+                              f'# TYPE {name}_{metric} counter'))
+                for (method, endpoint), count in sorted(values.items()):
+                    labels = _labels(method=method, endpoint=endpoint)
+                    lines.append(f'{name}_{metric}{{{labels}}} {count}')
+            lines.extend((f'# HELP {name}_token_refreshes_total Token refreshes by outcome.',
+                          f'# TYPE {name}_token_refreshes_total counter'))
+            for success, count in sorted(self._refreshes.items()):
+                labels = _labels(success=str(success).lower())
+                lines.append(f'{name}_token_refreshes_total{{{labels}}} {count}')
+            lines.extend((f'# HELP {name}_token_refresh_seconds_total Time spent '
+                          'refreshing tokens.',
+                          f'# TYPE {name}_token_refresh_seconds_total counter',
+                          f'{name}_token_refresh_seconds_total {self._refresh_seconds}',
+                          f'# HELP {name}_rate_limit_remaining Requests left in the '
+                          'rate limit windows.',
+                          f'# TYPE {name}_rate_limit_remaining gauge'))
+            for window, remaining in sorted(self._remaining.items()):
+                lines.append(f'{name}_rate_limit_remaining{{{_labels(window=window)}}} '
+                             f'{remaining}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: pagination.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Concurrent pagination of Strava listings
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+def prefetch_pages(fetch_page, per_page, prefetch=2):
+    """
+    Yields the pages of a listing while the next ones are being fetched.
+
+    A page shorter than per_page is the last one. Pages requested past it
+    come back empty and are dropped.
+
+    Args:
+        fetch_page: callable taking a page number, starting at 1, and
+            returning the list of results of that page
+        per_page: integer, results asked for per page
+        prefetch: integer, pages fetched ahead of the one being consumed
+
+    Returns: generator of lists
+
+    """
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=prefetch + 1) as executor:
+        try:
+            for page in range(1, prefetch + 2):
+                pending.append(executor.submit(fetch_page, page))
+            next_page = prefetch + 2
+            while pending:
+                results = pending.popleft().result()
+                if results:
+                    yield results
+                if len(results) < per_page:
+                    return
+                pending.append(executor.submit(fetch_page, next_page))
+                next_page += 1
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def fetch_all_pages(fetch_page, per_page):
+    """
+    Fetches every page of a listing one after the other
+
+    Args:
+        fetch_page: callable taking a page number and returning its results
+        per_page: integer, results asked for per page
+
+    Returns: list
+
+    """
+    results, page = [], 1
+    while True:
+        batch = fetch_page(page)
+        results.extend(batch)
+        if len(batch) < per_page:
+            return results
+        page += 1
+
+
+def split_window(after, before, slices):
+    """
+    Splits a time window into contiguous slices.
+
+    Strava excludes both bounds of an after and before window, so the bounds
+    of neighbouring slices overlap by a second to not leave any gap.
+
+    Args:
+        after: integer, epoch the window starts after
+        before: integer, epoch the window ends before
+        slices: integer, number of slices wanted
+
+    Returns: list of (after, before) tuples, newest first
+
+    """
+    if before - after < 2:
+        return [(after, before)]
+    last = before - 1
+    edges = [after + (last - after) * index // slices for index in range(slices)] + [last]
+    windows = [(start, end + 1) for start, end in zip(edges, edges[1:]) if start < end]
+    return windows[::-1]
+
+
+def fetch_slices(fetch_slice, windows, max_workers):
+    """
+    Yields the results of time window slices fetched in parallel
+
+    Args:
+        fetch_slice: callable taking an (after, before) tuple and returning
+            the list of results in it
+        windows: list of (after, before) tuples
+        max_workers: integer, slices fetched at the same time
+
+    Returns: generator of lists, in the order of windows
+
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch_slice, window) for window in windows]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
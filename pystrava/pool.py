@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: pool.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Multi athlete client pool for pystrava
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from .adapters import StravaAdapter
+from .constants import PoolStats, BootstrapResult
+from .pystrava import StravaAuthenticator, Strava
+from .tokenstore import MemoryTokenStore
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+# This is the main prefix used for logging
+LOGGER_BASENAME = '''pystrava'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+
+class StravaPool:
+    """
+    Keeps authenticated clients for many athletes of the same application.
+
+    All clients share one HTTP connection pool. At most max_clients are kept
+    alive, the least recently used one being evicted when the cap is reached.
+    Tokens outlive evictions in the token store, so rebuilding an evicted
+    client does not go through the login flow again.
+
+    """
+
+    def __init__(self, client_id, client_secret, callback, scope,
+                 max_clients=100, token_store=None, adapter=None, **kwargs):
+        """
+        Initialises object.
+
+        Args:
+            client_id: string
+            client_secret: string
+            callback: string
+            scope: comma separated string
+            max_clients: integer, maximum number of live clients
+            token_store: TokenStore object, defaults to an in memory one
+            adapter: HTTPAdapter object shared by all clients, by default a
+                StravaAdapter built with the pool options in kwargs
+            **kwargs: extra options passed to StravaAuthenticator
+        """
+        self._logger = logging.getLogger('{base}.{suffix}'
+                                         .format(base=LOGGER_BASENAME,
+                                                 suffix=self.__class__.__name__)
+                                         )
+        if max_clients < 1:
+            raise ValueError('max_clients should be at least 1')
+        self._client_id = client_id
+        self._client_secret = client_secret
+        self._callback = callback
+        self._scope = scope
+        self.max_clients = max_clients
+        self.token_store = token_store or MemoryTokenStore()
+        pool_options = {option: kwargs.pop(option)
+                        for option in ('pool_connections', 'pool_maxsize', 'pool_block',
+                                       'keep_alive', 'tcp_keepalive')
+                        if option in kwargs}
+        self.adapter = adapter or StravaAdapter(**pool_options)
+        self._options = kwargs
+        self._clients = OrderedDict()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, email, password):
+        """
+        Gets the client of an athlete, creating it if it is not live
+
+        Args:
+            email: string
+            password: string
+
+        Returns: stravalib object
+
+        """
+        with self._lock:
+            entry = self._clients.get(email)
+            if entry:
+                self._clients.move_to_end(email)
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+        authenticator = self._authenticate(email, password)
+        client = Strava.from_authenticator(authenticator)
+        with self._lock:
+            entry = self._clients.get(email)
+            if entry:
+                # another thread built it meanwhile, keep theirs
+                authenticator.close()
+                self._clients.move_to_end(email)
+                return entry[1]
+            self._clients[email] = (authenticator, client)
+            evicted = self._evict()
+        for old_authenticator in evicted:
+            old_authenticator.close()
+        return client
+
+    def bootstrap(self, credentials, max_workers=8):
+        """
+        Creates the clients of many athletes concurrently.
+
+        A failing login does not affect the others, its exception is returned
+        instead. The shared connection pool should hold at least max_workers
+        connections, see the pool_maxsize option.
+
+        Args:
+            credentials: iterable of (email, password) tuples
+            max_workers: integer, logins running at the same time
+
+        Returns: BootstrapResult namedtuple with dictionaries of clients and
+            of exceptions by email
+
+        """
+        credentials = OrderedDict(credentials)
+        if len(credentials) > self.max_clients:
+            self._logger.warning('Bootstrapping %s clients in a pool of %s, the '
+                                 'least recently used ones will be evicted',
+                                 len(credentials), self.max_clients)
+
+        def create(email):
+            try:
+                return email, self.get(email, credentials[email]), None
+            except Exception as error:  # pylint: disable=broad-except
+                self._logger.warning('Unable to create client for %s: %s', email, error)
+                return email, None, error
+
+        clients, failures = OrderedDict(), OrderedDict()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for email, client, error in executor.map(create, credentials):
+                if error is None:
+                    clients[email] = client
+                else:
+                    failures[email] = error
+        return BootstrapResult(clients, failures)
+
+    def _authenticate(self, email, password):
+        self._logger.info('Creating client for %s', email)
+        return StravaAuthenticator(self._client_id,
+                                   self._client_secret,
+                                   self._callback,
+                                   self._scope,
+                                   email,
+                                   password,
+                                   token_store=self.token_store,
+                                   adapter=self.adapter,
+                                   **self._options)
+
+    def _evict(self):
+        """
+        Drops least recently used clients above the cap. Must hold the lock.
+
+        Returns: list of evicted StravaAuthenticator objects
+
+        """
+        evicted = []
+        while len(self._clients) > self.max_clients:
+            email, (authenticator, _) = self._clients.popitem(last=False)
+            self._logger.info('Evicting idle client for %s', email)
+            self._evictions += 1
+            evicted.append(authenticator)
+        return evicted
+
+    def discard(self, email):
+        """
+        Closes the client of an athlete if it is live. Its token is kept.
+
+        Args:
+            email: string
+
+        Returns: None
+
+        """
+        with self._lock:
+            entry = self._clients.pop(email, None)
+        if entry:
+            entry[0].close()
+
+    def __contains__(self, email):
+        with self._lock:
+            return email in self._clients
+
+    def __len__(self):
+        with self._lock:
+            return len(self._clients)
+
+    @property
+    def stats(self):
+        """
+        Hit, miss and eviction counters of the pool
+
+        Returns: PoolStats namedtuple
+
+        """
+        with self._lock:
+            return PoolStats(self._hits, self._misses, self._evictions,
+                             len(self._clients))
+
+    @property
+    def connection_stats(self):
+        """
+        Use of the shared connection pools
+
+        Returns: list of ConnectionPoolStats namedtuples
+
+        """
+        return self.adapter.stats() if hasattr(self.adapter, 'stats') else []
+
+    def close(self):
+        """
+        Closes every live client and the shared connection pool
+
+        Returns: None
+
+        """
+        with self._lock:
+            entries = list(self._clients.values())
+            self._clients.clear()
+        for authenticator, _ in entries:
+            authenticator.close()
+        self.adapter.close()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: profiling.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Profiling of the pystrava authentication flow
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import cProfile
+import io
+import pstats
+import time
+from contextlib import contextmanager
+from .constants import PhaseTiming
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+def _bytes_in(response):
+    tell = getattr(response.raw, 'tell', None)
+    try:
+        return tell() if tell else len(response.content)
+    except Exception:  # pylint: disable=broad-except
+        return 0
+
+
+def _bytes_out(request):
+    body = request.body if request is not None else None
+    return len(body) if isinstance(body, (bytes, str)) else 0
+
+
+class AuthProfiler:
+    """
+    Times the phases of an authentication.
+
+    Per phase it records the wall time, the network time until the response
+    headers arrived, the time spent parsing pages and token responses, and
+    the bytes exchanged. Reading the rest of a streamed page happens while
+    parsing it, so that time is counted as parse time.
+
+    """
+
+    def __init__(self, cprofile=False):
+        """
+        Initialises object.
+
+        Args:
+            cprofile: boolean, also capture a cProfile of the authentication
+        """
+        self.profile = cProfile.Profile() if cprofile else None
+        self._timings = []
+        self._current = None
+
+    def attach(self, session):
+        """
+        Starts observing the responses of a session
+
+        Args:
+            session: requests Session object
+
+        Returns: None
+
+        """
+        session.hooks['response'].append(self._on_response)
+
+    def detach(self, session):
+        """
+        Stops observing the responses of a session
+
+        Args:
+            session: requests Session object
+
+        Returns: None
+
+        """
+        if self._on_response in session.hooks['response']:
+            session.hooks['response'].remove(self._on_response)
+
+    def _on_response(self, response, *args, **kwargs):
+        current = self._current
+        if current is not None:
+            current['network'] += response.elapsed.total_seconds()
+            current['responses'].append(response)
+
+    @contextmanager
+    def profiling(self):
+        """
+        Captures the cProfile of the block when enabled
+
+        Returns: context manager
+
+        """
+        if self.profile is None:
+            yield
+            return
+        self.profile.enable()
+        try:
+            yield
+        finally:
+            self.profile.disable()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Times a phase of the authentication
+
+        Args:
+            name: string
+
+        Returns: context manager
+
+        """
+        current = {'network': 0.0, 'parse': 0.0, 'responses': []}
+        self._current = current
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - started
+            self._current = None
+            responses = current['responses']
+            self._timings.append(PhaseTiming(name, wall, current['network'],
+                                             current['parse'],
+                                             sum(_bytes_in(response)
+                                                 for response in responses),
+                                             sum(_bytes_out(response.request)
+                                                 for response in responses),
+                                             len(responses)))
+
+    @contextmanager
+    def parsing(self):
+        """
+        Counts the block as parse time of the current phase
+
+        Returns: context manager
+
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self._current is not None:
+                self._current['parse'] += time.perf_counter() - started
+
+    @property
+    def report(self):
+        """
+        Timings of the phases in the order they ran
+
+        Returns: list of PhaseTiming namedtuples
+
+        """
+        return list(self._timings)
+
+    @property
+    def total(self):
+        """
+        Sum of the timings of every phase
+
+        Returns: PhaseTiming namedtuple
+
+        """
+        columns = list(zip(*self._timings))[1:] or [()] * 6
+        return PhaseTiming('total', *(sum(column) for column in columns))
+
+    def format_report(self):
+        """
+        Report as a table, times in milliseconds
+
+        Returns: string
+
+        """
+        lines = ['{:<20} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8}'.format(
+            'phase', 'wall ms', 'net ms', 'parse ms', 'bytes in', 'bytes out', 'requests')]
+        for timing in self._timings + [self.total]:
+            lines.append('{:<20} {:>9.2f} {:>9.2f} {:>9.2f} {:>9} {:>9} {:>8}'.format(
+                timing.phase, timing.wall * 1000, timing.network * 1000,
+                timing.parse * 1000, timing.bytes_in, timing.bytes_out, timing.requests))
+        return '\n'.join(lines)
+
+    def stats(self, sort='cumulative', limit=30):
+        """
+        Captured cProfile statistics
+
+        Args:
+            sort: string, pstats sort key
+            limit: integer, number of functions listed
+
+        Returns: string, empty if cProfile was not enabled
+
+        """
+        if self.profile is None:
+            return ''
+        output = io.StringIO()
+        pstats.Stats(self.profile, stream=output).sort_stats(sort).print_stats(limit)
+        return output.getvalue()
@@ -32,12 +32,22 @@ Main code for pystrava
 """
 
 import logging
+import time
+from contextlib import contextmanager, nullcontext
+from threading import Lock, Thread, Timer, get_ident
 from requests import Session
-from bs4 import BeautifulSoup as Bfs
+from requests.adapters import DEFAULT_POOLBLOCK, DEFAULT_POOLSIZE
+from requests.exceptions import (ConnectionError as RequestsConnectionError,
+                                 RequestException, Timeout)
 from urllib.parse import parse_qsl, urlparse
 from copy import copy
-from stravalib import Client as OriginalStrava
-from .constants import User, Token, HEADERS, SITE, INVALID_TOKEN_MSG
+from .constants import (User, Token, RequestSample, RefreshSample, HEADERS, SITE,
+                        INVALID_TOKEN_MSG, TOKEN_REFRESH_MARGIN, TOKEN_REQUEST_TIMEOUT)
+from .adapters import StravaAdapter
+from .csrf import find_csrf_token, read_csrf_token
+from .profiling import AuthProfiler
+from .ratelimit import RateLimiter, parse_rate_limit_headers
+from .tokenstore import token_key
 
 
 __author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
@@ -64,7 +74,14 @@ class StravaAuthenticator:
     More details can be found on https://developers.strava.com/docs/authentication
 
     """
-    def __init__(self, client_id, client_secret, callback, scope, email, password):
+    def __init__(self, client_id, client_secret, callback, scope, email, password,
+                 token_store=None, refresh_margin=TOKEN_REFRESH_MARGIN,
+                 auto_refresh=False, adapter=None, rate_limiter=None,
+                 pool_connections=DEFAULT_POOLSIZE, pool_maxsize=DEFAULT_POOLSIZE,
+                 pool_block=DEFAULT_POOLBLOCK, keep_alive=True, tcp_keepalive=False,
+                 cache=None, retry_policy=None, circuit_breaker=None, coalescer=None,
+                 metrics=None, profile=False, refresh_token=None, lazy=False,
+                 background=True, warm_up=False, cookie_store=None):
         """
         Initialises object.
 
@@ -75,6 +92,43 @@ class StravaAuthenticator:
             scope: comma separated string
             email: string
             password: string
+            token_store: TokenStore object to persist tokens across restarts
+            refresh_margin: seconds before expiry in which the token is
+                refreshed ahead of the next request
+            auto_refresh: boolean, refresh the token in a background timer
+                before it expires so requests never wait for it
+            adapter: HTTPAdapter object to share one connection pool between
+                several authenticators
+            rate_limiter: RateLimiter object pacing the API requests, by
+                default the budget is only tracked
+            pool_connections: integer, number of hosts to keep a pool for
+            pool_maxsize: integer, connections kept per host, it should be at
+                least the number of threads sharing the session
+            pool_block: boolean, wait for a free connection when the pool is
+                full instead of opening one that is discarded afterwards
+            keep_alive: boolean, reuse connections between requests
+            tcp_keepalive: boolean, send TCP keep alive probes on idle
+                pooled connections
+            cache: ResponseCache object to serve repeated GET requests from
+            retry_policy: RetryPolicy object to retry failed API requests
+            circuit_breaker: CircuitBreaker object failing requests fast
+                while Strava is failing
+            coalescer: RequestCoalescer object sharing one round trip between
+                identical concurrent GET requests
+            metrics: MetricsHook object receiving the latency, status and
+                size of every API request and the token refreshes
+            profile: boolean or AuthProfiler object, time the phases of the
+                authentication, the report is kept in the profiler attribute
+            refresh_token: string, refresh token of the athlete to get the
+                access token from instead of logging in
+            lazy: boolean, return right away and authenticate in the
+                background or on first use, requests wait for it if needed
+            background: boolean, start a lazy authentication right away in a
+                thread instead of on the first request
+            warm_up: boolean, open a connection to Strava in a thread so the
+                TLS handshake is done by the time it is used
+            cookie_store: FileCookieStore object keeping the web session, so
+                logging in again goes straight to accepting the application
         """
         self._logger = logging.getLogger('{base}.{suffix}'
                                          .format(base=LOGGER_BASENAME,
@@ -87,20 +141,254 @@ class StravaAuthenticator:
         self._session = Session()
         self._auth_url = None
         self._session.headers.update(HEADERS)
+        self._shared_adapter = adapter is not None
+        self.adapter = adapter or StravaAdapter(pool_connections=pool_connections,
+                                                pool_maxsize=pool_maxsize,
+                                                pool_block=pool_block,
+                                                keep_alive=keep_alive,
+                                                tcp_keepalive=tcp_keepalive)
+        self._session.mount('https://', self.adapter)
+        self._session.mount('http://', self.adapter)
         self._login_headers = {}
-        self._authenticate()
+        self._token_store = token_store
+        self._refresh_margin = refresh_margin
+        self._auto_refresh = auto_refresh
+        self._refresh_timer = None
+        self._refresh_lock = Lock()
+        self.rate_limiter = rate_limiter or RateLimiter(pace=False)
+        self.cache = cache
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.coalescer = coalescer
+        self.metrics = metrics
+        self.profiler = AuthProfiler() if profile is True else profile or None
+        self._bootstrap_refresh_token = refresh_token
+        self._cookie_store = cookie_store
+        self._key = token_key(self.user, refresh_token)
+        if self._key is None and (token_store or cache or coalescer or cookie_store):
+            raise ValueError('An email or a refresh token is required to tell the '
+                             'athlete apart in shared stores, caches and coalescers')
+        self._authenticated = False
+        self._authenticating = None
+        self._authentication_lock = Lock()
+        if warm_up:
+            Thread(target=self.warm_up, daemon=True).start()
+        if not lazy:
+            self.authenticate()
+            return
+        self._monkey_patch_session()
+        if background:
+            Thread(target=self._background_authenticate, daemon=True).start()
+
+    def authenticate(self):
+        """
+        Runs the authentication unless it already completed.
+
+        Lazy authenticators call it before their first request. Concurrent
+        callers wait for the one running it, and a failed authentication is
+        tried again by the next caller.
+
+        Returns: boolean
+
+        """
+        if self._authenticated:
+            return True
+        with self._authentication_lock:
+            if not self._authenticated:
+                self._authenticating = get_ident()
+                try:
+                    self._authenticate()
+                finally:
+                    self._authenticating = None
+                self._authenticated = True
+        return True
+
+    def _background_authenticate(self):
+        """
+        Thread target of a lazy authentication, failures are left to the next
+        request to retry and raise
+
+        Returns: None
+
+        """
+        try:
+            self.authenticate()
+        except Exception:  # pylint: disable=broad-except
+            self._logger.exception('Background authentication failed')
+
+    @property
+    def authenticated(self):
+        """
+        Whether the authentication completed
+
+        Returns: boolean
+
+        """
+        return self._authenticated
+
+    def warm_up(self, connections=1):
+        """
+        Opens connections to Strava ahead of their use.
+
+        The connections go back to the pool of the session, so the requests
+        using them skip the DNS lookup and the TCP and TLS handshakes.
+
+        Args:
+            connections: integer, connections opened in parallel
+
+        Returns: None
+
+        """
+        def connect():
+            try:
+                Session.request(self._session, 'HEAD', f'{SITE}/', allow_redirects=False,
+                                timeout=10).close()
+            except RequestException as error:
+                self._logger.warning('Unable to warm up a connection to Strava: %s', error)
+
+        threads = [Thread(target=connect, daemon=True) for _ in range(connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    @classmethod
+    def from_refresh_token(cls, client_id, client_secret, refresh_token, email=None,
+                           **kwargs):
+        """
+        Authenticates with a refresh token in a single request, without logging in
+
+        Args:
+            client_id: string
+            client_secret: string
+            refresh_token: string
+            email: string, identifies the athlete in token stores and pools,
+                by default a digest of the refresh token does
+            **kwargs: extra options passed to StravaAuthenticator
+
+        Returns: StravaAuthenticator object
+
+        """
+        return cls(client_id, client_secret, None, None, email, None,
+                   refresh_token=refresh_token, **kwargs)
 
     def _authenticate(self):
         """
         Initiate authentication flow to get token credentials
+
+        A token kept in the token store is used when it is still valid or can
+        be refreshed, then the refresh token given if any, otherwise the whole
+        login flow is performed.
+
         Returns: boolean
 
         """
-        response = self._accept_application()
-        self._token = self._exchange_token(response)
+        if self.profiler:
+            self.profiler.attach(self._session)
+        try:
+            with self.profiler.profiling() if self.profiler else nullcontext():
+                if self._token_store:
+                    with self._phase('stored_token'):
+                        self._token = self._load_stored_token()
+                if not self._token and self._bootstrap_refresh_token:
+                    self._token = self._token_from_refresh_token()
+                    if self._token:
+                        self._store_token()
+                if not self._token:
+                    response = self._accept_stored_session() if self._cookie_store \
+                        else None
+                    if response is None:
+                        response = self._accept_application()
+                    self._token = self._exchange_token(response)
+                    self._store_token()
+        finally:
+            if self.profiler:
+                self.profiler.detach(self._session)
         self._monkey_patch_session()
+        self._schedule_refresh()
         return True
 
+    def _token_from_refresh_token(self):
+        """
+        Gets a token from the refresh token given at construction
+
+        Returns: Token namedtuple or None when it was refused but the
+            credentials to log in are known
+
+        """
+        self._logger.info('Getting access token from refresh token')
+        token = Token(None, None, 0, 0, self._bootstrap_refresh_token)
+        try:
+            with self._phase('refresh_token'):
+                return self._renew_token(self._session, self.user, token)
+        except (ValueError, RequestException):
+            if not self.user.password:
+                raise
+            self._logger.warning('Unable to use the refresh token, logging in')
+            return None
+
+    def _load_stored_token(self):
+        """
+        Gets a usable token from the token store, refreshing it if expired
+
+        Returns: Token namedtuple or None
+
+        """
+        if not self._token_store:
+            return None
+        with self._token_store_lock():
+            token = self._token_store.load(self._key)
+            if not token:
+                return None
+            if not self._is_expiring(token):
+                self._logger.info('Using stored token')
+                return token
+            self._logger.info('Stored token is expired, trying to refresh it')
+            try:
+                token = self._renew_token(self._session, self.user, token)
+            except (ValueError, RequestException):
+                self._logger.warning('Unable to refresh stored token, logging in')
+                return None
+            self._token = token
+            self._store_token()
+            return token
+
+    @contextmanager
+    def _token_store_lock(self):
+        """
+        Holds the token store lock, if there is a store, while refreshing
+
+        Returns: context manager
+
+        """
+        if not self._token_store:
+            yield
+            return
+        with self._token_store.lock(self._key):
+            yield
+
+    def _is_expiring(self, token):
+        """
+        Whether the token is expired or will be within the refresh margin
+
+        Args:
+            token: Token namedtuple
+
+        Returns: boolean
+
+        """
+        return token.expires_at - self._refresh_margin <= time.time()
+
+    def _store_token(self):
+        """
+        Saves the current token in the token store if there is one
+
+        Returns: None
+
+        """
+        if self._token_store:
+            self._token_store.save(self._key, self._token)
+
     def __populate_url_params(self):
         """
         Generate string parameters for URL
@@ -133,9 +421,12 @@ class StravaAuthenticator:
 
         """
         login_url = f'{SITE}/login'
-        login_response = self._session.get(login_url)
+        with self._phase('login_page'):
+            login_response = self._session.get(login_url, stream=True)
+            with self._parsing():
+                csrf_token = read_csrf_token(login_response)
         login_form = {
-            'authenticity_token': self._get_csrf_token(login_response.text),
+            'authenticity_token': csrf_token,
             'email': self.user.email,
             'password': self.user.password,
             'utf8': '✓'}
@@ -151,9 +442,11 @@ class StravaAuthenticator:
         """
         login_form = self._get_login_details()
         self._logger.info("Logging in")
-        session_response = self._session.post(url=f'{SITE}/session',
-                                              data=login_form,
-                                              headers=self._login_headers)
+        with self._phase('login_session'):
+            session_response = self._session.post(url=f'{SITE}/session',
+                                                  data=login_form,
+                                                  headers=self._login_headers,
+                                                  stream=True)
         return session_response
 
     @staticmethod
@@ -169,7 +462,44 @@ class StravaAuthenticator:
         scope = {scope: 'on' for scope in scopes.split(',')}
         return scope
 
-    def _accept_application(self):
+    def _accept_stored_session(self):
+        """
+        Accepts the application with the stored web session, skipping the login
+
+        Returns: Response object or None if there is no usable web session
+
+        """
+        key = self._key
+        web_session = self._cookie_store.load(key)
+        if not web_session:
+            return None
+        self._logger.info('Using stored web session')
+        self._session.cookies.update(web_session.cookies)
+        response = self._accept_application(web_session.authenticity_token)
+        if self._authorization_code(response):
+            return response
+        self._logger.info('Stored web session expired, logging in')
+        self._cookie_store.delete(key)
+        self._session.cookies.clear()
+        return None
+
+    @staticmethod
+    def _authorization_code(response):
+        """
+        Code Strava redirects to the callback with after accepting the application
+
+        Args:
+            response: Response object of the acceptance
+
+        Returns: string or None
+
+        """
+        location_url = response.headers.get('location')
+        if not location_url:
+            return None
+        return dict(parse_qsl(urlparse(location_url).query)).get('code')
+
+    def _accept_application(self, authenticity_token=None):
         """
         Accepts application to use Strava's API.
 
@@ -177,22 +507,34 @@ class StravaAuthenticator:
         This will update the session and finally request for acceptance to
         the endpoint.
 
+        Args:
+            authenticity_token: string, CSRF token of an already logged in
+                web session, logs in when not given
+
         Returns: session object
 
         """
         headers = self._login_headers
-        login_session = self._login_session()
-        auth_form = {'authenticity_token': self._get_csrf_token(login_session.text)}
-        auth_form.update(self._generate_auth_scope(self._scope))
-        params = self.__populate_url_params()
-        params.update({'redirect_uri': self._callback})
-        self._logger.info("Accepting application")
-        auth_response = self._session.post(url=f'{SITE}/oauth/accept_application',
-                                           params=params,
-                                           data=auth_form,
-                                           headers=headers.update(
-                                               {'Referer': self._auth_url}),
-                                           allow_redirects=False)
+        login_session = self._login_session() if authenticity_token is None else None
+        with self._phase('accept_application'):
+            if login_session is not None:
+                with self._parsing():
+                    authenticity_token = read_csrf_token(login_session)
+            auth_form = {'authenticity_token': authenticity_token}
+            auth_form.update(self._generate_auth_scope(self._scope))
+            params = self.__populate_url_params()
+            params.update({'redirect_uri': self._callback})
+            self._logger.info("Accepting application")
+            auth_response = self._session.post(url=f'{SITE}/oauth/accept_application',
+                                               params=params,
+                                               data=auth_form,
+                                               headers=headers.update(
+                                                   {'Referer': self._auth_url}),
+                                               allow_redirects=False)
+        if login_session is not None and self._cookie_store and \
+                self._authorization_code(auth_response):
+            self._cookie_store.save(self._key, self._session.cookies,
+                                    authenticity_token)
         return auth_response
 
     def _exchange_token(self, response):
@@ -207,17 +549,37 @@ class StravaAuthenticator:
         Returns: Token object
 
         """
-        location_url = response.headers.get('location')
-        code = dict(parse_qsl(urlparse(location_url).query)).get('code')
-        payload = {'code': code,
+        payload = {'code': self._authorization_code(response),
                    'grant_type': 'authorization_code',
                    'client_id': self.user.client_id,
                    'client_secret': self.user.client_secret}
         self._logger.info("Getting access token from code")
-        return self._retrieve_token(self._session, payload)
+        with self._phase('exchange_token'):
+            return self._retrieve_token(self._session, payload, self._parsing)
+
+    def _phase(self, name):
+        """
+        Times a phase of the authentication when profiling
+
+        Args:
+            name: string
+
+        Returns: context manager
+
+        """
+        return self.profiler.phase(name) if self.profiler else nullcontext()
+
+    def _parsing(self):
+        """
+        Counts the block as parse time of the current phase when profiling
+
+        Returns: context manager
+
+        """
+        return self.profiler.parsing() if self.profiler else nullcontext()
 
     @staticmethod
-    def _retrieve_token(session, payload):
+    def _retrieve_token(session, payload, parsing=nullcontext):
         """
         Interface to request a token to the endpoint accordingly and it
         populates the Token namedtuple with the retrieved values.
@@ -225,20 +587,40 @@ class StravaAuthenticator:
         Args:
             session: session object
             payload: dictionary
+            parsing: callable returning a context manager around the decoding
+                of the response
 
         Returns: Token namedtuple
 
         """
         response = session.post(url=f'{SITE}/oauth/token',
-                                data=payload)
-        tokens = response.json()
+                                data=payload,
+                                timeout=TOKEN_REQUEST_TIMEOUT)
+        with parsing():
+            return StravaAuthenticator._parse_token(response.json(), payload)
+
+    @staticmethod
+    def _parse_token(tokens, payload):
+        """
+        Populates the Token namedtuple from a token endpoint response.
+
+        Strava does not always return the refresh token when renewing, in
+        which case the one sent in the payload is still valid.
+
+        Args:
+            tokens: dictionary, decoded response of the token endpoint
+            payload: dictionary sent to the token endpoint
+
+        Returns: Token namedtuple
+
+        """
         if not tokens.get('refresh_token'):
-            tokens.update({'refresh_token': session.token.refresh_token})
+            tokens.update({'refresh_token': payload.get('refresh_token')})
         token_values = [tokens.get(key) for key in Token._fields]
         if not all(token_values):
-            LOGGER.exception(response.content)
+            LOGGER.error(tokens)
             raise ValueError('Incomplete token response received. '
-                             'Got: %s', response.json())
+                             'Got: %s', tokens)
         return Token(*token_values)
 
     @staticmethod
@@ -254,12 +636,26 @@ class StravaAuthenticator:
         Returns: Token namedtuple
 
         """
-        payload = {'grant_type': 'refresh_token',
-                   'client_id': user.client_id,
-                   'client_secret': user.client_secret,
-                   'refresh_token': token.refresh_token}
+        payload = StravaAuthenticator._renew_payload(user, token)
         return StravaAuthenticator._retrieve_token(session, payload)
 
+    @staticmethod
+    def _renew_payload(user, token):
+        """
+        Payload to request a new token from a refresh token
+
+        Args:
+            user: User namedtuple
+            token: Token namedtuple
+
+        Returns: dictionary
+
+        """
+        return {'grant_type': 'refresh_token',
+                'client_id': user.client_id,
+                'client_secret': user.client_secret,
+                'refresh_token': token.refresh_token}
+
     def _monkey_patch_session(self):
         """
         Gets original request method and overrides it with the patched one.
@@ -270,7 +666,8 @@ class StravaAuthenticator:
         Returns: Session object
 
         """
-        self._session.original_request = self._session.request
+        if not hasattr(self._session, 'original_request'):
+            self._session.original_request = self._session.request
         self._session.token = self.token
         self._session.user = self.user
         self._session.renew_token = self._renew_token
@@ -290,19 +687,346 @@ class StravaAuthenticator:
         Returns: Session object
 
         """
-        self._logger.info(('Using patched request for method {method}, '
-                           'url {url}').format(method=method, url=url))
-        response = self._session.original_request(method, url, **kwargs)
+        self._logger.info('Using patched request for method %s, url %s', method, url)
+        if '/oauth/' in url:
+            return self._session.original_request(method, url, **kwargs)
+        if not self._authenticated:
+            if self._authenticating == get_ident():
+                # the login of a lazy authentication
+                return self._session.original_request(method, url, **kwargs)
+            self.authenticate()
+        cacheable = method.upper() == 'GET' and not kwargs.get('stream')
+        cache_key = None
+        unconditional_kwargs = kwargs
+        if self.cache and cacheable:
+            cache_key = self.cache.key(self._key, url, kwargs.get('params'))
+            cached, conditional_headers = self.cache.lookup(cache_key)
+            if cached is not None:
+                return cached
+            if conditional_headers:
+                headers = dict(kwargs.get('headers') or {})
+                headers.update(conditional_headers)
+                kwargs = dict(kwargs, headers=headers)
+        if self.coalescer and cacheable:
+            namespace = f'{self._key}:{self._session.token.access_token}'
+            response = self.coalescer.request(
+                self.coalescer.key(namespace, url, kwargs.get('params')),
+                lambda: self._authorized_request(method, url, **kwargs))
+        elif self.cache and method.upper() not in ('GET', 'HEAD', 'OPTIONS'):
+            try:
+                return self._authorized_request(method, url, **kwargs)
+            finally:
+                # the resource may have changed even if the request failed
+                self.invalidate_cache(url)
+        else:
+            response = self._authorized_request(method, url, **kwargs)
+        if cache_key:
+            revalidated = self.cache.store(cache_key, response)
+            if revalidated is None:
+                self._logger.info('Cached response evicted while revalidating it, '
+                                  'requesting it again')
+                response = self._authorized_request(method, url, **unconditional_kwargs)
+                response = self.cache.store(cache_key, response) or response
+            else:
+                response = revalidated
+        return response
+
+    def _authorized_request(self, method, url, **kwargs):
+        """
+        Sends an API request with a valid token, refreshing it when needed
+
+        Args:
+            method: HTTP verb
+            url: URL to request
+            **kwargs: extra kwargs
+
+        Returns: Response object
+
+        """
+        token = self._session.token
+        if self._is_expiring(token):
+            self._logger.info('Token is about to expire, refreshing it')
+            token = self._refresh_token(token)
+        self._set_request_token(kwargs, token)
+        response = self._send(method, url, **kwargs)
         if response.status_code == 401 and response.json() == INVALID_TOKEN_MSG:
             self._logger.warning('Expired token detected, trying to refresh!')
-            self._session.token = self._session.renew_token(self._session,
-                                                            self.user,
-                                                            self.token)
-            kwargs.update({'params':
-                          {'access_token': self._session.token.access_token}})
-            response = self._session.original_request(method, url, **kwargs)
+            token = self._refresh_token(token)
+            self._set_request_token(kwargs, token)
+            response = self._send(method, url, **kwargs)
         return response
 
+    def _send(self, method, url, **kwargs):
+        """
+        Sends an API request within the rate limit budget and updates it.
+
+        Failed attempts are retried as the retry policy decides. Every attempt
+        goes through the circuit breaker, which raises CircuitOpenError instead
+        of sending it while Strava is failing.
+
+        Args:
+            method: HTTP verb
+            url: URL to request
+            **kwargs: extra kwargs
+
+        Returns: Response object
+
+        """
+        policy = self.retry_policy
+        if policy:
+            policy.budget.deposit()
+        breaker = self.circuit_breaker
+        attempt = 0
+        while True:
+            # a failing acquire must not take the trial slot of a half open breaker
+            self.rate_limiter.acquire()
+            if breaker:
+                breaker.before_call()
+            started = time.monotonic()
+            try:
+                response = self._session.original_request(method, url, **kwargs)
+            except (RequestsConnectionError, Timeout) as error:
+                if breaker:
+                    breaker.record(False, time.monotonic() - started)
+                if self.metrics:
+                    self._observe_request(method, url, time.monotonic() - started)
+                delay = policy.retry_delay(method, attempt, error=error) if policy else None
+                if delay is None:
+                    raise
+                self._logger.warning('Request failed with %s, retrying in %.2f seconds',
+                                     error, delay)
+            except BaseException:
+                # any other failure still has to settle a half open trial
+                if breaker:
+                    breaker.record(False, time.monotonic() - started)
+                raise
+            else:
+                if breaker:
+                    breaker.record(response.status_code < 500, time.monotonic() - started)
+                if self.metrics:
+                    self._observe_request(method, url, time.monotonic() - started,
+                                          response, kwargs.get('stream'))
+                self.rate_limiter.update(response.headers)
+                if response.status_code == 429:
+                    self._logger.warning('Rate limit exceeded')
+                    self.rate_limiter.exhaust()
+                delay = policy.retry_delay(method, attempt, response=response,
+                                           rate_limiter=self.rate_limiter) \
+                    if policy else None
+                if delay is None:
+                    return response
+                self._logger.warning('Request got status %s, retrying in %.2f seconds',
+                                     response.status_code, delay)
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def _observe_request(self, method, url, duration, response=None, stream=False):
+        """
+        Reports a request to the metrics hook
+
+        A failing hook is logged, it never fails the request.
+
+        Args:
+            method: HTTP verb
+            url: URL requested
+            duration: float, seconds the request took
+            response: Response object or None when none was received
+            stream: boolean, the body of the response is not read yet
+
+        Returns: None
+
+        """
+        try:
+            status, bytes_out, bytes_in = None, 0, 0
+            if response is not None:
+                status = response.status_code
+                body = response.request.body if response.request is not None else None
+                bytes_out = len(body) if isinstance(body, (bytes, str)) else 0
+                bytes_in = self._response_size(response, stream)
+                budget = parse_rate_limit_headers(response.headers)
+                if budget:
+                    self.metrics.rate_limit(*budget)
+            self.metrics.request(RequestSample(method.upper(), self.metrics.endpoint(url),
+                                               status, duration, bytes_out, bytes_in))
+        except Exception:  # pylint: disable=broad-except
+            self._logger.exception('Metrics hook failed to record request to %s', url)
+
+    def _response_size(self, response, stream=False):
+        """
+        Bytes received for a response, as announced or as read
+
+        Args:
+            response: Response object
+            stream: boolean, the body of the response is not read yet
+
+        Returns: integer
+
+        """
+        length = response.headers.get('Content-Length')
+        if length is not None:
+            try:
+                return int(length)
+            except ValueError:
+                self._logger.warning('Invalid Content-Length %r', length)
+        return 0 if stream else len(response.content)
+
+    def _observe_refresh(self, duration, success):
+        """
+        Reports a token refresh to the metrics hook, a failing hook is logged
+
+        Args:
+            duration: float, seconds the refresh took
+            success: boolean
+
+        Returns: None
+
+        """
+        try:
+            self.metrics.refresh(RefreshSample(duration, success))
+        except Exception:  # pylint: disable=broad-except
+            self._logger.exception('Metrics hook failed to record token refresh')
+
+    @staticmethod
+    def _set_request_token(kwargs, token):
+        """
+        Sets the access token of a pending request.
+
+        Callers such as stravalib keep their own copy of the access token, which
+        goes stale once the session refreshes it, so the session token always
+        wins.
+
+        Args:
+            kwargs: dictionary of request kwargs, updated in place
+            token: Token namedtuple
+
+        Returns: None
+
+        """
+        headers = dict(kwargs.get('headers') or {})
+        headers.update({'Authorization': f'Bearer {token.access_token}'})
+        kwargs.update({'headers': headers})
+        params = kwargs.get('params')
+        if params and 'access_token' in params:
+            params = dict(params)
+            params.update({'access_token': token.access_token})
+            kwargs.update({'params': params})
+
+    def _refresh_token(self, stale_token=None):
+        """
+        Renews the current token and propagates it to the session and store
+
+        Only one thread renews at a time. Threads that found the same stale
+        token wait for that renewal and reuse its result instead of renewing
+        again. The same goes for processes sharing a token store, the token
+        another process stored meanwhile is used instead of renewing.
+
+        Args:
+            stale_token: Token namedtuple the caller found to be expired
+
+        Returns: Token namedtuple
+
+        """
+        with self._refresh_lock, self._token_store_lock():
+            current = self._session.token
+            if stale_token and current.access_token != stale_token.access_token:
+                return current
+            stored = self._token_store.load(self._key) \
+                if self._token_store else None
+            if stored and stored.access_token != current.access_token \
+                    and not self._is_expiring(stored):
+                self._logger.info('Using token refreshed by another process')
+                self._token = stored
+            else:
+                started = time.monotonic()
+                success = False
+                try:
+                    self._token = self._session.renew_token(self._session,
+                                                            self.user,
+                                                            current)
+                    success = True
+                finally:
+                    if self.metrics:
+                        self._observe_refresh(time.monotonic() - started, success)
+                self._store_token()
+            self._session.token = self._token
+            self._schedule_refresh()
+            return self._token
+
+    def _schedule_refresh(self, delay=None):
+        """
+        Arms the background timer that refreshes the token before it expires
+
+        Args:
+            delay: seconds to wait, defaults to the time left until the
+                refresh margin is reached
+
+        Returns: None
+
+        """
+        if not self._auto_refresh:
+            return
+        if self._refresh_timer:
+            self._refresh_timer.cancel()
+        if delay is None:
+            delay = self._token.expires_at - self._refresh_margin - time.time()
+        self._refresh_timer = Timer(max(delay, 0), self._background_refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _background_refresh(self):
+        """
+        Timer callback refreshing the token, retried shortly if it fails
+
+        Returns: None
+
+        """
+        self._logger.info('Refreshing token in the background')
+        try:
+            self._refresh_token(self._session.token)
+        except Exception:  # pylint: disable=broad-except
+            # token stores raise their own errors too, the timer must be rearmed
+            self._logger.exception('Background token refresh failed')
+            self._schedule_refresh(delay=min(self._refresh_margin, 30))
+
+    def invalidate_cache(self, url=None):
+        """
+        Drops the cached responses of the athlete, of an URL or all of them
+
+        Args:
+            url: string, only the responses of this URL, whatever their params
+
+        Returns: None
+
+        """
+        if self.cache:
+            self.cache.invalidate(self._key, url)
+
+    def close(self):
+        """
+        Stops the background refresh timer and closes the session.
+
+        A shared adapter is left open for the other authenticators using it.
+
+        Returns: None
+
+        """
+        self._auto_refresh = False
+        if self._refresh_timer:
+            self._refresh_timer.cancel()
+        if not self._shared_adapter:
+            self._session.close()
+
+    @property
+    def connection_stats(self):
+        """
+        Use of the connection pools of the session
+
+        Returns: list of ConnectionPoolStats namedtuples
+
+        """
+        return self.adapter.stats() if hasattr(self.adapter, 'stats') else []
+
     @property
     def token(self):
         """
@@ -323,14 +1047,12 @@ class StravaAuthenticator:
         Returns: string
 
         """
-        soup = Bfs(html_page, 'html.parser')
-        csrf_token = soup.find('meta',
-                               {'name': 'csrf-token'}).attrs.get('content')
-        return csrf_token
+        return find_csrf_token(html_page)
 
 
 class Strava:
-    def __new__(cls, client_id, client_secret, callback, scope, email, password):
+    def __new__(cls, client_id, client_secret, callback, scope, email, password,
+                **kwargs):
         """
         Main interface.
 
@@ -344,6 +1066,7 @@ class Strava:
             scope: comma separated string
             email: string
             password: string
+            **kwargs: extra options passed to StravaAuthenticator
 
         Returns: stravalib object
 
@@ -353,7 +1076,40 @@ class Strava:
                                             callback,
                                             scope,
                                             email,
-                                            password)
-        strava_client = OriginalStrava(access_token=authenticated.token.access_token,
-                                       requests_session=authenticated._session)
-        return strava_client
+                                            password,
+                                            **kwargs)
+        return cls.from_authenticator(authenticated)
+
+    @staticmethod
+    def from_refresh_token(client_id, client_secret, refresh_token, **kwargs):
+        """
+        Builds a client from a refresh token with a single request to Strava
+
+        Args:
+            client_id: string
+            client_secret: string
+            refresh_token: string
+            **kwargs: extra options passed to StravaAuthenticator
+
+        Returns: StravaClient object
+
+        """
+        authenticator = StravaAuthenticator.from_refresh_token(client_id, client_secret,
+                                                               refresh_token, **kwargs)
+        return Strava.from_authenticator(authenticator)
+
+    @staticmethod
+    def from_authenticator(authenticator):
+        """
+        Builds a stravalib client on top of an already authenticated session
+
+        Args:
+            authenticator: StravaAuthenticator object
+
+        Returns: StravaClient object
+
+        """
+        # stravalib is slow to import, it is only loaded once a client is built
+        from .client import StravaClient
+        return StravaClient(authenticator)
+
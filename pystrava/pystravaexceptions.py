@@ -40,3 +40,11 @@ __license__ = '''MIT'''
 __maintainer__ = '''Oriol Fabregas'''
 __email__ = '''<fabregas.oriol@gmail.com>'''
 __status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+class CircuitOpenError(Exception):
+    """The circuit breaker is open and the request was not sent to Strava."""
+
+
+class LockTimeoutError(Exception):
+    """Another process held the token store lock for longer than the timeout."""
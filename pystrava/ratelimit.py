@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: ratelimit.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Rate limit tracking and request pacing for pystrava
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from threading import Lock
+from .constants import (RateLimitState, RATE_LIMIT_SHORT, RATE_LIMIT_LONG,
+                        RATE_LIMIT_SHORT_WINDOW, RATE_LIMIT_LONG_WINDOW)
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+# This is the main prefix used for logging
+LOGGER_BASENAME = '''pystrava'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+
+def parse_rate_limit_headers(headers):
+    """
+    Parses Strava's X-RateLimit-Limit and X-RateLimit-Usage headers
+
+    Both hold the 15 minutes and the daily values separated by a comma.
+
+    Args:
+        headers: dictionary like response headers
+
+    Returns: tuple of (limits, usages) tuples or None if they are missing
+
+    """
+    limit = headers.get('X-RateLimit-Limit')
+    usage = headers.get('X-RateLimit-Usage')
+    if not limit or not usage:
+        return None
+    try:
+        limits = tuple(int(value) for value in limit.split(','))
+        usages = tuple(int(value) for value in usage.split(','))
+    except ValueError:
+        LOGGER.warning('Unable to parse rate limit headers %s and %s', limit, usage)
+        return None
+    if len(limits) != 2 or len(usages) != 2:
+        return None
+    return limits, usages
+
+
+class RateLimiter:
+    """
+    Live model of the Strava API budget, fed by the rate limit headers.
+
+    When pacing, requests go through a token bucket refilled at the rate that
+    spends the remaining budget evenly until the window resets, instead of
+    bursting through it and stalling on 429 responses. Strava resets the
+    short window every quarter of an hour and the long one at midnight UTC.
+
+    """
+
+    def __init__(self, pace=True, burst=10, short_limit=RATE_LIMIT_SHORT,
+                 long_limit=RATE_LIMIT_LONG):
+        """
+        Initialises object.
+
+        Args:
+            pace: boolean, whether acquire waits to spread requests
+            burst: integer, requests allowed back to back before pacing
+            short_limit: integer, 15 minutes quota until Strava reports it
+            long_limit: integer, daily quota until Strava reports it
+        """
+        self._logger = logging.getLogger('{base}.{suffix}'
+                                         .format(base=LOGGER_BASENAME,
+                                                 suffix=self.__class__.__name__)
+                                         )
+        self.pace = pace
+        self.burst = burst
+        self._lock = Lock()
+        self._limits = [short_limit, long_limit]
+        self._usages = [0, 0]
+        self._windows = self._current_windows()
+        self._tokens = float(burst)
+        self._last_refill = time.time()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Guards the budget while it is read or modified.
+
+        Subclasses sharing the budget with other processes load and save it
+        here.
+
+        Returns: context manager
+
+        """
+        with self._lock:
+            self._roll_windows()
+            yield
+
+    @staticmethod
+    def _current_windows(now=None):
+        now = time.time() if now is None else now
+        return (int(now // RATE_LIMIT_SHORT_WINDOW),
+                int(now // RATE_LIMIT_LONG_WINDOW))
+
+    def _roll_windows(self):
+        """
+        Forgets the usage of windows that already reset. Must hold the lock.
+
+        Returns: None
+
+        """
+        windows = self._current_windows()
+        for index, (window, current) in enumerate(zip(self._windows, windows)):
+            if window != current:
+                self._usages[index] = 0
+        self._windows = windows
+
+    def update(self, headers):
+        """
+        Updates the budget from the headers of a response
+
+        Args:
+            headers: dictionary like response headers
+
+        Returns: boolean, whether rate limit headers were found
+
+        """
+        parsed = parse_rate_limit_headers(headers)
+        if not parsed:
+            return False
+        limits, usages = parsed
+        with self._transaction():
+            self._limits = list(limits)
+            self._usages = list(usages)
+        return True
+
+    def exhaust(self):
+        """
+        Marks the short window as used up, after Strava answered with a 429
+
+        Returns: None
+
+        """
+        with self._transaction():
+            self._usages[0] = max(self._usages[0], self._limits[0])
+
+    def _rate(self, now):
+        """
+        Requests per second that spend the remaining budget until the resets
+
+        Args:
+            now: epoch timestamp
+
+        Returns: tuple of rate and seconds until the budget is available again
+
+        """
+        resets = self._resets(now)
+        rates = []
+        for limit, usage, reset in zip(self._limits, self._usages, resets):
+            remaining = limit - usage
+            if remaining <= 0:
+                return 0, reset - now
+            rates.append(remaining / max(reset - now, 1))
+        return min(rates), 0
+
+    def _resets(self, now):
+        return [(window + 1) * size
+                for window, size in zip(self._current_windows(now),
+                                        (RATE_LIMIT_SHORT_WINDOW, RATE_LIMIT_LONG_WINDOW))]
+
+    def acquire(self):
+        """
+        Takes one request from the budget, waiting for it when pacing
+
+        Returns: float, seconds waited
+
+        """
+        waited = 0
+        while True:
+            delay = self.reserve()
+            if not delay:
+                return waited
+            self._logger.debug('Pacing request for %.2f seconds', delay)
+            time.sleep(delay)
+            waited += delay
+
+    def reserve(self):
+        """
+        Takes one request from the budget if it is available without waiting
+
+        Callers that can't block, like coroutines, sleep on their own for the
+        returned delay and try again.
+
+        Returns: float, seconds to wait, 0 when the request was reserved
+
+        """
+        with self._transaction():
+            return self._reserve()
+
+    def wait_for_budget(self):
+        """
+        Waits until neither window is used up, even when not pacing
+
+        Returns: float, seconds waited
+
+        """
+        waited = 0
+        while True:
+            exhausted_for = self.exhausted_for()
+            if not exhausted_for:
+                return waited
+            self._logger.info('Rate limit budget used up, waiting %.0f seconds',
+                              exhausted_for)
+            time.sleep(exhausted_for)
+            waited += exhausted_for
+
+    def exhausted_for(self):
+        """
+        Seconds until a used up window resets
+
+        Returns: float, 0 when there is budget left
+
+        """
+        with self._transaction():
+            _, exhausted_for = self._rate(time.time())
+        return exhausted_for
+
+    def _reserve(self):
+        """
+        Reserves one request or tells how long to wait. Must hold the lock.
+
+        Returns: float, seconds to wait, 0 when the request was reserved
+
+        """
+        if not self.pace:
+            self._usages = [usage + 1 for usage in self._usages]
+            return 0
+        rate, exhausted_for = self._rate(time.time())
+        if exhausted_for:
+            return exhausted_for
+        now = time.time()
+        self._tokens = min(float(self.burst),
+                           self._tokens + max(now - self._last_refill, 0) * rate)
+        self._last_refill = now
+        if self._tokens < 1:
+            return (1 - self._tokens) / rate
+        self._tokens -= 1
+        self._usages = [usage + 1 for usage in self._usages]
+        return 0
+
+    @property
+    def state(self):
+        """
+        Current budget as last reported by Strava plus the requests sent since
+
+        Returns: RateLimitState namedtuple
+
+        """
+        with self._transaction():
+            short_reset, long_reset = self._resets(time.time())
+            return RateLimitState(self._limits[0], self._usages[0],
+                                  self._limits[1], self._usages[1],
+                                  short_reset, long_reset)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: retry.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Retry policy for pystrava sessions
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+from threading import Lock
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+# This is the main prefix used for logging
+LOGGER_BASENAME = '''pystrava'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE'])
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+def parse_retry_after(value):
+    """
+    Seconds to wait from a Retry-After header, in seconds or as an HTTP date
+
+    Args:
+        value: string
+
+    Returns: float or None if it can't be parsed
+
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of the requests.
+
+    Every request deposits ratio in the budget and every retry withdraws one,
+    so during an outage retries add at most that fraction of extra load
+    instead of multiplying it. A minimum of retries per second is always
+    allowed so that low traffic can still retry.
+
+    """
+
+    def __init__(self, ratio=0.1, min_per_second=1.0, capacity=20):
+        """
+        Initialises object.
+
+        Args:
+            ratio: float, retries allowed per request
+            min_per_second: float, retries allowed regardless of the traffic
+            capacity: float, maximum balance of the budget
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self._balance = float(capacity)
+        self._last_refill = time.monotonic()
+        self._lock = Lock()
+
+    def deposit(self):
+        """
+        Accounts for a request
+
+        Returns: None
+
+        """
+        with self._lock:
+            self._balance = min(self.capacity, self._balance + self.ratio)
+
+    def withdraw(self):
+        """
+        Takes one retry from the budget
+
+        Returns: boolean, whether the retry is allowed
+
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._balance = min(self.capacity,
+                                self._balance + (now - self._last_refill) * self.min_per_second)
+            self._last_refill = now
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+
+class RetryPolicy:
+    """
+    Retries failed requests with exponential backoff and full jitter.
+
+    Connection errors, timeouts and the retry statuses are retried, waiting
+    what Retry-After says when the response has it. Only idempotent methods
+    are retried unless retry_all_methods is set, and all retries go through a
+    RetryBudget. One policy can be shared between sessions to share the
+    budget.
+
+    """
+
+    def __init__(self, max_retries=3, backoff_factor=0.5, max_backoff=30,
+                 statuses=RETRY_STATUSES, retry_all_methods=False, budget=None):
+        """
+        Initialises object.
+
+        Args:
+            max_retries: integer, retries of a request
+            backoff_factor: seconds, the n-th retry waits up to
+                backoff_factor * 2 ** n
+            max_backoff: seconds, longest wait between attempts, a longer
+                Retry-After gives up retrying
+            statuses: iterable of HTTP statuses to retry
+            retry_all_methods: boolean, retry non idempotent methods too
+            budget: RetryBudget object, a default one if not given
+        """
+        self._logger = logging.getLogger('{base}.{suffix}'
+                                         .format(base=LOGGER_BASENAME,
+                                                 suffix=self.__class__.__name__)
+                                         )
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+        self.retry_all_methods = retry_all_methods
+        self.budget = budget or RetryBudget()
+        self.retries = 0
+        self.budget_exhausted = 0
+
+    def backoff(self, attempt):
+        """
+        Jittered wait before a retry
+
+        Args:
+            attempt: integer, number of attempts already failed minus one
+
+        Returns: seconds
+
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+
+    def retry_delay(self, method, attempt, response=None, error=None, rate_limiter=None):
+        """
+        Decides whether to retry an attempt and how long to wait before
+
+        Strava answers 429 without a Retry-After, a retry before the rate
+        limit window resets is bound to be refused again, so those wait for
+        the reset the rate limiter expects instead of backing off.
+
+        Args:
+            method: HTTP verb
+            attempt: integer, retries already made
+            response: Response object of the attempt
+            error: exception raised by the attempt
+            rate_limiter: RateLimiter object already told about the 429
+
+        Returns: seconds or None to not retry
+
+        """
+        if response is not None and response.status_code not in self.statuses:
+            return None
+        if attempt >= self.max_retries:
+            return None
+        if not self.retry_all_methods and method.upper() not in IDEMPOTENT_METHODS:
+            return None
+        delay = self.backoff(attempt)
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is None and response.status_code == 429 and rate_limiter:
+                retry_after = rate_limiter.exhausted_for()
+            if retry_after is not None:
+                if retry_after > self.max_backoff:
+                    self._logger.warning('Not retrying, rate limit resets in %s seconds',
+                                         retry_after)
+                    return None
+                delay = retry_after
+        if not self.budget.withdraw():
+            self._logger.warning('Retry budget exhausted, not retrying')
+            self.budget_exhausted += 1
+            return None
+        self.retries += 1
+        return delay
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: sharedstate.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+State shared between processes for pystrava
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import logging
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from .constants import Token
+from .pystravaexceptions import LockTimeoutError
+from .ratelimit import RateLimiter
+from .sqlitedb import SqliteDatabase
+from .tokenstore import TokenStore
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+# This is the main prefix used for logging
+LOGGER_BASENAME = '''pystrava'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tokens (
+    key TEXT PRIMARY KEY,
+    access_token TEXT NOT NULL,
+    token_type TEXT NOT NULL,
+    expires_at INTEGER NOT NULL,
+    expires_in INTEGER NOT NULL,
+    refresh_token TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rate_limits (
+    name TEXT PRIMARY KEY,
+    short_limit INTEGER NOT NULL,
+    short_usage INTEGER NOT NULL,
+    long_limit INTEGER NOT NULL,
+    long_usage INTEGER NOT NULL,
+    short_window INTEGER NOT NULL,
+    long_window INTEGER NOT NULL,
+    tokens REAL NOT NULL,
+    last_refill REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+'''
+
+
+class SqliteStateStore(SqliteDatabase, TokenStore):
+    """
+    Tokens and rate limit budgets in a SQLite file shared by several processes.
+
+    Every worker of a deployment points to the same file. A token refresh
+    holds a lease on the key of the token, so one worker renews an expired
+    token and the others pick it up, and the rate limit budget is paced
+    across all of them instead of per process.
+
+    Leases are rows claimed in short transactions, the database itself is
+    never locked while Strava is renewing a token, so the refreshes of other
+    athletes and the rate limiter carry on meanwhile.
+
+    """
+
+    schema = SCHEMA
+    private = True
+
+    def __init__(self, path, timeout=30, lease_duration=120, poll_interval=0.05):
+        """
+        Initialises object.
+
+        Args:
+            path: string, path of the SQLite file
+            timeout: seconds to wait for another process holding a lock
+            lease_duration: seconds after which the lease of a crashed
+                process is taken over, longer than a token request lasts
+            poll_interval: seconds between attempts to claim a held lease
+        """
+        super().__init__(path, timeout)
+        self.lease_duration = lease_duration
+        self.poll_interval = poll_interval
+
+    def load(self, key):
+        row = self._connection().execute(
+            'SELECT access_token, token_type, expires_at, expires_in, refresh_token '
+            'FROM tokens WHERE key = ?', (key,)).fetchone()
+        return Token(*row) if row else None
+
+    def save(self, key, token):
+        with self.transaction() as connection:
+            connection.execute('INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?, ?, ?)',
+                               (key,) + tuple(token))
+
+    def delete(self, key):
+        with self.transaction() as connection:
+            connection.execute('DELETE FROM tokens WHERE key = ?', (key,))
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Holds the lease of a key, nested calls of the same thread join it
+
+        Args:
+            key: string
+
+        Returns: context manager
+
+        """
+        leases = self._leases()
+        if key in leases:
+            yield
+            return
+        leases[key] = self._claim(key)
+        try:
+            yield
+        finally:
+            self._release(key, leases.pop(key))
+
+    def _leases(self):
+        """
+        Leases held by the current thread
+
+        Returns: dictionary of owner ids by key
+
+        """
+        leases = getattr(self._local, 'leases', None)
+        if leases is None:
+            leases = self._local.leases = {}
+        return leases
+
+    def _claim(self, key):
+        """
+        Waits until the lease of a key is free or expired and claims it
+
+        Args:
+            key: string
+
+        Returns: string, owner id to release the lease with
+
+        """
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + self.timeout
+        while True:
+            now = time.time()
+            try:
+                with self.transaction() as connection:
+                    row = connection.execute('SELECT expires_at FROM leases WHERE key = ?',
+                                             (key,)).fetchone()
+                    claimed = not row or row[0] <= now
+                    if claimed:
+                        connection.execute('INSERT OR REPLACE INTO leases VALUES (?, ?, ?)',
+                                           (key, owner, now + self.lease_duration))
+            except sqlite3.OperationalError as error:
+                self._logger.warning('Unable to claim the lease of %s: %s', key, error)
+                claimed = False
+            if claimed:
+                return owner
+            if time.monotonic() >= deadline:
+                raise LockTimeoutError(f'Lease of {key} held for more than '
+                                       f'{self.timeout} seconds')
+            time.sleep(self.poll_interval)
+
+    def _release(self, key, owner):
+        """
+        Frees the lease of a key unless it expired and was taken over
+
+        Args:
+            key: string
+            owner: string, owner id returned when claiming
+
+        Returns: None
+
+        """
+        try:
+            with self.transaction() as connection:
+                connection.execute('DELETE FROM leases WHERE key = ? AND owner = ?',
+                                   (key, owner))
+        except sqlite3.OperationalError as error:
+            # the lease expires on its own
+            self._logger.warning('Unable to release the lease of %s: %s', key, error)
+
+    def rate_limiter(self, name, **kwargs):
+        """
+        Rate limiter whose budget is shared through this store
+
+        Args:
+            name: string, usually the client id since quotas are per application
+            **kwargs: extra options passed to SharedRateLimiter
+
+        Returns: SharedRateLimiter object
+
+        """
+        return SharedRateLimiter(self, name, **kwargs)
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    RateLimiter keeping its budget and token bucket in a SqliteStateStore.
+
+    """
+
+    def __init__(self, store, name, **kwargs):
+        """
+        Initialises object.
+
+        Args:
+            store: SqliteStateStore object
+            name: string identifying the budget
+            **kwargs: extra options passed to RateLimiter
+        """
+        super().__init__(**kwargs)
+        self._store = store
+        self.name = name
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock, self._store.transaction() as connection:
+            row = connection.execute(
+                'SELECT short_limit, short_usage, long_limit, long_usage, '
+                'short_window, long_window, tokens, last_refill '
+                'FROM rate_limits WHERE name = ?', (self.name,)).fetchone()
+            if row:
+                (short_limit, short_usage, long_limit, long_usage,
+                 short_window, long_window, self._tokens, self._last_refill) = row
+                self._limits = [short_limit, long_limit]
+                self._usages = [short_usage, long_usage]
+                self._windows = (short_window, long_window)
+            self._roll_windows()
+            yield
+            connection.execute('INSERT OR REPLACE INTO rate_limits '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               (self.name,
+                                self._limits[0], self._usages[0],
+                                self._limits[1], self._usages[1],
+                                self._windows[0], self._windows[1],
+                                self._tokens, self._last_refill))
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: tokenstore.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Token persistence for pystrava
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from threading import Lock
+from .constants import Token
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+# This is the main prefix used for logging
+LOGGER_BASENAME = '''pystrava'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+
+def write_json(path, data):
+    """
+    Replaces a JSON file atomically, readable by the user only
+
+    A crashing process never leaves a truncated file behind.
+
+    Args:
+        path: string
+        data: JSON serialisable object
+
+    Returns: None
+
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix='.pystrava')
+    try:
+        with os.fdopen(file_descriptor, 'w') as json_file:
+            json.dump(data, json_file)
+        os.chmod(temporary_path, 0o600)
+        os.replace(temporary_path, path)
+    except Exception:
+        os.unlink(temporary_path)
+        raise
+
+
+def token_key(user, refresh_token=None):
+    """
+    Builds the key a token is stored under for a given user
+
+    Users without an email, known only by the refresh token they were built
+    from, are told apart by a digest of that refresh token.
+
+    Args:
+        user: User namedtuple
+        refresh_token: string, refresh token the client was built from
+
+    Returns: string or None if the user can't be identified
+
+    """
+    if user.email:
+        return f'{user.client_id}:{user.email}'
+    if refresh_token:
+        digest = hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()
+        return f'{user.client_id}:refresh-{digest[:32]}'
+    return None
+
+
+class TokenStore:
+    """
+    Interface for persisting Token namedtuples between process restarts.
+
+    Subclasses only need to implement load, save and delete.
+
+    """
+
+    def load(self, key):
+        """
+        Retrieves a stored token
+
+        Args:
+            key: string
+
+        Returns: Token namedtuple or None if nothing is stored
+
+        """
+        raise NotImplementedError
+
+    def save(self, key, token):
+        """
+        Stores a token, replacing any previous one
+
+        Args:
+            key: string
+            token: Token namedtuple
+
+        Returns: None
+
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """
+        Removes a stored token if there is any
+
+        Args:
+            key: string
+
+        Returns: None
+
+        """
+        raise NotImplementedError
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Serialises token refreshes between the users of the store.
+
+        Stores shared between processes hold a lock here so only one of them
+        refreshes an expired token while the others wait and load it.
+
+        Args:
+            key: string
+
+        Returns: context manager
+
+        """
+        yield
+
+
+class MemoryTokenStore(TokenStore):
+    """
+    Keeps tokens in a dictionary. Useful for tests and for sharing tokens
+    between clients living in the same process.
+
+    """
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = Lock()
+
+    def load(self, key):
+        with self._lock:
+            return self._tokens.get(key)
+
+    def save(self, key, token):
+        with self._lock:
+            self._tokens[key] = token
+
+    def delete(self, key):
+        with self._lock:
+            self._tokens.pop(key, None)
+
+
+class FileTokenStore(TokenStore):
+    """
+    Keeps tokens in a JSON file on disk.
+
+    The file is rewritten atomically so a crashing process never leaves a
+    truncated file behind. It is created with user only permissions since it
+    holds credentials.
+
+    """
+
+    def __init__(self, path):
+        """
+        Initialises object.
+
+        Args:
+            path: string, path of the JSON file
+        """
+        self._logger = logging.getLogger('{base}.{suffix}'
+                                         .format(base=LOGGER_BASENAME,
+                                                 suffix=self.__class__.__name__)
+                                         )
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self._lock = Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as token_file:
+                return json.load(token_file)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            self._logger.warning('Ignoring corrupted token file %s', self.path)
+            return {}
+
+    def _write(self, tokens):
+        write_json(self.path, tokens)
+
+    def load(self, key):
+        with self._lock:
+            values = self._read().get(key)
+        if not values:
+            return None
+        try:
+            return Token(**values)
+        except TypeError:
+            self._logger.warning('Ignoring malformed token stored for %s', key)
+            return None
+
+    def save(self, key, token):
+        with self._lock:
+            tokens = self._read()
+            tokens[key] = token._asdict()
+            self._write(tokens)
+
+    def delete(self, key):
+        with self._lock:
+            tokens = self._read()
+            if tokens.pop(key, None) is not None:
+                self._write(tokens)
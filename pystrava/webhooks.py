@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: webhooks.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Strava webhook events for pystrava
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import json
+import logging
+import queue
+from threading import Thread
+from urllib.parse import parse_qsl
+from requests import Session
+from .constants import WebhookEvent, SITE
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+# This is the main prefix used for logging
+LOGGER_BASENAME = '''pystrava'''
+LOGGER = logging.getLogger(LOGGER_BASENAME)
+LOGGER.addHandler(logging.NullHandler())
+
+STATUS_LINES = {200: '200 OK',
+                400: '400 Bad Request',
+                403: '403 Forbidden',
+                405: '405 Method Not Allowed'}
+
+
+class WebhookSubscriptions:
+    """
+    Manages the push subscription of an application.
+
+    Strava allows one subscription per application, it sends the events of
+    every athlete that authorised it to the callback URL.
+
+    """
+
+    def __init__(self, client_id, client_secret, session=None):
+        """
+        Initialises object.
+
+        Args:
+            client_id: string
+            client_secret: string
+            session: requests Session to use, a new one when not given
+        """
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self._session = session or Session()
+
+    @property
+    def _credentials(self):
+        return {'client_id': self.client_id, 'client_secret': self.client_secret}
+
+    def create(self, callback_url, verify_token):
+        """
+        Subscribes the callback URL to the events of the application.
+
+        Strava validates the callback with a GET request before answering, so
+        the receiver must already be reachable.
+
+        Args:
+            callback_url: string, public URL of the WebhookReceiver
+            verify_token: string, the verify_token of the WebhookReceiver
+
+        Returns: integer, id of the subscription
+
+        """
+        data = dict(self._credentials, callback_url=callback_url,
+                    verify_token=verify_token)
+        response = self._session.post(f'{SITE}/api/v3/push_subscriptions', data=data)
+        response.raise_for_status()
+        return response.json()['id']
+
+    def list(self):
+        """
+        Subscriptions of the application
+
+        Returns: list of dictionaries with the id and callback_url
+
+        """
+        response = self._session.get(f'{SITE}/api/v3/push_subscriptions',
+                                     params=self._credentials)
+        response.raise_for_status()
+        return response.json()
+
+    def delete(self, subscription_id):
+        """
+        Stops the events of a subscription
+
+        Args:
+            subscription_id: integer
+
+        Returns: None
+
+        """
+        response = self._session.delete(
+            f'{SITE}/api/v3/push_subscriptions/{subscription_id}',
+            params=self._credentials)
+        response.raise_for_status()
+
+
+def parse_event(payload):
+    """
+    Builds an event from the body Strava posts to the callback
+
+    Args:
+        payload: dictionary
+
+    Returns: WebhookEvent namedtuple
+
+    """
+    return WebhookEvent(payload['object_type'],
+                        int(payload['object_id']),
+                        payload['aspect_type'],
+                        int(payload['owner_id']),
+                        int(payload['subscription_id']),
+                        int(payload['event_time']),
+                        payload.get('updates') or {})
+
+
+class WebhookReceiver:
+    """
+    Callback endpoint of a webhook subscription as a WSGI and ASGI application.
+
+    It answers the validation handshake of Strava and puts the events posted
+    afterwards in a queue. Strava expects an answer within two seconds, so
+    nothing else is done while handling the request.
+
+    """
+
+    def __init__(self, verify_token, subscription_id=None, events=None):
+        """
+        Initialises object.
+
+        Args:
+            verify_token: string, shared with Strava when subscribing
+            subscription_id: integer, events of other subscriptions are refused
+            events: queue the events are put in, a new Queue when not given
+        """
+        self._logger = logging.getLogger('{base}.{suffix}'
+                                         .format(base=LOGGER_BASENAME,
+                                                 suffix=self.__class__.__name__)
+                                         )
+        self.verify_token = verify_token
+        self.subscription_id = subscription_id
+        self.events = events if events is not None else queue.Queue()
+
+    def handle(self, method, query_string, body):
+        """
+        Answers a request to the callback
+
+        Args:
+            method: string, HTTP method
+            query_string: string
+            body: bytes
+
+        Returns: tuple of integer status and dictionary to send as JSON
+
+        """
+        if method == 'GET':
+            return self._validate(dict(parse_qsl(query_string)))
+        if method != 'POST':
+            return 405, {'error': 'method not allowed'}
+        try:
+            event = parse_event(json.loads(body))
+        except (ValueError, KeyError, TypeError):
+            self._logger.warning('Ignoring malformed webhook event %r', body[:200])
+            return 400, {'error': 'malformed event'}
+        if self.subscription_id is not None and event.subscription_id != self.subscription_id:
+            self._logger.warning('Refusing event of subscription %s', event.subscription_id)
+            return 403, {'error': 'unknown subscription'}
+        self.events.put(event)
+        return 200, {}
+
+    def _validate(self, params):
+        if params.get('hub.mode') != 'subscribe' or \
+                params.get('hub.verify_token') != self.verify_token:
+            self._logger.warning('Refusing subscription validation with mode %s',
+                                 params.get('hub.mode'))
+            return 403, {'error': 'invalid verify token'}
+        return 200, {'hub.challenge': params.get('hub.challenge', '')}
+
+    def __call__(self, environ, start_response):
+        """WSGI application"""
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        body = environ['wsgi.input'].read(length) if length else b''
+        status, payload = self.handle(environ['REQUEST_METHOD'],
+                                      environ.get('QUERY_STRING', ''), body)
+        content = json.dumps(payload).encode()
+        start_response(STATUS_LINES[status], [('Content-Type', 'application/json'),
+                                              ('Content-Length', str(len(content)))])
+        return [content]
+
+    async def asgi(self, scope, receive, send):
+        """ASGI application"""
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        body, more_body = b'', True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        status, payload = self.handle(scope['method'],
+                                      scope.get('query_string', b'').decode('latin-1'),
+                                      body)
+        content = json.dumps(payload).encode()
+        await send({'type': 'http.response.start',
+                    'status': status,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(content)).encode())]})
+        await send({'type': 'http.response.body', 'body': content})
+
+
+class EventDispatcher:
+    """
+    Fetches the objects named by webhook events and hands them to a handler.
+
+    Activities are fetched with the session of the authenticator of their
+    owner, so only the events actually received cost API requests. Deleted
+    objects and athlete events, which carry everything in their updates, are
+    handed over without a fetch.
+
+    """
+
+    def __init__(self, events, authenticator_for, handler, workers=2):
+        """
+        Initialises object.
+
+        Args:
+            events: queue of WebhookEvent namedtuples, usually WebhookReceiver.events
+            authenticator_for: callable taking an owner id and returning its
+                StravaAuthenticator, or None to skip the event
+            handler: callable taking a WebhookEvent and the fetched JSON
+                dictionary or None
+            workers: integer, events processed at the same time
+        """
+        self._logger = logging.getLogger('{base}.{suffix}'
+                                         .format(base=LOGGER_BASENAME,
+                                                 suffix=self.__class__.__name__)
+                                         )
+        self.events = events
+        self.authenticator_for = authenticator_for
+        self.handler = handler
+        self._threads = [Thread(target=self._work, daemon=True) for _ in range(workers)]
+
+    def fetch(self, event):
+        """
+        Retrieves the object an event is about
+
+        The cached copy of the activity is dropped first, the event means it
+        changed.
+
+        Args:
+            event: WebhookEvent namedtuple
+
+        Returns: dictionary or None when there is nothing to fetch
+
+        """
+        if event.object_type != 'activity':
+            return None
+        authenticator = self.authenticator_for(event.owner_id)
+        if authenticator is None:
+            self._logger.info('No authenticator for athlete %s, skipping event',
+                              event.owner_id)
+            return None
+        url = f'{SITE}/api/v3/activities/{event.object_id}'
+        authenticator.invalidate_cache(url)
+        if event.aspect_type == 'delete':
+            return None
+        response = authenticator._session.get(url)
+        response.raise_for_status()
+        return response.json()
+
+    def dispatch(self, event):
+        """
+        Fetches the object of an event and calls the handler with it
+
+        Args:
+            event: WebhookEvent namedtuple
+
+        Returns: None
+
+        """
+        self.handler(event, self.fetch(event))
+
+    def _work(self):
+        while True:
+            event = self.events.get()
+            try:
+                if event is None:
+                    return
+                self.dispatch(event)
+            except Exception:  # pylint: disable=broad-except
+                self._logger.exception('Failed to dispatch %s', event)
+            finally:
+                self.events.task_done()
+
+    def start(self):
+        """
+        Starts processing events in background threads
+
+        Returns: EventDispatcher object
+
+        """
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """
+        Processes the events already queued and stops the threads
+
+        Returns: None
+
+        """
+        for _ in self._threads:
+            self.events.put(None)
+        for thread in self._threads:
+            thread.join()
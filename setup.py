@@ -50,6 +50,7 @@ setup(
                  '''pystrava'''},
     include_package_data=True,
     install_requires=requirements,
+    extras_require={'async': ['aiohttp>=3.5']},
     license='MIT',
     zip_safe=False,
     keywords='''pystrava strava auth''',
@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# File: fakestrava.py
+#
+# Copyright 2018 Oriol Fabregas
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to
+#  deal in the Software without restriction, including without limitation the
+#  rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+#  sell copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+"""
+fakestrava
+----------------------------------
+Local stand-in for the Strava endpoints used by pystrava.
+
+.. _Google Python Style Guide:
+   http://google.github.io/styleguide/pyguide.html
+
+"""
+
+import json
+import random
+import time
+import uuid
+from urllib.request import Request, urlopen
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qsl, urlencode, urlparse
+from pystrava import INVALID_TOKEN_MSG
+
+__author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
+__docformat__ = '''google'''
+__date__ = '''2018-08-22'''
+__copyright__ = '''Copyright 2018, Oriol Fabregas'''
+__credits__ = ["Oriol Fabregas"]
+__license__ = '''MIT'''
+__maintainer__ = '''Oriol Fabregas'''
+__email__ = '''<fabregas.oriol@gmail.com>'''
+__status__ = '''Development'''  # "Prototype", "Development", "Production".
+
+
+class FakeStravaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Strava</title>
+<meta name="csrf-param" content="authenticity_token" />
+<meta name="csrf-token" content="{csrf}" />
+</head>
+<body>{body}</body>
+</html>
+'''
+
+SESSION_COOKIE = '_strava4_session'
+
+
+class FakeStravaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.fake.count_connection()
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_page(self, csrf, body='', headers=None):
+        time.sleep(self.server.fake.page_delay)
+        payload = PAGE.format(csrf=csrf, body=body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_failure(self, status, headers):
+        headers.update(self.server.fake.count_api_request())
+        self._send_json(status, {'message': 'Injected failure'}, headers)
+
+    def _redirect(self, location):
+        time.sleep(self.server.fake.page_delay)
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _session_id(self):
+        for cookie in self.headers.get('Cookie', '').split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == SESSION_COOKIE:
+                return value
+        return None
+
+    def _read_form(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return dict(parse_qsl(self.rfile.read(length).decode()))
+
+    def _access_token(self):
+        authorization = self.headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            return authorization[len('Bearer '):]
+        return dict(parse_qsl(urlparse(self.path).query)).get('access_token')
+
+    def do_POST(self):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        form = self._read_form()
+        failure = fake.next_failure() if url.path.startswith('/api/') else None
+        if failure:
+            self._send_failure(*failure)
+        elif url.path == '/oauth/token':
+            if not fake.is_valid_grant(form):
+                self._send_json(400, {'message': 'Bad Request'})
+            else:
+                self._send_json(200, fake.issue_token(form))
+        elif url.path == '/session':
+            session_id = fake.login(form)
+            if not session_id:
+                self._send_page(fake.login_csrf, 'The username or password did not match.')
+            else:
+                self._send_page(fake.app_csrf, 'Authorize application',
+                                {'Set-Cookie': f'{SESSION_COOKIE}={session_id}; Path=/'})
+        elif url.path == '/api/v3/push_subscriptions':
+            subscription_id = fake.subscribe(form)
+            if subscription_id is None:
+                self._send_json(400, {'message': 'Bad Request',
+                                      'errors': [{'field': 'callback url',
+                                                  'code': 'GET to callback URL does not return 200'}]})
+            else:
+                self._send_json(201, {'id': subscription_id})
+        elif url.path == '/oauth/accept_application':
+            query = dict(parse_qsl(url.query))
+            if not fake.is_logged_in(self._session_id()) or \
+                    form.get('authenticity_token') != fake.app_csrf:
+                self._send_json(401, {'message': 'Authorization Error'})
+            else:
+                self._redirect('{callback}?{query}'.format(
+                    callback=query.get('redirect_uri'),
+                    query=urlencode({'state': '', 'code': fake.code,
+                                     'scope': query.get('scope')})))
+        else:
+            self._send_json(404, {'message': 'Record Not Found'})
+
+    def do_GET(self):
+        fake = self.server.fake
+        path = urlparse(self.path).path
+        failure = fake.next_failure() if path.startswith('/api/') else None
+        if path in ('/login', '/oauth/authorize'):
+            self._send_page(fake.login_csrf, 'Log In')
+        elif failure:
+            self._send_failure(*failure)
+        elif path == '/api/v3/push_subscriptions':
+            self._send_json(200, fake.list_subscriptions())
+        elif not fake.is_valid(self._access_token()):
+            self._send_json(401, INVALID_TOKEN_MSG, fake.count_api_request())
+        elif path == '/api/v3/athlete':
+            self._send_json(200, {'id': 1, 'firstname': 'Fake'}, fake.count_api_request())
+        elif path.startswith('/api/v3/activities/'):
+            activity_id = path.rsplit('/', 1)[-1]
+            name = fake.activity_names.get(activity_id, f'Activity {activity_id}')
+            headers = fake.count_api_request()
+            headers.update({'ETag': f'"activity-{activity_id}-{len(name)}"'})
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                self.send_response(304)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+            else:
+                self._send_json(200, {'id': int(activity_id), 'name': name,
+                                      'description': 'x' * 1000}, headers)
+        else:
+            self._send_json(404, {'message': 'Record Not Found'}, fake.count_api_request())
+
+    def do_PUT(self):
+        fake = self.server.fake
+        path = urlparse(self.path).path
+        form = self._read_form()
+        if not fake.is_valid(self._access_token()):
+            self._send_json(401, INVALID_TOKEN_MSG, fake.count_api_request())
+        elif path.startswith('/api/v3/activities/'):
+            activity_id = path.rsplit('/', 1)[-1]
+            fake.activity_names[activity_id] = form.get('name', f'Activity {activity_id}')
+            self._send_json(200, {'id': int(activity_id),
+                                  'name': fake.activity_names[activity_id]},
+                            fake.count_api_request())
+        else:
+            self._send_json(404, {'message': 'Record Not Found'}, fake.count_api_request())
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_DELETE(self):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        subscription_id = url.path.rsplit('/', 1)[-1]
+        if url.path.startswith('/api/v3/push_subscriptions/') and \
+                fake.unsubscribe(int(subscription_id)):
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self._send_json(404, {'message': 'Record Not Found'})
+
+
+class FakeStrava:
+    """
+    Threaded HTTP server mimicking Strava.
+
+    It hands out sequential access tokens and keeps count of the token
+    requests it served. Latency can be added to the login pages, the token
+    endpoint and the API, and API requests fail at error_rate with
+    error_status on top of the failures queued with fail_next.
+    """
+
+    def __init__(self, token_delay=0, api_delay=0, email='athlete@example.com',
+                 password='password', page_delay=0, error_rate=0, error_status=503,
+                 seed=None):
+        self.token_delay = token_delay
+        self.api_delay = api_delay
+        self.page_delay = page_delay
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self.accounts = {email: password}
+        self.login_csrf = uuid.uuid4().hex
+        self.app_csrf = uuid.uuid4().hex
+        self.code = uuid.uuid4().hex
+        self.sessions = set()
+        self.token_requests = 0
+        self.rate_limits = (600, 30000)
+        self.api_requests = 0
+        self.connections = 0
+        self.failures = []
+        self.subscriptions = {}
+        self.activity_names = {}
+        self.revoked_refresh_tokens = set()
+        self._issued = 0
+        self._valid_token = None
+        self._lock = Lock()
+        self._server = FakeStravaServer(('127.0.0.1', 0), FakeStravaHandler)
+        self._server.fake = self
+        self._thread = Thread(target=self._server.serve_forever, args=(0.05,),
+                              daemon=True)
+
+    @property
+    def url(self):
+        # a host name rather than an IP, aiohttp ignores cookies set by IPs
+        return f'http://localhost:{self._server.server_address[1]}'
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def issue_token(self, form):
+        time.sleep(self.token_delay)
+        with self._lock:
+            self.token_requests += 1
+            self._issued += 1
+            self._valid_token = f'access-{self._issued}'
+            return {'access_token': self._valid_token,
+                    'token_type': 'Bearer',
+                    'expires_at': int(time.time()) + 21600,
+                    'expires_in': 21600,
+                    'refresh_token': f'refresh-{self._issued}'}
+
+    def fail_next(self, status, count=1, headers=None):
+        with self._lock:
+            self.failures.extend((status, dict(headers or {})) for _ in range(count))
+
+    def next_failure(self):
+        with self._lock:
+            if self.failures:
+                return self.failures.pop(0)
+            if self.error_rate and self._random.random() < self.error_rate:
+                return self.error_status, {}
+            return None
+
+    def count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def count_api_request(self):
+        time.sleep(self.api_delay)
+        with self._lock:
+            self.api_requests += 1
+            usage = self.api_requests
+        return {'X-RateLimit-Limit': '{},{}'.format(*self.rate_limits),
+                'X-RateLimit-Usage': f'{usage},{usage}'}
+
+    def login(self, form):
+        if form.get('authenticity_token') != self.login_csrf or \
+                self.accounts.get(form.get('email')) != form.get('password'):
+            return None
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self.sessions.add(session_id)
+        return session_id
+
+    def is_logged_in(self, session_id):
+        with self._lock:
+            return session_id in self.sessions
+
+    def is_valid_grant(self, form):
+        if form.get('grant_type') == 'authorization_code':
+            return form.get('code') == self.code
+        return form.get('grant_type') == 'refresh_token' and \
+            form.get('refresh_token') not in self.revoked_refresh_tokens
+
+    def is_valid(self, access_token):
+        with self._lock:
+            return access_token is not None and access_token == self._valid_token
+
+    def expire_tokens(self):
+        with self._lock:
+            self._valid_token = None
+
+    def subscribe(self, form):
+        challenge = uuid.uuid4().hex
+        query = urlencode({'hub.mode': 'subscribe', 'hub.challenge': challenge,
+                           'hub.verify_token': form.get('verify_token', '')})
+        try:
+            with urlopen(f"{form.get('callback_url')}?{query}", timeout=2) as response:
+                if json.load(response).get('hub.challenge') != challenge:
+                    return None
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            subscription_id = len(self.subscriptions) + 1
+            self.subscriptions[subscription_id] = form['callback_url']
+        return subscription_id
+
+    def list_subscriptions(self):
+        with self._lock:
+            return [{'id': subscription_id, 'callback_url': callback_url}
+                    for subscription_id, callback_url in self.subscriptions.items()]
+
+    def unsubscribe(self, subscription_id):
+        with self._lock:
+            return self.subscriptions.pop(subscription_id, None) is not None
+
+    def send_event(self, object_type, object_id, aspect_type, owner_id, updates=None):
+        """Posts an event to every subscription like Strava does, returns the statuses."""
+        event = json.dumps({'object_type': object_type, 'object_id': object_id,
+                            'aspect_type': aspect_type, 'owner_id': owner_id,
+                            'updates': updates or {}, 'event_time': int(time.time())})
+        statuses = []
+        for subscription in self.list_subscriptions():
+            body = dict(json.loads(event), subscription_id=subscription['id'])
+            request = Request(subscription['callback_url'], data=json.dumps(body).encode(),
+                              headers={'Content-Type': 'application/json'})
+            try:
+                with urlopen(request, timeout=2) as response:
+                    statuses.append(response.status)
+            except OSError as error:
+                statuses.append(getattr(error, 'code', None))
+        return statuses
@@ -33,7 +33,37 @@ Tests for `pystrava` module.
 
 """
 
+import asyncio
+import datetime
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import TestCase, mock
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import make_server, WSGIRequestHandler
 from betamax.fixtures import unittest
+from requests.exceptions import HTTPError, ChunkedEncodingError
+from pystrava import (StravaAuthenticator, Token, FileTokenStore, MemoryTokenStore,
+                      StravaPool, PoolStats, Strava, RateLimiter, SqliteStateStore,
+                      ResponseCache, RequestCoalescer, BatchResult, ActivityStore)
+from pystrava.retry import RetryPolicy, RetryBudget, parse_retry_after
+from pystrava.circuitbreaker import CircuitBreaker
+from pystrava.pystravaexceptions import CircuitOpenError, LockTimeoutError
+from pystrava.aio import AsyncStrava, AsyncStravaAuthenticator
+from pystrava.csrf import CsrfTokenScanner, find_csrf_token
+from pystrava.tokenstore import token_key
+from pystrava.client import StravaClient
+from pystrava.pagination import split_window
+from pystrava.metrics import PrometheusMetrics, CallbackMetrics
+from pystrava.profiling import AuthProfiler
+from pystrava.cookiestore import FileCookieStore
+from pystrava.webhooks import WebhookReceiver, WebhookSubscriptions, EventDispatcher
+from pystrava.constants import WebhookEvent
+from .fakestrava import FakeStrava
 
 __author__ = '''Oriol Fabregas <fabregas.oriol@gmail.com>'''
 __docformat__ = '''google'''
@@ -63,3 +93,1295 @@ class TestPystrava(unittest.BetamaxTestCase):
         This is where you should tear down what you've setup in setUp before. This method is called after every test.
         """
         pass
+
+
+def build_token(expires_in=3600, access_token='access', refresh_token='refresh'):
+    return Token(access_token, 'Bearer', int(time.time()) + expires_in,
+                 expires_in, refresh_token)
+
+
+def build_authenticator(**kwargs):
+    arguments = dict(client_id='1', client_secret='secret',
+                     callback='http://localhost.local/callback',
+                     scope='read', email='athlete@example.com',
+                     password='password')
+    arguments.update(kwargs)
+    return StravaAuthenticator(**arguments)
+
+
+def build_datetime(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc)
+
+
+class TestTokenStore(TestCase):
+
+    def test_file_store_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tokens.json')
+            token = build_token()
+            FileTokenStore(path).save('1:athlete@example.com', token)
+            self.assertEqual(FileTokenStore(path).load('1:athlete@example.com'), token)
+            self.assertIsNone(FileTokenStore(path).load('2:athlete@example.com'))
+            FileTokenStore(path).delete('1:athlete@example.com')
+            self.assertIsNone(FileTokenStore(path).load('1:athlete@example.com'))
+
+    def test_valid_stored_token_skips_login(self):
+        store = MemoryTokenStore()
+        token = build_token()
+        store.save('1:athlete@example.com', token)
+        with mock.patch.object(StravaAuthenticator, '_accept_application') as login:
+            authenticator = build_authenticator(token_store=store)
+        login.assert_not_called()
+        self.assertEqual(authenticator.token, token)
+
+    def test_expired_stored_token_is_refreshed(self):
+        store = MemoryTokenStore()
+        store.save('1:athlete@example.com', build_token(expires_in=-10))
+        renewed = build_token(access_token='renewed')
+        with mock.patch.object(StravaAuthenticator, '_accept_application') as login, \
+                mock.patch.object(StravaAuthenticator, '_renew_token',
+                                  return_value=renewed):
+            authenticator = build_authenticator(token_store=store)
+        login.assert_not_called()
+        self.assertEqual(authenticator.token, renewed)
+        self.assertEqual(store.load(token_key(authenticator.user)), renewed)
+
+    def test_failed_refresh_falls_back_to_login(self):
+        store = MemoryTokenStore()
+        store.save('1:athlete@example.com', build_token(expires_in=-10))
+        fresh = build_token(access_token='fresh')
+        with mock.patch.object(StravaAuthenticator, '_accept_application') as login, \
+                mock.patch.object(StravaAuthenticator, '_renew_token',
+                                  side_effect=ValueError), \
+                mock.patch.object(StravaAuthenticator, '_exchange_token',
+                                  return_value=fresh):
+            authenticator = build_authenticator(token_store=store)
+        login.assert_called_once_with()
+        self.assertEqual(authenticator.token, fresh)
+        self.assertEqual(store.load(token_key(authenticator.user)), fresh)
+
+
+def build_logged_in_authenticator(token, **kwargs):
+    with mock.patch.object(StravaAuthenticator, '_accept_application'), \
+            mock.patch.object(StravaAuthenticator, '_exchange_token',
+                              return_value=token):
+        return build_authenticator(**kwargs)
+
+
+class TestProactiveRefresh(TestCase):
+
+    def test_expiring_token_is_refreshed_before_request(self):
+        authenticator = build_logged_in_authenticator(build_token(expires_in=30),
+                                                      refresh_margin=60)
+        renewed = build_token(access_token='renewed')
+        authenticator._session.renew_token = mock.Mock(return_value=renewed)
+        authenticator._session.original_request = mock.Mock(
+            return_value=mock.Mock(status_code=200, headers={}))
+        authenticator._session.get('https://www.strava.com/api/v3/athlete',
+                                   params={'page': 2},
+                                   headers={'Authorization': 'Bearer access'})
+        authenticator._session.renew_token.assert_called_once()
+        _, kwargs = authenticator._session.original_request.call_args
+        self.assertEqual(kwargs['params'], {'page': 2})
+        self.assertEqual(kwargs['headers']['Authorization'], 'Bearer renewed')
+        self.assertEqual(authenticator.token, renewed)
+
+    def test_valid_token_is_not_refreshed(self):
+        authenticator = build_logged_in_authenticator(build_token())
+        authenticator._session.renew_token = mock.Mock()
+        authenticator._session.original_request = mock.Mock(
+            return_value=mock.Mock(status_code=200, headers={}))
+        authenticator._session.get('https://www.strava.com/api/v3/athlete')
+        authenticator._session.renew_token.assert_not_called()
+
+    def test_background_timer_refreshes_ahead_of_expiry(self):
+        refreshed = threading.Event()
+        renewed = build_token(access_token='renewed')
+
+        def renew(*_):
+            refreshed.set()
+            return renewed
+
+        with mock.patch.object(StravaAuthenticator, '_renew_token', side_effect=renew):
+            authenticator = build_logged_in_authenticator(build_token(expires_in=1),
+                                                          refresh_margin=0.9,
+                                                          auto_refresh=True)
+            try:
+                self.assertTrue(refreshed.wait(5))
+                deadline = time.time() + 5
+                while authenticator.token != renewed and time.time() < deadline:
+                    time.sleep(0.01)
+            finally:
+                authenticator.close()
+        self.assertEqual(authenticator.token, renewed)
+
+
+    def test_background_refresh_is_retried_after_store_errors(self):
+        authenticator = build_logged_in_authenticator(build_token())
+        with mock.patch.object(authenticator, '_refresh_token',
+                               side_effect=LockTimeoutError('lease held')), \
+                mock.patch.object(authenticator, '_schedule_refresh') as schedule:
+            with self.assertLogs('pystrava', level='ERROR'):
+                authenticator._background_refresh()
+        schedule.assert_called_once_with(delay=30)
+        authenticator.close()
+
+class TestSingleFlightRefresh(TestCase):
+
+    def setUp(self):
+        self.fake = FakeStrava(token_delay=0.05).start()
+        self.site = mock.patch('pystrava.pystrava.SITE', self.fake.url)
+        self.site.start()
+
+    def tearDown(self):
+        self.site.stop()
+        self.fake.stop()
+
+    def test_one_refresh_per_expiry_under_concurrency(self):
+        token = Token(**self.fake.issue_token({}))
+        authenticator = build_logged_in_authenticator(token)
+        threads = 64
+        barrier = threading.Barrier(threads)
+
+        def fetch_athlete(_):
+            barrier.wait()
+            return authenticator._session.get(f'{self.fake.url}/api/v3/athlete',
+                                              headers={'Authorization': 'Bearer stale'})
+
+        for expiry in range(1, 3):
+            self.fake.expire_tokens()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                responses = list(executor.map(fetch_athlete, range(threads)))
+            self.assertEqual([response.status_code for response in responses],
+                             [200] * threads)
+            self.assertEqual(self.fake.token_requests, 1 + expiry)
+        authenticator.close()
+
+
+class TestStravaPool(TestCase):
+
+    def setUp(self):
+        self.logins = []
+
+        def exchange_token(authenticator, _):
+            self.logins.append(authenticator.user.email)
+            return build_token(access_token=authenticator.user.email)
+
+        self.patches = [mock.patch.object(StravaAuthenticator, '_accept_application'),
+                        mock.patch.object(StravaAuthenticator, '_exchange_token',
+                                          autospec=True, side_effect=exchange_token)]
+        for patch in self.patches:
+            patch.start()
+        self.pool = StravaPool('1', 'secret', 'http://localhost.local/callback',
+                               'read', max_clients=2)
+
+    def tearDown(self):
+        self.pool.close()
+        for patch in self.patches:
+            patch.stop()
+
+    def test_clients_are_reused_and_evicted_in_lru_order(self):
+        first = self.pool.get('a@example.com', 'password')
+        self.pool.get('b@example.com', 'password')
+        self.assertIs(self.pool.get('a@example.com', 'password'), first)
+        self.pool.get('c@example.com', 'password')
+        self.assertIn('a@example.com', self.pool)
+        self.assertNotIn('b@example.com', self.pool)
+        self.assertEqual(self.pool.stats, PoolStats(hits=1, misses=3, evictions=1, size=2))
+
+    def test_evicted_client_is_rebuilt_from_its_token(self):
+        self.pool.get('a@example.com', 'password')
+        self.pool.get('b@example.com', 'password')
+        self.pool.get('c@example.com', 'password')
+        client = self.pool.get('a@example.com', 'password')
+        self.assertEqual(self.logins, ['a@example.com', 'b@example.com', 'c@example.com'])
+        self.assertEqual(client.access_token, 'a@example.com')
+
+    def test_clients_share_one_connection_pool(self):
+        first = self.pool.get('a@example.com', 'password')
+        second = self.pool.get('b@example.com', 'password')
+        self.assertIs(first.protocol.rsession.get_adapter('https://www.strava.com'),
+                      second.protocol.rsession.get_adapter('https://www.strava.com'))
+
+
+class TestAuthenticationFlow(TestCase):
+
+    def setUp(self):
+        self.fake = FakeStrava().start()
+        self.sites = [mock.patch(f'pystrava.{module}.SITE', self.fake.url)
+                      for module in ('pystrava', 'aio')]
+        for site in self.sites:
+            site.start()
+
+    def tearDown(self):
+        for site in self.sites:
+            site.stop()
+        self.fake.stop()
+
+    def test_login_flow(self):
+        authenticator = build_authenticator()
+        self.assertEqual(authenticator.token.access_token, 'access-1')
+        response = authenticator._session.get(f'{self.fake.url}/api/v3/athlete')
+        self.assertEqual(response.json()['firstname'], 'Fake')
+
+    def test_async_login_flow_and_refresh(self):
+        async def run():
+            async with await AsyncStrava.login('1', 'secret',
+                                               'http://localhost.local/callback',
+                                               'read', 'athlete@example.com',
+                                               'password') as strava:
+                self.assertEqual(strava.authenticator.token.access_token, 'access-1')
+                self.fake.expire_tokens()
+                athletes = await asyncio.gather(*[strava.get_athlete()
+                                                  for _ in range(32)])
+                self.assertEqual(strava.authenticator.token.access_token, 'access-2')
+                self.assertEqual(strava.rate_limit.short_limit, 600)
+                return athletes
+
+        athletes = asyncio.run(run())
+        self.assertEqual([athlete['firstname'] for athlete in athletes], ['Fake'] * 32)
+        self.assertEqual(self.fake.token_requests, 2)
+
+    def test_injected_latency_and_errors(self):
+        with FakeStrava(page_delay=0.05, error_rate=1, error_status=502) as fake, \
+                mock.patch('pystrava.pystrava.SITE', fake.url):
+            started = time.monotonic()
+            authenticator = build_authenticator()
+            self.assertGreaterEqual(time.monotonic() - started, 0.05 * 3)
+            response = authenticator._session.get(f'{fake.url}/api/v3/athlete')
+            authenticator.close()
+        self.assertEqual(response.status_code, 502)
+
+    def test_profiled_login(self):
+        self.fake.page_delay = 0.02
+        authenticator = build_authenticator(profile=AuthProfiler(cprofile=True))
+        authenticator.close()
+        report = authenticator.profiler.report
+        self.assertEqual([timing.phase for timing in report],
+                         ['login_page', 'login_session', 'accept_application',
+                          'exchange_token'])
+        for timing in report:
+            self.assertEqual(timing.requests, 1)
+            self.assertGreaterEqual(timing.wall, timing.network + timing.parse)
+        self.assertGreaterEqual(report[0].network, 0.02)
+        self.assertGreater(report[0].parse, 0)
+        self.assertGreater(report[0].bytes_in, 0)
+        self.assertGreater(report[1].bytes_out, 0)
+        self.assertEqual(authenticator.profiler.total.requests, 4)
+        self.assertIn('login_page', authenticator.profiler.format_report())
+        self.assertIn('_accept_application', authenticator.profiler.stats())
+        self.assertEqual(authenticator._session.hooks['response'], [])
+
+    def test_client_from_refresh_token(self):
+        strava = Strava.from_refresh_token('1', 'secret', 'refresh-0')
+        self.assertEqual(strava.authenticator.token.access_token, 'access-1')
+        self.assertEqual((self.fake.token_requests, self.fake.sessions), (1, set()))
+        response = strava.authenticator._session.get(f'{self.fake.url}/api/v3/athlete')
+        self.assertEqual(response.json()['firstname'], 'Fake')
+        strava.authenticator.close()
+
+    def test_refresh_token_clients_share_a_store_per_athlete(self):
+        store = MemoryTokenStore()
+        first = StravaAuthenticator.from_refresh_token('1', 'secret', 'refresh-a',
+                                                       token_store=store)
+        second = StravaAuthenticator.from_refresh_token('1', 'secret', 'refresh-b',
+                                                        token_store=store)
+        again = StravaAuthenticator.from_refresh_token('1', 'secret', 'refresh-a',
+                                                       token_store=store)
+        self.assertEqual(self.fake.token_requests, 2)
+        self.assertNotEqual(first.token, second.token)
+        self.assertEqual(again.token, first.token)
+        self.assertNotIn('None', first._key)
+        for authenticator in (first, second, again):
+            authenticator.close()
+
+    def test_shared_state_requires_an_identity(self):
+        with self.assertRaises(ValueError):
+            StravaAuthenticator('1', 'secret', 'http://localhost.local/callback', 'read',
+                                None, None, lazy=True, background=False,
+                                token_store=MemoryTokenStore())
+
+    def test_refused_refresh_token(self):
+        self.fake.revoked_refresh_tokens.add('revoked')
+        with self.assertRaises(ValueError):
+            StravaAuthenticator.from_refresh_token('1', 'secret', 'revoked')
+        authenticator = build_authenticator(refresh_token='revoked')
+        self.assertEqual(len(self.fake.sessions), 1)
+        self.assertEqual(authenticator.token.access_token, 'access-1')
+        authenticator.close()
+
+    def test_lazy_authentication_in_the_background(self):
+        self.fake.page_delay = 0.1
+        started = time.monotonic()
+        strava = Strava('1', 'secret', 'http://localhost.local/callback', 'read',
+                        'athlete@example.com', 'password', lazy=True)
+        self.assertLess(time.monotonic() - started, 0.1)
+        self.assertFalse(strava.authenticator.authenticated)
+        response = strava.authenticator._session.get(f'{self.fake.url}/api/v3/athlete')
+        self.assertEqual(response.json()['firstname'], 'Fake')
+        self.assertTrue(strava.authenticator.authenticated)
+        self.assertEqual(strava.authenticator.token.access_token, 'access-1')
+        strava.authenticator.close()
+
+    def test_lazy_authentication_on_first_use(self):
+        authenticator = build_authenticator(lazy=True, background=False)
+        self.assertEqual((self.fake.sessions, self.fake.token_requests), (set(), 0))
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(
+                lambda _: authenticator._session.get(f'{self.fake.url}/api/v3/athlete'),
+                range(8)))
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(self.fake.token_requests, 1)
+        self.assertEqual(len(self.fake.sessions), 1)
+        authenticator.close()
+
+    def test_warmed_up_connection_is_used_by_the_login(self):
+        connections = self.fake.connections
+        authenticator = build_authenticator(lazy=True, background=False)
+        authenticator.warm_up()
+        self.assertEqual(self.fake.connections, connections + 1)
+        authenticator.authenticate()
+        self.assertEqual(self.fake.connections, connections + 1)
+        authenticator.close()
+
+    def test_failed_lazy_authentication_is_raised_on_use(self):
+        authenticator = build_authenticator(password='wrong', lazy=True)
+        with self.assertRaises(ValueError):
+            authenticator._session.get(f'{self.fake.url}/api/v3/athlete')
+        self.assertFalse(authenticator.authenticated)
+
+    def test_stored_web_session_skips_the_login(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = FileCookieStore(os.path.join(directory, 'cookies.json'))
+            build_authenticator(cookie_store=store).close()
+            self.assertEqual(len(self.fake.sessions), 1)
+            with mock.patch.object(StravaAuthenticator, '_login_session') as login:
+                authenticator = build_authenticator(cookie_store=store)
+            login.assert_not_called()
+            self.assertEqual(authenticator.token.access_token, 'access-2')
+            authenticator.close()
+
+            self.fake.sessions.clear()
+            authenticator = build_authenticator(cookie_store=store)
+            self.assertEqual(authenticator.token.access_token, 'access-3')
+            self.assertEqual(len(self.fake.sessions), 1)
+            self.assertIsNotNone(store.load(token_key(authenticator.user)))
+            authenticator.close()
+            self.assertIsNone(FileCookieStore(store.path, max_age=0)
+                              .load(token_key(authenticator.user)))
+
+    def test_bulk_bootstrap(self):
+        self.fake.token_delay = 0.2
+        credentials = [(f'athlete{index}@example.com', 'password') for index in range(8)]
+        self.fake.accounts.update(credentials)
+        pool = StravaPool('1', 'secret', 'http://localhost.local/callback', 'read',
+                          pool_maxsize=8)
+        started = time.monotonic()
+        result = pool.bootstrap(credentials + [('athlete@example.com', 'wrong')],
+                                max_workers=8)
+        elapsed = time.monotonic() - started
+        pool.close()
+        self.assertLess(elapsed, 0.2 * 4)
+        self.assertEqual(list(result.clients), [email for email, _ in credentials])
+        self.assertEqual(list(result.failures), ['athlete@example.com'])
+        self.assertIsInstance(result.failures['athlete@example.com'], ValueError)
+        self.assertEqual(len({client.authenticator.token.access_token
+                              for client in result.clients.values()}), 8)
+
+    def test_async_wrong_password(self):
+        async def run():
+            await AsyncStrava.login('1', 'secret', 'http://localhost.local/callback',
+                                    'read', 'athlete@example.com', 'wrong')
+
+        with self.assertRaises(ValueError):
+            asyncio.run(run())
+
+
+class TestRateLimiter(TestCase):
+
+    def test_budget_is_read_from_headers(self):
+        with FakeStrava() as fake, mock.patch('pystrava.pystrava.SITE', fake.url):
+            strava = Strava('1', 'secret', 'http://localhost.local/callback', 'read',
+                            'athlete@example.com', 'password')
+            for _ in range(3):
+                strava.authenticator._session.get(f'{fake.url}/api/v3/athlete')
+            strava.authenticator.close()
+        state = strava.rate_limit
+        self.assertEqual((state.short_limit, state.short_usage), (600, 3))
+        self.assertEqual((state.long_limit, state.long_usage), (30000, 3))
+        self.assertGreater(state.long_reset, state.short_reset)
+
+    def test_requests_are_paced_after_the_burst(self):
+        limiter = RateLimiter(burst=2)
+        limiter.update({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '0,0'})
+        self.assertEqual(limiter._reserve(), 0)
+        self.assertEqual(limiter._reserve(), 0)
+        self.assertGreater(limiter._reserve(), 0)
+        self.assertEqual(limiter.state.short_usage, 2)
+
+    def test_exhausted_budget_waits_for_the_reset(self):
+        limiter = RateLimiter()
+        limiter.update({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '100,200'})
+        self.assertAlmostEqual(limiter._reserve(), limiter.state.short_reset - time.time(),
+                               delta=1)
+
+    def test_without_pacing_requests_are_only_counted(self):
+        limiter = RateLimiter(pace=False)
+        limiter.update({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '100,200'})
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertEqual(limiter.state.short_usage, 101)
+
+    def test_waiting_for_budget_ignores_pacing(self):
+        limiter = RateLimiter(pace=False)
+        limiter.update({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '100,200'})
+        reset = {'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '0,200'}
+        with mock.patch('pystrava.ratelimit.time.sleep',
+                        side_effect=lambda _: limiter.update(reset)) as sleep:
+            self.assertGreater(limiter.wait_for_budget(), 0)
+        sleep.assert_called_once()
+        self.assertEqual(limiter.wait_for_budget(), 0)
+
+
+class TestSharedState(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'state.sqlite')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_workers_refresh_an_expired_token_once(self):
+        with FakeStrava(token_delay=0.05) as fake, \
+                mock.patch('pystrava.pystrava.SITE', fake.url):
+            token = Token(**fake.issue_token({}))
+            # every worker has its own store connection, as separate processes
+            workers = [build_logged_in_authenticator(token,
+                                                     token_store=SqliteStateStore(self.path))
+                       for _ in range(8)]
+            fake.expire_tokens()
+            with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+                responses = list(executor.map(
+                    lambda worker: worker._session.get(f'{fake.url}/api/v3/athlete'),
+                    workers))
+            self.assertEqual([response.status_code for response in responses],
+                             [200] * len(workers))
+            self.assertEqual(fake.token_requests, 2)
+            self.assertEqual({worker.token for worker in workers},
+                             {SqliteStateStore(self.path).load('1:athlete@example.com')})
+
+    def test_refresh_lease_only_blocks_its_own_key(self):
+        holder = SqliteStateStore(self.path)
+        other = SqliteStateStore(self.path, timeout=0.2)
+        token = build_token()
+        with holder.lock('1:first@example.com'):
+            started = time.monotonic()
+            with other.lock('1:second@example.com'):
+                other.save('1:second@example.com', token)
+            other.rate_limiter('1', pace=False).acquire()
+            self.assertLess(time.monotonic() - started, 0.2)
+            with self.assertRaises(LockTimeoutError):
+                with other.lock('1:first@example.com'):
+                    pass
+        with other.lock('1:first@example.com'):
+            self.assertEqual(holder.load('1:second@example.com'), token)
+
+    def test_expired_lease_is_taken_over(self):
+        crashed = SqliteStateStore(self.path, lease_duration=0.05)
+        crashed._claim('1:athlete@example.com')
+        with SqliteStateStore(self.path, timeout=1).lock('1:athlete@example.com'):
+            pass
+
+    def test_async_workers_refresh_an_expired_token_once(self):
+        async def run(fake, token):
+            workers = [AsyncStravaAuthenticator('1', 'secret', 'http://localhost.local/callback',
+                                                'read', 'athlete@example.com', 'password',
+                                                token_store=SqliteStateStore(self.path))
+                       for _ in range(4)]
+            for worker in workers:
+                worker._token = token
+            try:
+                responses = await asyncio.gather(*[
+                    worker.request('GET', f'{fake.url}/api/v3/athlete') for worker in workers])
+            finally:
+                for worker in workers:
+                    await worker.close()
+            return [response.status for response in responses], workers
+
+        with FakeStrava(token_delay=0.05) as fake, \
+                mock.patch('pystrava.aio.SITE', fake.url):
+            token = Token(**fake.issue_token({}))
+            SqliteStateStore(self.path).save('1:athlete@example.com', token)
+            fake.expire_tokens()
+            statuses, workers = asyncio.run(run(fake, token))
+        self.assertEqual(statuses, [200] * 4)
+        self.assertEqual(fake.token_requests, 2)
+        self.assertEqual({worker.token for worker in workers},
+                         {SqliteStateStore(self.path).load('1:athlete@example.com')})
+
+    def test_file_is_readable_by_the_user_only(self):
+        umask = os.umask(0o022)
+        try:
+            SqliteStateStore(self.path).save('1:athlete@example.com', build_token())
+        finally:
+            os.umask(umask)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_rate_limit_budget_is_shared(self):
+        first = SqliteStateStore(self.path).rate_limiter('1', pace=False)
+        second = SqliteStateStore(self.path).rate_limiter('1', pace=False)
+        first.update({'X-RateLimit-Limit': '600,30000', 'X-RateLimit-Usage': '10,20'})
+        second.acquire()
+        first.acquire()
+        self.assertEqual(second.state.short_limit, 600)
+        self.assertEqual((first.state.short_usage, first.state.long_usage), (12, 22))
+
+    def test_pacing_is_shared(self):
+        first = SqliteStateStore(self.path).rate_limiter('1', burst=2)
+        second = SqliteStateStore(self.path).rate_limiter('1', burst=2)
+        first.update({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '0,0'})
+        with first._transaction():
+            self.assertEqual(first._reserve(), 0)
+        with second._transaction():
+            self.assertEqual(second._reserve(), 0)
+            self.assertGreater(second._reserve(), 0)
+
+
+class TestCsrfToken(TestCase):
+
+    def test_token_split_across_chunks(self):
+        page = (b'<html><head><meta charset="utf-8">'
+                b'<meta name="csrf-token" content="a+b/c==" /></head><body>')
+        scanner = CsrfTokenScanner()
+        finished = [scanner.feed(page[index:index + 7]) for index in range(0, len(page), 7)]
+        self.assertEqual(scanner.token, 'a+b/c==')
+        self.assertIn(True, finished)
+        self.assertLess(len(scanner.buffer), len(page))
+
+    def test_attribute_order_and_entities(self):
+        page = "<head><meta content='a&amp;b' name='csrf-token'></head>"
+        self.assertEqual(find_csrf_token(page), 'a&b')
+
+    def test_scan_stops_at_the_end_of_the_head(self):
+        scanner = CsrfTokenScanner()
+        self.assertTrue(scanner.feed(b'<head><title>x</title></head><body>'))
+        self.assertIsNone(scanner.token)
+
+    def test_full_parse_fallback(self):
+        page = '<head></head><body><meta name="csrf-token" content="late"></body>'
+        self.assertEqual(find_csrf_token(page), 'late')
+
+    def test_missing_token(self):
+        with self.assertRaises(ValueError):
+            find_csrf_token('<html><head></head><body></body></html>')
+
+
+class TestLazyImports(TestCase):
+
+    def loaded_modules(self, statement):
+        code = (f'{statement}\nimport sys\n'
+                'print(" ".join(name for name in ("requests", "stravalib", "bs4", "aiohttp")'
+                ' if name in sys.modules))')
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=os.path.dirname(os.path.dirname(__file__)),
+                                         universal_newlines=True)
+        return output.split()
+
+    def test_import_loads_no_heavy_dependency(self):
+        self.assertEqual(self.loaded_modules('import pystrava\npystrava.Token'), [])
+
+    def test_dependencies_load_on_first_use(self):
+        self.assertEqual(self.loaded_modules('from pystrava import StravaAuthenticator'),
+                         ['requests'])
+        self.assertIn('stravalib', self.loaded_modules('from pystrava import StravaClient'))
+
+    def test_star_import_exports_the_lazy_names(self):
+        code = ('from pystrava import *\n'
+                'print(Strava.__name__, StravaAuthenticator.__name__, Token.__name__, '
+                'FileTokenStore.__name__, SITE)')
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=os.path.dirname(os.path.dirname(__file__)),
+                                         universal_newlines=True)
+        self.assertEqual(output.split(), ['Strava', 'StravaAuthenticator', 'Token',
+                                          'FileTokenStore', 'https://www.strava.com'])
+
+
+class TestConnectionPool(TestCase):
+
+    def setUp(self):
+        self.fake = FakeStrava().start()
+        self.site = mock.patch('pystrava.pystrava.SITE', self.fake.url)
+        self.site.start()
+
+    def tearDown(self):
+        self.site.stop()
+        self.fake.stop()
+
+    def fetch_concurrently(self, authenticator, requests):
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(lambda _: authenticator._session.get(
+                f'{self.fake.url}/api/v3/athlete'), range(requests)))
+
+    def test_blocking_pool_never_exceeds_its_size(self):
+        authenticator = build_authenticator(pool_maxsize=4, pool_block=True)
+        self.fetch_concurrently(authenticator, 64)
+        stats, = authenticator.connection_stats
+        self.assertEqual(stats.host, self.fake.url)
+        self.assertLessEqual(stats.connections, 4)
+        self.assertEqual(stats.maxsize, 4)
+        self.assertEqual(stats.in_use, 0)
+        self.assertGreaterEqual(stats.requests, 64)
+        authenticator.close()
+
+    def test_connections_are_not_reused_without_keep_alive(self):
+        authenticator = build_authenticator(keep_alive=False)
+        connections = self.fake.connections
+        for _ in range(3):
+            authenticator._session.get(f'{self.fake.url}/api/v3/athlete')
+        self.assertEqual(self.fake.connections - connections, 3)
+        authenticator.close()
+
+    def test_connections_are_reused_with_keep_alive(self):
+        authenticator = build_authenticator()
+        connections = self.fake.connections
+        for _ in range(3):
+            authenticator._session.get(f'{self.fake.url}/api/v3/athlete')
+        self.assertEqual(self.fake.connections - connections, 0)
+        authenticator.close()
+
+
+class TestResponseCache(TestCase):
+
+    def setUp(self):
+        self.fake = FakeStrava().start()
+        self.site = mock.patch('pystrava.pystrava.SITE', self.fake.url)
+        self.site.start()
+
+    def tearDown(self):
+        self.site.stop()
+        self.fake.stop()
+
+    def get(self, authenticator, path, **kwargs):
+        return authenticator._session.get(f'{self.fake.url}/api/v3{path}', **kwargs)
+
+    def test_fresh_responses_are_served_from_memory(self):
+        authenticator = build_authenticator(cache=ResponseCache())
+        first = self.get(authenticator, '/athlete')
+        second = self.get(authenticator, '/athlete')
+        self.assertEqual(self.fake.api_requests, 1)
+        self.assertEqual(second.json(), first.json())
+        self.assertNotEqual(self.get(authenticator, '/athlete', params={'page': 2}).json(),
+                            None)
+        self.assertEqual(self.fake.api_requests, 2)
+        stats = authenticator.cache.stats
+        self.assertEqual((stats.hits, stats.misses, stats.entries), (1, 2, 2))
+        self.assertEqual(stats.bytes_saved, len(first.content))
+
+    def test_stale_responses_are_revalidated(self):
+        authenticator = build_authenticator(cache=ResponseCache(ttls={}))
+        first = self.get(authenticator, '/activities/7')
+        second = self.get(authenticator, '/activities/7')
+        self.assertEqual(self.fake.api_requests, 2)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+        stats = authenticator.cache.stats
+        self.assertEqual((stats.revalidations, stats.misses), (1, 1))
+        self.assertEqual(stats.hit_ratio, 0.5)
+
+    def test_evicted_entries_are_requested_again_on_not_modified(self):
+        cache = ResponseCache(ttls={})
+        authenticator = build_authenticator(cache=cache)
+        first = self.get(authenticator, '/activities/7')
+        lookup = cache.lookup
+
+        def lookup_then_evict(key):
+            result = lookup(key)
+            cache.invalidate()
+            return result
+
+        with mock.patch.object(cache, 'lookup', side_effect=lookup_then_evict):
+            second = self.get(authenticator, '/activities/7')
+        self.assertEqual(self.fake.api_requests, 3)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(cache.stats.entries, 1)
+
+    def test_writes_invalidate_the_cached_resource(self):
+        cache = ResponseCache()
+        authenticator = build_authenticator(cache=cache)
+        self.get(authenticator, '/activities/7')
+        self.get(authenticator, '/activities/8')
+        authenticator._session.put(f'{self.fake.url}/api/v3/activities/7',
+                                   data={'name': 'Renamed'})
+        self.assertEqual(self.get(authenticator, '/activities/7').json()['name'], 'Renamed')
+        self.get(authenticator, '/activities/8')
+        self.assertEqual(self.fake.api_requests, 4)
+        self.assertEqual(cache.stats.hits, 1)
+
+    def test_least_recently_used_responses_are_evicted(self):
+        cache = ResponseCache(max_bytes=5000)
+        authenticator = build_authenticator(cache=cache)
+        for activity_id in (1, 2, 3, 1):
+            self.get(authenticator, f'/activities/{activity_id}')
+        self.get(authenticator, '/activities/4')
+        self.assertLessEqual(cache.stats.size, 5000)
+        self.get(authenticator, '/activities/1')
+        self.assertEqual(cache.stats.hits, 2)
+        self.get(authenticator, '/activities/2')
+        self.assertEqual(cache.stats.hits, 2)
+
+
+class TestRetryPolicy(TestCase):
+
+    def setUp(self):
+        self.fake = FakeStrava().start()
+        self.site = mock.patch('pystrava.pystrava.SITE', self.fake.url)
+        self.site.start()
+        self.sleep = mock.patch('pystrava.pystrava.time.sleep')
+        self.sleeps = self.sleep.start()
+
+    def tearDown(self):
+        self.sleep.stop()
+        self.site.stop()
+        self.fake.stop()
+
+    def test_transient_errors_are_retried(self):
+        policy = RetryPolicy(max_retries=3)
+        authenticator = build_authenticator(retry_policy=policy)
+        self.fake.fail_next(503, count=2)
+        response = authenticator._session.get(f'{self.fake.url}/api/v3/athlete')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(policy.retries, 2)
+        for (delay,), _ in self.sleeps.call_args_list:
+            self.assertLessEqual(delay, 30)
+
+    def test_retry_after_is_honoured(self):
+        authenticator = build_authenticator(retry_policy=RetryPolicy())
+        self.fake.fail_next(429, headers={'Retry-After': '7'})
+        response = authenticator._session.get(f'{self.fake.url}/api/v3/athlete')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(mock.call(7.0), self.sleeps.call_args_list)
+
+    def test_rate_limited_requests_wait_for_the_window_reset(self):
+        policy = RetryPolicy()
+        authenticator = build_authenticator(retry_policy=policy)
+        self.fake.fail_next(429, count=2)
+        with mock.patch.object(authenticator.rate_limiter, 'exhausted_for',
+                               side_effect=[12, 600]):
+            response = authenticator._session.get(f'{self.fake.url}/api/v3/athlete')
+        self.assertEqual(response.status_code, 429)
+        # the fake server sleeps its zero API delay through the same mock
+        self.assertEqual([call for call in self.sleeps.call_args_list if call != mock.call(0)],
+                         [mock.call(12)])
+        self.assertEqual(policy.retries, 1)
+
+    def test_non_idempotent_methods_are_not_retried(self):
+        policy = RetryPolicy()
+        authenticator = build_authenticator(retry_policy=policy)
+        self.fake.fail_next(503)
+        response = authenticator._session.post(f'{self.fake.url}/api/v3/activities')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(policy.retries, 0)
+
+    def test_retries_stop_when_the_budget_is_spent(self):
+        policy = RetryPolicy(max_retries=5,
+                             budget=RetryBudget(ratio=0, min_per_second=0, capacity=2))
+        authenticator = build_authenticator(retry_policy=policy)
+        self.fake.fail_next(500, count=10)
+        response = authenticator._session.get(f'{self.fake.url}/api/v3/athlete')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual((policy.retries, policy.budget_exhausted), (2, 1))
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('12'), 12)
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertAlmostEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+
+
+class TestCircuitBreaker(TestCase):
+
+    def setUp(self):
+        self.fake = FakeStrava().start()
+        self.site = mock.patch('pystrava.pystrava.SITE', self.fake.url)
+        self.site.start()
+        self.transitions = []
+        self.breaker = CircuitBreaker(window=4, min_calls=4, open_timeout=0.05)
+        self.breaker.add_listener(lambda old, new: self.transitions.append((old, new)))
+        self.authenticator = build_authenticator(circuit_breaker=self.breaker)
+
+    def tearDown(self):
+        self.authenticator.close()
+        self.site.stop()
+        self.fake.stop()
+
+    def get(self):
+        return self.authenticator._session.get(f'{self.fake.url}/api/v3/athlete')
+
+    def test_circuit_opens_fails_fast_and_recovers(self):
+        self.fake.fail_next(503, count=2)
+        for _ in range(4):
+            self.get()
+        self.assertEqual(self.breaker.state, 'open')
+        requests = self.fake.api_requests
+        with self.assertRaises(CircuitOpenError):
+            self.get()
+        self.assertEqual(self.fake.api_requests, requests)
+        time.sleep(0.06)
+        self.assertEqual(self.get().status_code, 200)
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertEqual(self.transitions, [('closed', 'open'), ('open', 'half_open'),
+                                            ('half_open', 'closed')])
+        self.assertEqual(self.breaker.stats.rejected, 1)
+
+    def test_failed_trial_reopens_the_circuit(self):
+        self.fake.fail_next(500, count=5)
+        for _ in range(4):
+            self.get()
+        time.sleep(0.06)
+        self.assertEqual(self.get().status_code, 500)
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertEqual(self.transitions[-1], ('half_open', 'open'))
+
+    def test_unexpected_errors_settle_the_trial(self):
+        self.fake.fail_next(500, count=4)
+        for _ in range(4):
+            self.get()
+        time.sleep(0.06)
+        with mock.patch.object(self.authenticator._session, 'original_request',
+                               side_effect=ChunkedEncodingError('truncated body')):
+            with self.assertRaises(ChunkedEncodingError):
+                self.get()
+        self.assertEqual(self.breaker.state, 'open')
+        time.sleep(0.06)
+        self.assertEqual(self.get().status_code, 200)
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_failing_rate_limiter_keeps_the_trial(self):
+        self.fake.fail_next(500, count=4)
+        for _ in range(4):
+            self.get()
+        time.sleep(0.06)
+        with mock.patch.object(self.authenticator.rate_limiter, 'acquire',
+                               side_effect=sqlite3.OperationalError('database is locked')):
+            with self.assertRaises(sqlite3.OperationalError):
+                self.get()
+        self.assertEqual(self.get().status_code, 200)
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_slow_calls_open_the_circuit(self):
+        breaker = CircuitBreaker(slow_call_duration=0.5, window=4, min_calls=4)
+        for duration in (0.1, 0.6, 0.1, 0.7):
+            breaker.before_call()
+            breaker.record(True, duration)
+        self.assertEqual(breaker.stats.state, 'open')
+        self.assertEqual(breaker.stats.slow_call_rate, 0.5)
+
+
+class TestRequestCoalescer(TestCase):
+
+    def test_identical_concurrent_gets_share_one_round_trip(self):
+        with FakeStrava(api_delay=0.3) as fake, \
+                mock.patch('pystrava.pystrava.SITE', fake.url):
+            authenticator = build_authenticator(coalescer=RequestCoalescer())
+            threads = 16
+            barrier = threading.Barrier(threads)
+
+            def fetch(path):
+                barrier.wait()
+                return authenticator._session.get(f'{fake.url}/api/v3{path}')
+
+            paths = ['/athlete'] * (threads - 1) + ['/activities/1']
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                responses = list(executor.map(fetch, paths))
+            self.assertEqual(fake.api_requests, 2)
+            authenticator.close()
+        self.assertEqual({response.json()['firstname'] for response in responses[:-1]},
+                         {'Fake'})
+        self.assertEqual(responses[-1].json()['id'], 1)
+        self.assertEqual(authenticator.coalescer.stats, (threads, threads - 2, 0))
+
+    def test_errors_are_shared(self):
+        coalescer = RequestCoalescer()
+        started, release = threading.Event(), threading.Event()
+
+        def fail():
+            started.set()
+            release.wait()
+            raise ValueError('boom')
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(coalescer.request, 'key', fail)
+            started.wait()
+            follower = executor.submit(coalescer.request, 'key', fail)
+            while coalescer.stats.coalesced == 0:
+                time.sleep(0.01)
+            release.set()
+        for future in (leader, follower):
+            with self.assertRaises(ValueError):
+                future.result()
+
+
+class TestBatch(TestCase):
+
+    def test_results_keep_order_and_isolate_errors(self):
+        with FakeStrava(api_delay=0.05) as fake, \
+                mock.patch('pystrava.pystrava.SITE', fake.url):
+            strava = Strava('1', 'secret', 'http://localhost.local/callback', 'read',
+                            'athlete@example.com', 'password')
+
+            def get_activity(activity_id):
+                if activity_id == 3:
+                    raise ValueError('no such activity')
+                url = f'{fake.url}/api/v3/activities/{activity_id}'
+                return strava.authenticator._session.get(url).json()['id']
+
+            started = time.monotonic()
+            results = strava.batch(get_activity, range(8), max_workers=8)
+            elapsed = time.monotonic() - started
+            strava.authenticator.close()
+        self.assertLess(elapsed, 0.05 * 7)
+        self.assertEqual([result.item for result in results], list(range(8)))
+        self.assertEqual([result.result for result in results],
+                         [0, 1, 2, None, 4, 5, 6, 7])
+        self.assertIsInstance(results[3].error, ValueError)
+        self.assertEqual(results[0], BatchResult(0, 0, None))
+
+    def test_async_batch(self):
+        class Client(AsyncStrava):
+            async def get_activity(self, activity_id):
+                if activity_id == 1:
+                    raise ValueError('no such activity')
+                return {'id': activity_id}
+
+        authenticator = AsyncStravaAuthenticator('1', 'secret', 'http://localhost.local/callback',
+                                                 'read', 'athlete@example.com', 'password')
+        results = asyncio.run(Client(authenticator).batch('get_activity', [2, 1, 0],
+                                                          concurrency=2))
+        self.assertEqual([result.result for result in results], [{'id': 2}, None, {'id': 0}])
+        self.assertIsInstance(results[1].error, ValueError)
+
+    def test_async_rate_limiter_does_not_block_the_loop(self):
+        authenticator = AsyncStravaAuthenticator('1', 'secret', 'http://localhost.local/callback',
+                                                 'read', 'athlete@example.com', 'password')
+
+        def reserve():
+            time.sleep(0.2)
+            return 0
+
+        async def run():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            ticker = asyncio.ensure_future(tick())
+            await asyncio.sleep(0)
+            await authenticator._acquire()
+            ticker.cancel()
+            return ticks
+
+        with mock.patch.object(authenticator.rate_limiter, 'reserve', side_effect=reserve):
+            self.assertGreater(asyncio.run(run()), 5)
+
+    def test_async_batch_waits_for_budget(self):
+        class Client(AsyncStrava):
+            async def get_activity(self, activity_id):
+                return {'id': activity_id}
+
+        authenticator = AsyncStravaAuthenticator('1', 'secret', 'http://localhost.local/callback',
+                                                 'read', 'athlete@example.com', 'password')
+        limiter = authenticator.rate_limiter
+        limiter.update({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '100,200'})
+        delays = []
+
+        async def sleep(delay):
+            delays.append(delay)
+            limiter.update({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '0,200'})
+
+        with mock.patch('pystrava.aio.asyncio.sleep', sleep):
+            results = asyncio.run(Client(authenticator).batch('get_activity', [1, 2]))
+        self.assertEqual([result.result for result in results], [{'id': 1}, {'id': 2}])
+        # both calls may find the budget used up before either sleeps
+        self.assertIn(len(delays), (1, 2))
+        for delay in delays:
+            self.assertGreater(delay, 0)
+
+
+class FakeActivityListing:
+    """Stands in for stravalib's protocol.get on /athlete/activities."""
+
+    def __init__(self, count, delay=0.02):
+        self.starts = [1500000000 + index * 3600 for index in range(count)]
+        self.delay = delay
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def get(self, url, check_for_errors=True, page=1, per_page=200, before=None,
+            after=None):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        starts = [start for start in reversed(self.starts)
+                  if (before is None or start < before) and (after is None or start > after)]
+        with self._lock:
+            self.in_flight -= 1
+        return [{'id': start, 'start_date': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                                           time.gmtime(start))}
+                for start in starts[(page - 1) * per_page:page * per_page]]
+
+
+class TestPagination(TestCase):
+
+    def setUp(self):
+        self.listing = FakeActivityListing(1000)
+        self.client = StravaClient(build_logged_in_authenticator(build_token()))
+        self.client.protocol.get = self.listing.get
+
+    def test_pages_are_prefetched(self):
+        activities = list(self.client.iter_activities(prefetch=3, per_page=100))
+        self.assertEqual([activity.id for activity in activities],
+                         sorted(self.listing.starts, reverse=True))
+        self.assertGreater(self.listing.max_in_flight, 1)
+        self.assertLessEqual(self.listing.calls, 11 + 3)
+
+    def test_limit_stops_early(self):
+        activities = list(self.client.iter_activities(limit=150, prefetch=1, per_page=100))
+        self.assertEqual(len(activities), 150)
+        self.assertLessEqual(self.listing.calls, 3)
+
+    def test_window_slices_are_fetched_in_parallel(self):
+        after, before = self.listing.starts[100], self.listing.starts[900]
+        activities = list(self.client.iter_activities(before=build_datetime(before),
+                                                      after=build_datetime(after),
+                                                      slices=8, per_page=50))
+        self.assertEqual([activity.id for activity in activities],
+                         [start for start in reversed(self.listing.starts)
+                          if after < start < before])
+        self.assertGreater(self.listing.max_in_flight, 1)
+
+    def test_slicing_needs_a_bounded_window(self):
+        with self.assertRaises(ValueError):
+            list(self.client.iter_activities(after=build_datetime(0), slices=4))
+
+    def test_split_window_leaves_no_gap(self):
+        for after, before, slices in ((0, 11, 2), (0, 1000, 7), (5, 8, 10)):
+            covered = [second for start, end in split_window(after, before, slices)
+                       for second in range(start + 1, end)]
+            self.assertEqual(sorted(covered), list(range(after + 1, before)))
+
+
+class TestActivityStore(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = ActivityStore(os.path.join(self.directory.name, 'activities.sqlite'))
+        self.listing = FakeActivityListing(500, delay=0)
+        self.client = StravaClient(build_logged_in_authenticator(build_token()))
+        self.client.protocol.get = mock.Mock(side_effect=self.listing.get)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_sync_only_fetches_new_activities(self):
+        self.assertEqual(self.store.sync(self.client, athlete_id=1), 500)
+        self.assertEqual(self.store.watermark(1), self.listing.starts[-1])
+        self.listing.starts.extend([self.listing.starts[-1] + 60, self.listing.starts[-1] + 120])
+        self.client.protocol.get.reset_mock()
+        self.assertEqual(self.store.sync(self.client, athlete_id=1), 2)
+        _, kwargs = self.client.protocol.get.call_args
+        self.assertEqual(kwargs['after'], self.listing.starts[-3])
+        self.assertEqual(self.store.count(1), 502)
+        self.assertEqual(self.store.watermark(1), self.listing.starts[-1])
+        self.assertEqual(self.store.sync(self.client, athlete_id=1), 0)
+
+    def test_fractional_lookback_is_sent_as_an_epoch(self):
+        self.store.sync(self.client, athlete_id=1)
+        self.store.sync(self.client, athlete_id=1, lookback=90.5)
+        _, kwargs = self.client.protocol.get.call_args
+        self.assertIsInstance(kwargs['after'], int)
+        self.assertEqual(kwargs['after'], int(self.listing.starts[-1] - 90.5))
+        list(self.client.iter_activities(after=float(self.listing.starts[-2]), raw=True))
+        _, kwargs = self.client.protocol.get.call_args
+        self.assertEqual(kwargs['after'], self.listing.starts[-2])
+        self.assertIsInstance(kwargs['after'], int)
+
+    def test_reads_come_from_the_local_tables(self):
+        self.store.sync(self.client, athlete_id=1)
+        self.client.protocol.get.reset_mock()
+        after, before = self.listing.starts[10], self.listing.starts[20]
+        activities = self.store.activities(1, before=before, after=build_datetime(after))
+        self.assertEqual([activity['id'] for activity in activities],
+                         self.listing.starts[19:10:-1])
+        self.assertEqual(len(self.store.activities(1, limit=5)), 5)
+        self.assertEqual(self.store.activities(2), [])
+        self.client.protocol.get.assert_not_called()
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class TestWebhooks(TestCase):
+
+    def setUp(self):
+        self.fake = FakeStrava().start()
+        self.sites = [mock.patch(f'pystrava.{module}.SITE', self.fake.url)
+                      for module in ('pystrava', 'webhooks')]
+        for site in self.sites:
+            site.start()
+        self.receiver = WebhookReceiver('verify-me')
+        self.server = make_server('127.0.0.1', 0, self.receiver, handler_class=QuietHandler)
+        self.callback_url = f'http://127.0.0.1:{self.server.server_port}/webhook'
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for site in self.sites:
+            site.stop()
+        self.fake.stop()
+
+    def test_subscription_handshake_and_events(self):
+        subscriptions = WebhookSubscriptions('1', 'secret')
+        with self.assertRaises(HTTPError):
+            subscriptions.create(self.callback_url, 'wrong-token')
+        subscription_id = subscriptions.create(self.callback_url, 'verify-me')
+        self.assertEqual(subscriptions.list(), [{'id': subscription_id,
+                                                 'callback_url': self.callback_url}])
+        self.assertEqual(self.fake.send_event('activity', 7, 'create', 1), [200])
+        event = self.receiver.events.get_nowait()
+        self.assertEqual(event, WebhookEvent('activity', 7, 'create', 1, subscription_id,
+                                             event.event_time, {}))
+        subscriptions.delete(subscription_id)
+        self.assertEqual(subscriptions.list(), [])
+
+    def test_events_trigger_targeted_fetches(self):
+        authenticator = build_authenticator()
+        handled = []
+        dispatcher = EventDispatcher(self.receiver.events,
+                                     lambda owner_id: authenticator if owner_id == 1 else None,
+                                     lambda event, payload: handled.append((event, payload)))
+        WebhookSubscriptions('1', 'secret').create(self.callback_url, 'verify-me')
+        api_requests = self.fake.api_requests
+        self.fake.send_event('activity', 7, 'create', 1)
+        self.fake.send_event('activity', 8, 'delete', 1)
+        self.fake.send_event('activity', 9, 'create', 2)
+        self.fake.send_event('athlete', 1, 'update', 1, {'authorized': 'false'})
+        dispatcher.start().stop()
+        payloads = {(event.object_id, event.aspect_type): payload for event, payload in handled}
+        self.assertEqual(payloads[(7, 'create')]['id'], 7)
+        self.assertIsNone(payloads[(8, 'delete')])
+        self.assertIsNone(payloads[(9, 'create')])
+        self.assertIsNone(payloads[(1, 'update')])
+        self.assertEqual(self.fake.api_requests - api_requests, 1)
+        authenticator.close()
+
+    def test_update_events_bypass_the_cached_activity(self):
+        authenticator = build_authenticator(cache=ResponseCache())
+        handled = []
+        dispatcher = EventDispatcher(self.receiver.events, lambda owner_id: authenticator,
+                                     lambda event, payload: handled.append(payload))
+        WebhookSubscriptions('1', 'secret').create(self.callback_url, 'verify-me')
+        authenticator._session.get(f'{self.fake.url}/api/v3/activities/7')
+        self.fake.activity_names['7'] = 'Renamed'
+        self.fake.send_event('activity', 7, 'update', 1, {'title': 'Renamed'})
+        dispatcher.start().stop()
+        self.assertEqual(handled[0]['name'], 'Renamed')
+        authenticator.close()
+
+    def test_asgi_application(self):
+        async def call(method, query_string=b'', body=b''):
+            messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+            sent = []
+
+            async def receive():
+                return messages.pop(0)
+
+            async def send(message):
+                sent.append(message)
+
+            await self.receiver.asgi({'type': 'http', 'method': method,
+                                      'query_string': query_string}, receive, send)
+            return sent[0]['status'], sent[1]['body']
+
+        query = b'hub.mode=subscribe&hub.challenge=abc&hub.verify_token=verify-me'
+        self.assertEqual(asyncio.run(call('GET', query)), (200, b'{"hub.challenge": "abc"}'))
+        self.assertEqual(asyncio.run(call('POST', body=b'not json'))[0], 400)
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.fake = FakeStrava().start()
+        self.site = mock.patch('pystrava.pystrava.SITE', self.fake.url)
+        self.site.start()
+
+    def tearDown(self):
+        self.site.stop()
+        self.fake.stop()
+
+    def test_prometheus_exporter(self):
+        metrics = PrometheusMetrics(buckets=(0.5, 5))
+        authenticator = build_authenticator(metrics=metrics)
+        for path in ('/athlete', '/athlete', '/activities/5', '/activities/6'):
+            authenticator._session.get(f'{self.fake.url}/api/v3{path}')
+        self.fake.fail_next(503)
+        authenticator._session.get(f'{self.fake.url}/api/v3/athlete')
+        self.fake.expire_tokens()
+        authenticator._session.get(f'{self.fake.url}/api/v3/athlete')
+        authenticator._session.post(f'{self.fake.url}/api/v3/uploads', data=b'x' * 20)
+        authenticator.close()
+        text = metrics.render()
+        remaining = 600 - self.fake.api_requests
+        for line in ('pystrava_requests_total{method="GET",endpoint="/athlete",status="200"} 3',
+                     'pystrava_requests_total{method="GET",endpoint="/athlete",status="401"} 1',
+                     'pystrava_requests_total{method="GET",endpoint="/athlete",status="503"} 1',
+                     'pystrava_request_duration_seconds_count'
+                     '{method="GET",endpoint="/activities/{id}"} 2',
+                     'pystrava_request_duration_seconds_bucket'
+                     '{method="GET",endpoint="/activities/{id}",le="+Inf"} 2',
+                     'pystrava_request_bytes_total{method="POST",endpoint="/uploads"} 20',
+                     'pystrava_token_refreshes_total{success="true"} 1',
+                     f'pystrava_rate_limit_remaining{{window="short"}} {remaining}'):
+            self.assertIn(line, text.splitlines())
+        response_bytes = [line for line in text.splitlines() if line.startswith(
+            'pystrava_response_bytes_total{method="GET",endpoint="/activities/{id}"}')]
+        self.assertGreater(int(response_bytes[0].split()[-1]), 2000)
+
+    def test_callback_exporter(self):
+        samples = []
+        authenticator = build_authenticator(metrics=CallbackMetrics(on_request=samples.append))
+        authenticator._session.get(f'{self.fake.url}/api/v3/gear/b1?x=1')
+        authenticator.close()
+        self.assertEqual([(sample.method, sample.endpoint, sample.status)
+                          for sample in samples], [('GET', '/gear/{id}', 404)])
+
+    def test_failing_hooks_do_not_fail_requests(self):
+        def fail(_):
+            raise RuntimeError('exporter down')
+
+        metrics = CallbackMetrics(on_request=fail, on_refresh=fail)
+        authenticator = build_authenticator(metrics=metrics)
+        self.fake.expire_tokens()
+        with self.assertLogs('pystrava', level='ERROR'):
+            response = authenticator._session.get(f'{self.fake.url}/api/v3/athlete')
+        authenticator.close()
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalid_content_length_falls_back_to_the_body(self):
+        samples = []
+        authenticator = build_authenticator(metrics=CallbackMetrics(on_request=samples.append))
+        response = authenticator._session.get(f'{self.fake.url}/api/v3/athlete')
+        response.headers['Content-Length'] = 'many'
+        authenticator._observe_request('GET', response.url, 0.1, response)
+        authenticator.close()
+        self.assertEqual(samples[-1].bytes_in, len(response.content))